@@ -9,8 +9,11 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'final_dj_dip.settings')
+django.setup(set_prefix=False)
 
-application = get_asgi_application()
+from shop.asgi import StreamingASGIHandler  # noqa: E402 - модели доступны только после setup
+
+application = StreamingASGIHandler()
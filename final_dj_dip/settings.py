@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -19,23 +20,26 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'rest_framework',
     'rest_framework.authtoken',
     'django_filters',
     'djoser',
 
-    'shop',
+    'shop.apps.ShopConfig',
 ]
 
+# Стандартные middleware Django с теми же настройками, под ASGI они не переходят в поток на каждом запросе
 MIDDLEWARE = [
-    'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.common.CommonMiddleware',
-    'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
-    'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.middleware.QueryInstrumentationMiddleware',
+    'shop.middleware.SecurityMiddleware',
+    'shop.middleware.SessionMiddleware',
+    'shop.middleware.CommonMiddleware',
+    'shop.middleware.CsrfViewMiddleware',
+    'shop.middleware.AuthenticationMiddleware',
+    'shop.middleware.MessageMiddleware',
+    'shop.middleware.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'final_dj_dip.urls'
@@ -65,10 +69,11 @@ LOGGING = {
             'class': 'logging.StreamHandler',
         },
     },
+    # Каждый SQL-запрос в консоль больше не пишется, выборку запросов логирует shop.sql (SHOP_SQL_LOG_SAMPLE_RATE)
     'loggers': {
-        'django.db': {
+        'shop.sql': {
             'handlers': ['console'],
-            'level': "DEBUG",
+            'level': "INFO",
             'propagate': False,
         },
     },
@@ -80,11 +85,18 @@ WSGI_APPLICATION = 'final_dj_dip.wsgi.application'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'shop.authentication.CachedTokenAuthentication',
+    ],
+    # orjson, если установлен, ответ тот же, что у rest_framework.renderers.JSONRenderer
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+    'DEFAULT_PAGINATION_CLASS': 'shop.pagination.KeysetPagination',
+    'PAGE_SIZE': int(os.getenv("PAGE_SIZE", 50)),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
 
@@ -100,6 +112,23 @@ DATABASES = {
     }
 }
 
+# Файловый кэш общий для всех процессов на одной машине, locmem подойдёт только для одного процесса
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv("CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "final_dj_dip_cache")),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv("CACHE_MAX_ENTRIES", 100000))},
+    },
+    # Версии моделей отдельно от ответов: вытеснение ответов не должно сбрасывать версии, иначе сбрасывается
+    # весь кэш ответов и сдвигается Last-Modified. Ключей здесь по одному на модель, до MAX_ENTRIES не дойдёт
+    'versions': {
+        'BACKEND': os.getenv("VERSION_CACHE_BACKEND", 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv(
+            "VERSION_CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "final_dj_dip_cache_versions")),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -137,8 +166,38 @@ MEDIA_URL = "/media/"
 
 AUTH_USER_MODEL = "shop.User"
 
-
-# EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+SHOP_IMPORT_BATCH_SIZE = int(os.getenv("SHOP_IMPORT_BATCH_SIZE", 1000))
+SHOP_WORKERS = int(os.getenv("SHOP_WORKERS", 2))
+SHOP_MAX_PAGE_SIZE = int(os.getenv("SHOP_MAX_PAGE_SIZE", 500))
+
+SHOP_CACHE_ALIAS = "default"
+SHOP_VERSION_CACHE_ALIAS = "versions"
+SHOP_CACHE_TIMEOUT = int(os.getenv("SHOP_CACHE_TIMEOUT", 300))
+SHOP_LOOKUP_CACHE_SIZE = 10000
+SHOP_LOOKUP_CACHE_TTL = 300
+# Токены с пользователями в памяти процесса, повторный запрос аутентифицируется без обращения к БД
+SHOP_AUTH_CACHE_SIZE = int(os.getenv("SHOP_AUTH_CACHE_SIZE", 10000))
+SHOP_AUTH_CACHE_TTL = int(os.getenv("SHOP_AUTH_CACHE_TTL", 300))
+
+SHOP_DISK_API_URL = os.getenv(
+    "SHOP_DISK_API_URL",
+    "https://cloud-api.yandex.net/v1/disk/public/resources/download"
+)
+SHOP_DOWNLOAD_TIMEOUT = (5, 60)
+SHOP_DOWNLOAD_RETRIES = 3
+SHOP_DOWNLOAD_BACKOFF = 0.5
+SHOP_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+# Письма (активация djoser, уведомления о заказах) сначала пишутся в таблицу и уходят из фонового пула,
+# SMTP-соединение не открывается во время запроса, см. shop.mail
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "shop.mail.OutboxEmailBackend")
+SHOP_OUTBOX_EMAIL_BACKEND = os.getenv("SHOP_OUTBOX_EMAIL_BACKEND", "django.core.mail.backends.smtp.EmailBackend")
+SHOP_OUTBOX_BATCH_SIZE = 100
+SHOP_OUTBOX_MAX_ATTEMPTS = int(os.getenv("SHOP_OUTBOX_MAX_ATTEMPTS", 5))
+SHOP_OUTBOX_RETRY_DELAY = int(os.getenv("SHOP_OUTBOX_RETRY_DELAY", 60))
+# На сколько секунд пачка писем уходит из очереди на время отправки; если обработчик упал, письма вернутся
+SHOP_OUTBOX_CLAIM_TIMEOUT = int(os.getenv("SHOP_OUTBOX_CLAIM_TIMEOUT", 300))
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_PORT = 587
 # EMAIL_USE_TLS = True
@@ -153,3 +212,20 @@ DJOSER = {
     'SEND_ACTIVATION_EMAIL': True,
     'SERIALIZERS': {},
 }
+
+# Пустое значение - выбрать по БД: полнотекстовый поиск PostgreSQL или обратный индекс в таблице
+SHOP_SEARCH_BACKEND = os.getenv("SHOP_SEARCH_BACKEND", "")
+
+# Доля HTTP-запросов, для которых все SQL-запросы пишутся в лог shop.sql, 0 - выключено
+SHOP_SQL_LOG_SAMPLE_RATE = float(os.getenv("SHOP_SQL_LOG_SAMPLE_RATE", 0))
+SHOP_SQL_REPEATED_QUERY_THRESHOLD = int(os.getenv("SHOP_SQL_REPEATED_QUERY_THRESHOLD", 5))
+SHOP_SQL_STATS_WINDOW = 1000
+
+# Сколько предложений выгрузки магазина читается из БД за раз, от этого зависит память на одну выгрузку
+SHOP_EXPORT_CHUNK_SIZE = int(os.getenv("SHOP_EXPORT_CHUNK_SIZE", 2000))
+
+# До скольки строк по оценке планировщика админка считает точный COUNT(*), выше - показывает оценку
+SHOP_ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("SHOP_ADMIN_EXACT_COUNT_LIMIT", 10000))
+
+# Сколько заказов можно перевести в другой статус одним запросом
+SHOP_MAX_ORDER_TRANSITIONS = int(os.getenv("SHOP_MAX_ORDER_TRANSITIONS", 10000))
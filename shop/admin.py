@@ -3,13 +3,22 @@ from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
 from shop.models import Category, User, Shop, Product, ProductInfo, Parameter, ProductParameter, Contacts, Order, \
-    OrderItem
+    OrderItem, ImportJob, OutboxEmail, SalesRollup, ShopSalesRollup
+from shop.pagination import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Список без полного COUNT(*): число строк берётся из оценки планировщика"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class CategoryShopsInline(admin.TabularInline):
     model = Category.shops.through
     can_delete = False
     extra = 0
+    autocomplete_fields = ("category", "shop")
 
 
 class IsUserAdmin(UserAdmin):
@@ -28,6 +37,8 @@ class IsUserAdmin(UserAdmin):
 class ShopAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'user', 'state')
     list_display_links = ('name', )
+    list_select_related = ("user",)
+    search_fields = ("name",)
     inlines = (CategoryShopsInline, )
     readonly_fields = ("name", 'user', 'state', "filename", 'url')
 
@@ -35,49 +46,94 @@ class ShopAdmin(admin.ModelAdmin):
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('id', 'name',)
     list_display_links = ('name',)
+    search_fields = ("name",)
     inlines = (CategoryShopsInline, )
     readonly_fields = ("shops",)
 
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ("id", "name", "category")
     list_display_links = ("name", )
+    list_select_related = ("category",)
+    list_filter = ("category",)
     readonly_fields = ("name", "category")
 
 
-class ProductInfoAdmin(admin.ModelAdmin):
+class ProductInfoAdmin(LargeTableAdmin):
     list_display = ("id", "product", "shop", "price",)
     list_display_links = ("product", )
+    list_select_related = ("product", "shop")
+    list_filter = ("shop",)
     readonly_fields = ("product", "shop", "quantity", "price", "price_rrc", )
 
 
 class ParameterAdmin(admin.ModelAdmin):
     list_display = ("id", "name")
     list_display_links = ("name", )
+    search_fields = ("name",)
 
 
-class ProductParameterAdmin(admin.ModelAdmin):
+class ProductParameterAdmin(LargeTableAdmin):
     list_display = ("id", "product_info", "parameter")
     list_display_links = ("parameter", )
+    list_select_related = ("product_info__product", "parameter")
+    list_filter = ("parameter",)
     readonly_fields = ("product_info", "parameter", "value")
 
 
-class ContactsAdmin(admin.ModelAdmin):
+class ContactsAdmin(LargeTableAdmin):
     list_display = ("id", "user", "city", "district", "street", "house", "building", "phone", )
     list_display_links = ("user",)
+    list_select_related = ("user",)
     readonly_fields = ("id", "user", "city", "district", "street", "house", "building", "phone", )
 
 
-class OrderAdmin(admin.ModelAdmin):
-    list_display = ("id", "user", "state")
+class OrderAdmin(LargeTableAdmin):
+    list_display = ("id", "user", "state", "total_sum", "items_count")
     list_display_links = ("user",)
-    readonly_fields = ("id", "user", "created_date", "state", "contacts",)
+    list_select_related = ("user",)
+    list_filter = ("state",)
+    readonly_fields = ("id", "user", "created_date", "state", "contacts", "total_sum", "items_count")
 
 
-class OrderItemAdmin(admin.ModelAdmin):
-    list_display = ("id", "order", "quantity",)
+class OrderItemAdmin(LargeTableAdmin):
+    list_display = ("id", "order", "product_info", "quantity", "price")
     list_display_links = ("order",)
-    readonly_fields = ("id", "order", "product_info", "quantity",)
+    list_select_related = ("order__user", "product_info__product")
+    # shop - копия product_info.shop; редактируемое поле было бы <select> со всеми магазинами
+    readonly_fields = ("id", "order", "product_info", "shop", "quantity", "price")
+
+
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "shop", "mode", "state", "processed", "created_at", "finished_at")
+    list_display_links = ("shop",)
+    list_select_related = ("shop",)
+    readonly_fields = ("shop", "url", "mode", "retire_missing", "state", "processed", "inserted", "updated",
+                       "unchanged", "removed", "errors", "created_at", "started_at", "finished_at")
+
+
+class OutboxEmailAdmin(LargeTableAdmin):
+    list_display = ("id", "subject", "state", "attempts", "next_attempt_at", "sent_at")
+    list_display_links = ("subject",)
+    list_filter = ("state",)
+    readonly_fields = ("subject", "body", "html_body", "from_email", "to", "cc", "bcc", "reply_to", "headers", "state",
+                       "attempts", "last_error", "created_at", "next_attempt_at", "sent_at")
+
+
+class SalesRollupAdmin(LargeTableAdmin):
+    list_display = ("id", "day", "shop", "product_info", "units", "revenue", "orders")
+    list_display_links = ("product_info",)
+    list_select_related = ("shop", "product_info__product")
+    list_filter = ("shop",)
+    readonly_fields = ("shop", "product_info", "day", "units", "revenue", "orders")
+
+
+class ShopSalesRollupAdmin(LargeTableAdmin):
+    list_display = ("id", "day", "shop", "units", "revenue", "orders")
+    list_display_links = ("shop",)
+    list_select_related = ("shop",)
+    list_filter = ("shop",)
+    readonly_fields = ("shop", "day", "units", "revenue", "orders")
 
 
 admin.site.register(User, IsUserAdmin)
@@ -90,3 +146,7 @@ admin.site.register(ProductParameter, ProductParameterAdmin)
 admin.site.register(Contacts, ContactsAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(OrderItem, OrderItemAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
+admin.site.register(SalesRollup, SalesRollupAdmin)
+admin.site.register(ShopSalesRollup, ShopSalesRollupAdmin)
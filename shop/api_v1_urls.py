@@ -1,17 +1,32 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 
 from shop.api_v1_views import ShopsViewSet, CategoriesViewSet, ProductViewSet, CreateWithYamlViewSet, ParametersViewSet, \
-    ContactsViewSet, OrdersViewSet, ProductInfoViewSet
+    ContactsViewSet, OrdersViewSet, ProductInfoViewSet, ImportJobsViewSet, QueryStatsViewSet, \
+    RevenueReportViewSet, ProductSalesReportViewSet
+from shop.async_views import READ_VIEWSETS, async_read_view
 
 router = DefaultRouter()
 router.register("shops", ShopsViewSet, basename="all_shops")
 router.register("categories", CategoriesViewSet, basename="all_categories")
 router.register("products", ProductViewSet, basename="all_products")
 router.register("create-yml", CreateWithYamlViewSet, basename="create_yml")
+router.register("import-jobs", ImportJobsViewSet, basename="import_jobs")
 router.register("parameters", ParametersViewSet, basename="all_parameters")
 router.register("contacts", ContactsViewSet, basename="contacts")
 router.register("orders", OrdersViewSet, basename="orders")
 router.register("product-info", ProductInfoViewSet, basename="product_info")
+router.register("reports/revenue", RevenueReportViewSet, basename="revenue_report")
+router.register("reports/products", ProductSalesReportViewSet, basename="product_sales_report")
+router.register("query-stats", QueryStatsViewSet, basename="query_stats")
 
 
-urlpatterns = [] + router.urls
+# Чтение каталога для запуска под ASGI, ответы совпадают с синхронными эндпоинтами
+async_urlpatterns = []
+for prefix, viewset in READ_VIEWSETS.items():
+    async_urlpatterns += [
+        path(f"async/{prefix}/", async_read_view(viewset, {"get": "list"}), name=f"async_{prefix}-list"),
+        path(f"async/{prefix}/<int:pk>/", async_read_view(viewset, {"get": "retrieve"}), name=f"async_{prefix}-detail"),
+    ]
+
+urlpatterns = async_urlpatterns + router.urls
@@ -1,19 +1,37 @@
-from rest_framework import viewsets
-from rest_framework.exceptions import ValidationError
+from django.db.models import F, Prefetch
+from django.http import StreamingHttpResponse
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import generics, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.response import Response
-from shop.filters import ShopsFilterSet, CategoryFilterSet, ProductFilterSet, ParameterFilterSet
-from shop.models import Shop, Category, Product, Parameter, Order, ProductInfo
+from shop.cache import CachedReadMixin
+from shop.cards import build_cards, get_cards
+from shop.export import EXPORT_STREAMS, YamlExportRenderer, CsvExportRenderer, JsonLinesExportRenderer
+from shop.facets import get_facets
+from shop.fieldsets import FieldSpec
+from shop.filters import ShopsFilterSet, CategoryFilterSet, ProductFilterSet, ParameterFilterSet, ProductInfoFilterSet
+from shop.middleware import endpoint_stats
+from shop.pagination import offset_page_response
+from shop.models import User, Shop, Category, Product, Parameter, Order, ProductInfo, ProductParameter, ImportJob, \
+    FacetCount, ProductCard, OrderItem, STATE_CHOICES
+from shop.orders import seller_orders, transition_orders
+from shop.reports import revenue_report, product_sales_report
+from shop.search import get_search_backend
 from shop.serializers import ShopSerializer, CategorySerializer, ProductSerializer, YamlSerializer, ParameterSerializer, \
-    ContactsSerializer, OrderSerializer, CustomProductInfoSerializer
+    ContactsSerializer, OrderSerializer, CustomProductInfoSerializer, ImportJobSerializer, \
+    RevenueReportQuerySerializer, SellerOrderSerializer, OrderTransitionSerializer, ProductSalesReportQuerySerializer
 from rest_framework import permissions
 
 
-class ShopsViewSet(viewsets.ModelViewSet):
+class ShopsViewSet(CachedReadMixin, viewsets.ModelViewSet):
     serializer_class = ShopSerializer
     filterset_class = ShopsFilterSet
+    cache_models = (Shop, Category, User)
 
     def get_permissions(self):
-        if self.action in ["retrieve", "list", "create", "update", "delete"]:
+        if self.action in ["retrieve", "list", "create", "update", "delete", "export"]:
             return [permissions.IsAuthenticated()]
         return []
 
@@ -32,11 +50,25 @@ class ShopsViewSet(viewsets.ModelViewSet):
             raise ValidationError("Вы не являетесь владельцом магазина или суперпользователем!")
         return super(ShopsViewSet, self).destroy(request, *args, **kwargs)
 
-
-class CategoriesViewSet(viewsets.ModelViewSet):
+    @action(detail=True, renderer_classes=[YamlExportRenderer, CsvExportRenderer, JsonLinesExportRenderer])
+    def export(self, request, pk=None):
+        """Выгрузка каталога магазина в формате импорта, ?format=yaml|csv|jsonl"""
+        shop = self.get_object()
+        if not request.user.is_staff and shop.user_id != request.user.id:
+            raise PermissionDenied("Выгружать каталог может только владелец магазина")
+        # Формат уже выбран DRF по ?format=, ответ отдаётся потоком мимо рендерера
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(EXPORT_STREAMS[renderer.format](shop),
+                                         content_type=f"{renderer.media_type}; charset=utf-8")
+        response["Content-Disposition"] = f'attachment; filename="shop-{shop.pk}.{renderer.format}"'
+        return response
+
+
+class CategoriesViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     filterset_class = CategoryFilterSet
+    cache_models = (Category,)
 
     def get_permissions(self):
         if self.action in ["retrieve", "list"]:
@@ -46,23 +78,100 @@ class CategoriesViewSet(viewsets.ModelViewSet):
         return []
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.prefetch_related(
-        "category",
-        "product_info",
-        "product_info__shop",
-        "product_info__shop__user",
-        "product_info__product_parameter",
-        "product_info__product_parameter__parameter"
-    ).all()
+PRODUCT_PREFETCH = (
+    (("product_info",), "product_info", True),
+    (("product_info", "shop"), "product_info__shop", False),
+    (("product_info", "shop", "user"), "product_info__shop__user", False),
+    (("product_info", "shop", "categories"), "product_info__shop__categories", True),
+    (("product_info", "product_parameter"), "product_info__product_parameter", True),
+    (("product_info", "product_parameter", "parameter"), "product_info__product_parameter__parameter", False),
+)
+
+
+class ProductViewSet(CachedReadMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
     filterset_class = ProductFilterSet
+    cache_models = (Product, ProductInfo, ProductParameter, Parameter, Category, Shop, User, FacetCount, ProductCard)
+
+    def get_queryset(self):
+        spec = FieldSpec.from_request(self.request)
+        queryset = Product.objects.all()
+        if spec.needs_prefetch(("category",), many=False):
+            queryset = queryset.select_related("category")
+        return queryset.prefetch_related(
+            *[lookup for path, lookup, many in PRODUCT_PREFETCH if spec.needs_prefetch(path, many)]
+        )
+
+    def get_card_queryset(self):
+        """Отфильтрованные продукты с готовой карточкой: одна выборка по первичному ключу вместо шести связей"""
+        return self.filter_queryset(Product.objects.all()).values("id", card_data=F("card__data"))
+
+    def get_card_data(self, rows):
+        # Карточка может ещё не успеть собраться после коммита, такие продукты собираются на лету
+        built = build_cards([row["id"] for row in rows if row["card_data"] is None])
+        return [row["card_data"] if row["card_data"] is not None else built[row["id"]] for row in rows]
+
+    def list(self, request, *args, **kwargs):
+        if not FieldSpec.from_request(request).is_default:
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(self.card_list, request, *args, **kwargs)
+
+    def card_list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.get_card_queryset())
+        return self.get_paginated_response(self.get_card_data(page))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not FieldSpec.from_request(request).is_default:
+            return super().retrieve(request, *args, **kwargs)
+        return self.cached_response(self.card_retrieve, request, *args, **kwargs)
+
+    def card_retrieve(self, request, *args, **kwargs):
+        row = generics.get_object_or_404(self.get_card_queryset(), pk=kwargs[self.lookup_field])
+        return Response(self.get_card_data([row])[0])
 
     def get_permissions(self):
-        if self.action in ["list", "retrieve", "create", "update", "delete"]:
+        if self.action in ["list", "retrieve", "create", "update", "delete", "facets", "search"]:
             return [permissions.IsAuthenticated()]
         return []
 
+    @action(detail=False)
+    def facets(self, request):
+        """Значения параметров с количеством предложений для боковой панели фильтров"""
+        return self.cached_response(self.facet_list, request)
+
+    def facet_list(self, request):
+        category = request.query_params.get("category")
+        if category is not None and not category.isdigit():
+            raise ValidationError({"category": "Ожидается id категории"})
+        return Response(get_facets(int(category) if category is not None else None))
+
+    @action(detail=False)
+    def search(self, request):
+        """Продукты по релевантности к ?q= среди названий, категорий и значений параметров"""
+        return self.cached_response(self.search_list, request)
+
+    def search_list(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            raise ValidationError({"q": "Укажите строку поиска"})
+        paginator = self.paginator
+        limit = paginator.get_page_size(request)
+        offset = request.query_params.get("offset", "0")
+        if not offset.isdigit():
+            raise ValidationError({"offset": "Ожидается неотрицательное число"})
+        offset = int(offset)
+        # Лишний id показывает, есть ли следующая страница
+        ids = get_search_backend().search(query, limit + 1, offset)
+        has_next = len(ids) > limit
+        ids = ids[:limit]
+        if FieldSpec.from_request(request).is_default:
+            cards = get_cards(ids)
+            results = [cards[pk] for pk in ids if pk in cards]
+        else:
+            products = self.get_queryset().in_bulk(ids)
+            results = self.get_serializer([products[pk] for pk in ids if pk in products], many=True).data
+        return offset_page_response(request, results, offset, limit, has_next)
+
     def perform_create(self, serializer):
         user = self.request.user
         if "url" in self.request.data:
@@ -88,18 +197,87 @@ class CreateWithYamlViewSet(viewsets.ModelViewSet):
         get = user.users_shop.all()
         return get
 
-    def perform_create(self, serializer):
-        user = self.request.user
-        serializer.save(user=user)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save(user=request.user)
+        return Response(ImportJobSerializer(job).data, status=202)
 
     def destroy(self, request, *args, **kwargs):
         return Response("Нельзя удалить ссылку на файл или сам файл!", status=405)
 
 
-class ParametersViewSet(viewsets.ModelViewSet):
+class ImportJobsViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = ImportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [OrderingFilter]
+    ordering_fields = ("id",)
+    ordering = "-id"
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_superuser:
+            return ImportJob.objects.all()
+        return ImportJob.objects.filter(shop__user=user)
+
+
+class QueryStatsViewSet(viewsets.ViewSet):
+    """p50/p95 времени и число SQL-запросов по эндпоинтам текущего процесса сервера"""
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def list(self, request):
+        return Response(endpoint_stats.summary())
+
+    @action(detail=False, methods=["post"])
+    def reset(self, request):
+        endpoint_stats.clear()
+        return Response(status=204)
+
+
+def report_shop_ids(request, params):
+    """Магазины отчёта: продавцу только свои, админу все или выбранный в ?shop="""
+    if request.user.is_staff:
+        return [params["shop"]] if "shop" in params else None
+    shop_ids = list(Shop.objects.filter(user=request.user).values_list("id", flat=True))
+    if not shop_ids:
+        raise PermissionDenied("Отчёт доступен только продавцам и админам!")
+    return shop_ids
+
+
+class RevenueReportViewSet(viewsets.ViewSet):
+    """Выручка по магазинам и периодам: продавцу по своему магазину, админу по всем или по ?shop="""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        query = RevenueReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        shop_ids = report_shop_ids(request, params)
+        rows = revenue_report(params["period"], shop_ids, params.get("date_from"), params.get("date_to"))
+        return Response(list(rows))
+
+
+class ProductSalesReportViewSet(viewsets.ViewSet):
+    """Самые продаваемые предложения за период, доступ как у отчёта по выручке"""
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        query = ProductSalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        shop_ids = report_shop_ids(request, params)
+        rows = product_sales_report(shop_ids, params.get("date_from"), params.get("date_to"), params["limit"])
+        return Response(list(rows))
+
+
+class ParametersViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = Parameter.objects.all()
     serializer_class = ParameterSerializer
     filterset_class = ParameterFilterSet
+    cache_models = (Parameter,)
 
     def get_permissions(self):
         if self.action in ["create", "update", "delete"]:
@@ -133,6 +311,10 @@ class ContactsViewSet(viewsets.ModelViewSet):
 class ProductInfoViewSet(viewsets.ModelViewSet):
     queryset = ProductInfo.objects.all()
     serializer_class = CustomProductInfoSerializer
+    filterset_class = ProductInfoFilterSet
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    ordering_fields = ("id", "price")
+    ordering = "id"
 
     def get_permissions(self):
         if self.action in ["list", "retrieve"]:
@@ -145,9 +327,12 @@ class ProductInfoViewSet(viewsets.ModelViewSet):
 
 class OrdersViewSet(viewsets.ModelViewSet):
     serializer_class = OrderSerializer
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    ordering_fields = ("id", "created_date")
+    ordering = "-id"
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'create', 'update', 'delete']:
+        if self.action in ['list', 'retrieve', 'create', 'update', 'delete', 'seller', 'transition']:
             return [permissions.IsAuthenticated()]
         return []
 
@@ -155,12 +340,47 @@ class OrdersViewSet(viewsets.ModelViewSet):
         user = self.request.user
         serializer.save(user=user)
 
+    def destroy(self, request, *args, **kwargs):
+        # Удаление обошло бы отмену: остатки остались бы списанными, а заказ - в итогах продаж
+        return Response("Заказ нельзя удалить, его можно только отменить!", status=405)
+
     def get_queryset(self):
         user = self.request.user
         if user.is_superuser:
             return Order.objects.prefetch_related("positions", "contacts").all()
         return user.order.all()
 
+    def get_seller_shop(self):
+        shop = Shop.objects.filter(user=self.request.user).first()
+        if shop is None and not self.request.user.is_staff:
+            raise PermissionDenied("У вас нет магазина!")
+        return shop
+
+    @action(detail=False)
+    def seller(self, request):
+        """Заказы с продуктами магазина продавца, в позициях только его товары"""
+        shop = self.get_seller_shop()
+        if shop is None:
+            raise ValidationError("Лента заказов есть только у магазина")
+        orders = seller_orders(shop).select_related("contacts").prefetch_related(
+            Prefetch("positions", queryset=OrderItem.objects.filter(shop=shop)))
+        state = request.query_params.get("state")
+        if state is not None:
+            if state not in dict(STATE_CHOICES):
+                raise ValidationError({"state": "Нет такого статуса заказа"})
+            orders = orders.filter(state=state)
+        page = self.paginate_queryset(self.filter_queryset(orders))
+        return self.get_paginated_response(SellerOrderSerializer(page, many=True).data)
+
+    @action(detail=False, methods=["post"])
+    def transition(self, request):
+        """Переводит список заказов в новый статус, продавец - только заказы со своими продуктами"""
+        shop = self.get_seller_shop()
+        serializer = OrderTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = transition_orders(serializer.validated_data["orders"], serializer.validated_data["state"], shop)
+        return Response({"updated": updated, "state": serializer.validated_data["state"]})
+
 
 
 
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ShopConfig(AppConfig):
     name = 'shop'
+
+    def ready(self):
+        import shop.signals  # noqa: F401
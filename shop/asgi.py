@@ -0,0 +1,47 @@
+from asgiref.sync import sync_to_async
+from django.core.exceptions import SynchronousOnlyOperation
+from django.core.handlers.asgi import ASGIHandler
+
+
+async def run_inline(func, *args, **kwargs):
+    """Вызывает синхронную func прямо в цикле событий, а если ей нужна БД - в потоке синхронного кода
+
+    Django бросает SynchronousOnlyOperation из цикла событий до выполнения запроса, и func повторяется
+    целиком в том же потоке и соединении, где работают синхронные представления. Подходит только
+    для функций, которые до первого запроса к БД не делают ничего, что нельзя повторить.
+    """
+    try:
+        return func(*args, **kwargs)
+    except SynchronousOnlyOperation:
+        return await sync_to_async(func, thread_sensitive=True)(*args, **kwargs)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler, который читает потоковые ответы в потоке синхронного кода
+
+    Django 3.1 перебирает StreamingHttpResponse прямо в цикле событий, и генератор с запросами к БД
+    (выгрузка каталога) падает с SynchronousOnlyOperation. Здесь каждый кусок берётся через
+    sync_to_async(thread_sensitive=True), в том же потоке и соединении, где работало представление.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        headers = [
+            (header.encode("ascii") if isinstance(header, str) else header,
+             value.encode("latin1") if isinstance(value, str) else value)
+            for header, value in response.items()
+        ]
+        headers.extend((b"Set-Cookie", cookie.output(header="").encode("ascii").strip())
+                       for cookie in response.cookies.values())
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=True)
+        while True:
+            part = await next_part(parts, None)
+            if part is None:
+                break
+            for chunk, last in self.chunk_bytes(part):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
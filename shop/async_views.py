@@ -0,0 +1,46 @@
+from django.http import HttpResponse
+
+from shop.api_v1_views import ShopsViewSet, CategoriesViewSet, ProductViewSet, ParametersViewSet
+from shop.asgi import run_inline
+
+
+def rendered(view):
+    """Представление DRF, которое сразу рендерит ответ и возвращает обычный HttpResponse
+
+    У ответа с render() Django 3.1 под ASGI вызывает его в потоке синхронного кода, готовый ответ он не трогает.
+    """
+    def respond(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        if not hasattr(response, "render"):
+            return response
+        response.render()
+        plain = HttpResponse(response.content, status=response.status_code)
+        for header, value in response.items():
+            plain[header] = value
+        return plain
+    return respond
+
+
+def async_read_view(viewset, actions):
+    """Асинхронное представление только для чтения поверх ViewSet: ответ, кэш и ETag те же, что у синхронного
+
+    Асинхронного ORM в Django 3.1 нет. Токен из памяти процесса, версии моделей и ответ из кэша запросов к БД
+    не требуют, поэтому такой запрос целиком обрабатывается в цикле событий. Если нужна БД, чтение
+    повторяется в потоке синхронного кода, см. shop.asgi.run_inline. Чтение ничего не пишет, повтор безопасен.
+    """
+    respond = rendered(viewset.as_view(actions))
+
+    async def async_view(request, *args, **kwargs):
+        return await run_inline(respond, request, *args, **kwargs)
+
+    # csrf_exempt из Django 3.1 заворачивает представление в синхронную функцию, поэтому флаг ставится напрямую
+    async_view.csrf_exempt = True
+    return async_view
+
+
+READ_VIEWSETS = {
+    "shops": ShopsViewSet,
+    "categories": CategoriesViewSet,
+    "products": ProductViewSet,
+    "parameters": ParametersViewSet,
+}
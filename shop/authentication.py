@@ -0,0 +1,60 @@
+import copy
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from shop.cache import get_cache, new_version
+from shop.lookups import TTLCache
+from shop.utils import defer_on_commit
+
+token_cache = TTLCache(settings.SHOP_AUTH_CACHE_SIZE, settings.SHOP_AUTH_CACHE_TTL)
+
+
+def token_version_key(key):
+    return f"shop:token:{key}"
+
+
+def expire_tokens(keys):
+    get_cache().set_many({token_version_key(key): new_version() for key in keys}, settings.SHOP_AUTH_CACHE_TTL)
+
+
+def expire_user_tokens(user_ids):
+    expire_tokens(Token.objects.filter(user__in=list(user_ids)).values_list("key", flat=True))
+
+
+def schedule_token_expiry(keys=(), user_ids=()):
+    """Меняет версии токенов после коммита: до него другой запрос прочитал бы из БД старые данные"""
+    for key in keys:
+        token_cache.delete(key)
+    if keys:
+        defer_on_commit(expire_tokens, keys)
+    if user_ids:
+        defer_on_commit(expire_user_tokens, user_ids)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который держит токен с пользователем в памяти процесса
+
+    Повторный запрос с тем же токеном проверяет только версию токена в общем кэше, без запроса к БД.
+    Версия меняется при удалении токена и при изменении пользователя, см. shop.signals.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        version_key = token_version_key(key)
+        # Версия читается до запроса к БД, иначе изменение между ними осталось бы незамеченным
+        version = cache.get(version_key)
+        cached = token_cache.get(key)
+        if cached is not None and version is not None and cached[1] == version:
+            token = copy.deepcopy(cached[0])
+            return token.user, token
+        user, token = super().authenticate_credentials(key)
+        if version is None:
+            version = new_version()
+            # add не перезапишет версию, которую успело поставить изменение пользователя
+            if not cache.add(version_key, version, settings.SHOP_AUTH_CACHE_TTL):
+                return user, token
+        # Запросы не должны делить один объект пользователя, в кэше лежит копия
+        token_cache.set(key, (copy.deepcopy(token), version))
+        return user, token
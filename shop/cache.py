@@ -0,0 +1,100 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from shop.utils import defer_on_commit
+
+
+def get_cache():
+    return caches[settings.SHOP_CACHE_ALIAS]
+
+
+def get_version_cache():
+    return caches[settings.SHOP_VERSION_CACHE_ALIAS]
+
+
+def version_key(model):
+    return f"shop:version:{model._meta.label_lower}"
+
+
+def new_version():
+    return str(time.time_ns())
+
+
+def get_versions(models):
+    cache = get_version_cache()
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = {key: new_version() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def set_new_versions(models):
+    get_version_cache().set_many({version_key(model): new_version() for model in models}, timeout=None)
+
+
+def bump_versions(*models):
+    """Меняет версии моделей после коммита, все модели транзакции пишутся в кэш одним вызовом"""
+    defer_on_commit(set_new_versions, models)
+
+
+def response_cache_key(request, versions):
+    versions = ":".join(versions)
+    raw = f"{request.get_host()}{request.path}?{request.META.get('QUERY_STRING', '')}"
+    return f"shop:response:{hashlib.md5(raw.encode()).hexdigest()}:{hashlib.md5(versions.encode()).hexdigest()}"
+
+
+def last_modified(versions):
+    # Версия - время последнего bump_versions модели в наносекундах: записи, удаления и UPDATE мимо save()
+    # меняют её после коммита, поэтому Last-Modified берётся из кэша без запроса к БД.
+    # Last-Modified и If-Modified-Since точны до секунды
+    return int(max(int(version) for version in versions) / 1e9)
+
+
+def response_etag(request, versions):
+    raw = f"{':'.join(versions)}:{request.META.get('HTTP_ACCEPT', '')}"
+    return quote_etag(hashlib.md5(raw.encode()).hexdigest())
+
+
+class CachedReadMixin:
+    """Кэширует данные list/retrieve до следующей записи в любую из моделей cache_models
+
+    Ответы получают ETag и Last-Modified, на If-None-Match / If-Modified-Since без изменений
+    отдаётся 304 без обращения к сериализатору.
+    """
+
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, action, request, *args, **kwargs):
+        cache = get_cache()
+        versions = get_versions(self.cache_models)
+        etag = response_etag(request, versions)
+        modified = last_modified(versions)
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            key = response_cache_key(request, versions)
+            data = cache.get(key)
+            if data is not None:
+                response = Response(data)
+            else:
+                response = action(request, *args, **kwargs)
+                if response.status_code == 200:
+                    cache.set(key, response.data, settings.SHOP_CACHE_TIMEOUT)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(modified)
+        return response
@@ -1,12 +1,57 @@
+import re
 import tempfile
+import threading
+import time
+
 import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+_session = None
+_lock = threading.Lock()
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_session():
+    """Общая сессия с пулом keep-alive соединений
+
+    Повторов на уровне urllib3 нет: их делают get_download_link и download_file, иначе попытки перемножаются.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_maxsize=max(settings.SHOP_WORKERS, 10))
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def wait_before(attempt):
+    if attempt:
+        time.sleep(settings.SHOP_DOWNLOAD_BACKOFF * 2 ** (attempt - 1))
 
 
 def get_download_link(link):
-    API_ENDPOINT = "https://cloud-api.yandex.net/v1/disk/public/resources/download?public_key="
-    res = requests.get(f"{API_ENDPOINT}{link}")
-    response = res.json().get("href")
-    return response
+    for attempt in range(settings.SHOP_DOWNLOAD_RETRIES + 1):
+        wait_before(attempt)
+        try:
+            res = get_session().get(
+                settings.SHOP_DISK_API_URL,
+                params={"public_key": link},
+                timeout=settings.SHOP_DOWNLOAD_TIMEOUT
+            )
+        except (requests.ConnectionError, requests.Timeout):
+            continue
+        if res.status_code in RETRY_STATUSES:
+            continue
+        try:
+            return res.json().get("href")
+        except ValueError:
+            return None
+    return None
 
 
 def get_filename(download_link):
@@ -16,10 +61,45 @@ def get_filename(download_link):
     return False
 
 
+def get_total_size(response, downloaded):
+    if response.status_code == 206:
+        match = re.search(r"/(\d+)$", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
+    length = response.headers.get("Content-Length")
+    return downloaded + int(length) if length else None
+
+
 def download_file(file_link):
-    download = requests.get(file_link)
-    if not download:
-        return False
+    """Качает файл в NamedTemporaryFile по кускам, при обрыве докачивает через Range
+
+    Файл удаляется при закрытии, закрыть его должен вызывающий код.
+    """
     file = tempfile.NamedTemporaryFile()
-    file.write(download.content)
-    return file
+    downloaded = 0
+    for attempt in range(settings.SHOP_DOWNLOAD_RETRIES + 1):
+        wait_before(attempt)
+        headers = {"Range": f"bytes={downloaded}-"} if downloaded else {}
+        try:
+            with get_session().get(file_link, headers=headers, stream=True,
+                                   timeout=settings.SHOP_DOWNLOAD_TIMEOUT) as download:
+                if download.status_code in RETRY_STATUSES:
+                    continue
+                if not download:
+                    break
+                if downloaded and download.status_code != 206:
+                    # Сервер не поддерживает Range, качаем заново
+                    file.seek(0)
+                    file.truncate()
+                    downloaded = 0
+                total = get_total_size(download, downloaded)
+                for chunk in download.iter_content(chunk_size=settings.SHOP_DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    downloaded += len(chunk)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            continue
+        if total is None or downloaded >= total:
+            file.flush()
+            file.seek(0)
+            return file
+    file.close()
+    return False
@@ -0,0 +1,106 @@
+import csv
+import io
+import json
+
+import yaml
+from django.conf import settings
+from rest_framework import renderers
+
+from shop.models import ProductInfo, ProductParameter, Parameter
+from shop.utils import chunked
+
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+CSV_COLUMNS = ("id", "name", "category", "quantity", "price", "price_rrc")
+
+
+class ExportRenderer(renderers.JSONRenderer):
+    """Нужен только чтобы DRF принял ?format=, сама выгрузка идёт потоком мимо рендерера, а ошибки - в JSON"""
+
+
+class YamlExportRenderer(ExportRenderer):
+    media_type = "application/x-yaml"
+    format = "yaml"
+
+
+class CsvExportRenderer(ExportRenderer):
+    media_type = "text/csv"
+    format = "csv"
+
+
+class JsonLinesExportRenderer(ExportRenderer):
+    media_type = "application/x-ndjson"
+    format = "jsonl"
+
+
+def iter_catalog_chunks(shop, chunk_size=None):
+    """Продукты магазина в формате файла импорта пачками, в памяти не больше одной пачки"""
+    chunk_size = chunk_size or settings.SHOP_EXPORT_CHUNK_SIZE
+    rows = ProductInfo.objects.filter(shop=shop).order_by("id").values_list(
+        "id", "external_id", "product__name", "quantity", "price", "price_rrc", "product__category__name")
+    # prefetch_related не работает с iterator(), параметры пачки добираются одним запросом
+    for chunk in chunked(rows.iterator(chunk_size=chunk_size), chunk_size):
+        parameters = {row[0]: [] for row in chunk}
+        values = ProductParameter.objects.filter(product_info__in=list(parameters)).order_by("id").values_list(
+            "product_info_id", "parameter__name", "value")
+        for info_id, name, value in values:
+            parameters[info_id].append({"parameter": {"name": name}, "value": value})
+        items = []
+        for info_id, external_id, name, quantity, price, price_rrc, category in chunk:
+            item = {}
+            # Без external_id импорт сопоставляет продукт по имени, поэтому id не выдумываем
+            if external_id is not None:
+                item["id"] = external_id
+            item["name"] = name
+            item["product_info"] = {"quantity": quantity, "price": price, "price_rrc": price_rrc}
+            item["product_parameter"] = parameters[info_id]
+            item["category"] = {"name": category}
+            items.append(item)
+        yield items
+
+
+def stream_yaml(shop):
+    empty = True
+    for items in iter_catalog_chunks(shop):
+        empty = False
+        # Каждая пачка - кусок списка верхнего уровня, склеенные куски дают один документ
+        yield yaml.dump(items, Dumper=YamlDumper, allow_unicode=True, sort_keys=False)
+    if empty:
+        yield "[]\n"
+
+
+def stream_jsonl(shop):
+    for items in iter_catalog_chunks(shop):
+        yield "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items)
+
+
+def stream_csv(shop):
+    names = list(Parameter.objects.filter(parameter_name__product_info__shop=shop).distinct().order_by(
+        "name").values_list("name", flat=True))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow([*CSV_COLUMNS, *names])
+    yield flush()
+    for items in iter_catalog_chunks(shop):
+        for item in items:
+            info = item["product_info"]
+            values = {parameter["parameter"]["name"]: parameter["value"] for parameter in item["product_parameter"]}
+            writer.writerow([
+                item.get("id", ""), item["name"], item["category"]["name"], info["quantity"], info["price"],
+                info["price_rrc"], *[values.get(name, "") for name in names]
+            ])
+        yield flush()
+
+
+EXPORT_STREAMS = {
+    "yaml": stream_yaml,
+    "csv": stream_csv,
+    "jsonl": stream_jsonl,
+}
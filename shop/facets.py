@@ -0,0 +1,150 @@
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from shop.cache import bump_versions
+from shop.models import FacetCount, Product, ProductInfo, ProductParameter
+from shop.utils import chunked, defer_on_commit
+
+UPSERT_BATCH_SIZE = 500
+
+_local = threading.local()
+
+
+def apply_facet_deltas(deltas):
+    """Прибавляет к счётчикам {(категория, параметр, значение): изменение} через INSERT ... ON CONFLICT"""
+    rows = [(*key, delta) for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+    table = connection.ops.quote_name(FacetCount._meta.db_table)
+    with connection.cursor() as cursor:
+        for chunk in chunked(rows, UPSERT_BATCH_SIZE):
+            values = ", ".join(["(%s, %s, %s, %s)"] * len(chunk))
+            cursor.execute(
+                f"INSERT INTO {table} (category_id, parameter_id, value, count) VALUES {values} "
+                f"ON CONFLICT (category_id, parameter_id, value) DO UPDATE SET count = {table}.count + excluded.count",
+                [field for row in chunk for field in row]
+            )
+    FacetCount.objects.filter(category_id__in={row[0] for row in rows}, count__lte=0).delete()
+    bump_versions(FacetCount)
+
+
+def rebuild_facets(category_ids=None):
+    """Пересчитывает счётчики категорий целиком, без category_ids - все"""
+    if category_ids is not None and not category_ids:
+        return
+    with transaction.atomic():
+        stale = FacetCount.objects.all()
+        values = ProductParameter.objects.all()
+        if category_ids is not None:
+            stale = stale.filter(category_id__in=category_ids)
+            values = values.filter(product_info__product__category_id__in=category_ids)
+        stale.delete()
+        counts = values.values("product_info__product__category_id", "parameter_id", "value").annotate(
+            total=Count("id")).order_by()
+        for chunk in chunked(counts.iterator(), UPSERT_BATCH_SIZE):
+            FacetCount.objects.bulk_create([
+                FacetCount(
+                    category_id=row["product_info__product__category_id"],
+                    parameter_id=row["parameter_id"],
+                    value=row["value"],
+                    count=row["total"]
+                )
+                for row in chunk
+            ])
+        bump_versions(FacetCount)
+
+
+def rebuild_product_facets(product_ids):
+    rebuild_facets(set(Product.objects.filter(pk__in=product_ids).values_list("category_id", flat=True)))
+
+
+def schedule_facet_rebuild(category_ids=(), product_ids=()):
+    """Откладывает пересчёт до коммита, все удаления транзакции пересчитываются одним вызовом"""
+    if category_ids:
+        defer_on_commit(rebuild_facets, category_ids)
+    if product_ids:
+        defer_on_commit(rebuild_product_facets, product_ids)
+
+
+def tracking_state():
+    """Состояние потока для сигналов: флаг "счётчики ведёт вызывающий код" и id удаляемых предложений"""
+    if not hasattr(_local, "paused"):
+        _local.paused = False
+        _local.deleting_infos = set()
+    return _local
+
+
+@contextmanager
+def facets_counted_by_caller():
+    """Внутри блока сигналы не трогают счётчики: импорт сам собирает изменения и применяет их одним вызовом"""
+    state = tracking_state()
+    paused, state.paused = state.paused, True
+    try:
+        yield
+    finally:
+        state.paused = paused
+
+
+def parameter_facet_key(product_parameter_id):
+    """(категория, параметр, значение) сохранённой строки ProductParameter"""
+    return ProductParameter.objects.filter(pk=product_parameter_id).values_list(
+        "product_info__product__category_id", "parameter_id", "value").first()
+
+
+def info_category(info_id):
+    return ProductInfo.objects.filter(pk=info_id).values_list("product__category_id", flat=True).first()
+
+
+def track_parameter_saved(instance, old_key):
+    """Переносит счётчик со старого значения параметра (old_key, до сохранения) на новое"""
+    if tracking_state().paused:
+        return
+    deltas = Counter({(info_category(instance.product_info_id), instance.parameter_id, instance.value): 1})
+    if old_key is not None:
+        deltas[old_key] -= 1
+    apply_facet_deltas(deltas)
+
+
+def track_parameter_deleted(instance):
+    state = tracking_state()
+    # Предложение удаляется целиком: его категория пересчитывается после коммита, строки по одной не считаем
+    if state.paused or instance.product_info_id in state.deleting_infos:
+        return
+    category_id = info_category(instance.product_info_id)
+    if category_id is not None:
+        apply_facet_deltas({(category_id, instance.parameter_id, instance.value): -1})
+
+
+def track_category_change(product_id, old_category_id, new_category_id):
+    """Переносит счётчики параметров продукта из старой категории в новую"""
+    if tracking_state().paused or old_category_id == new_category_id:
+        return
+    rows = ProductParameter.objects.filter(product_info__product=product_id).values(
+        "parameter_id", "value").annotate(total=Count("id")).order_by()
+    deltas = Counter()
+    for row in rows:
+        deltas[(old_category_id, row["parameter_id"], row["value"])] -= row["total"]
+        deltas[(new_category_id, row["parameter_id"], row["value"])] += row["total"]
+    apply_facet_deltas(deltas)
+
+
+def get_facets(category_id=None):
+    """Значения параметров с количеством предложений, без категории - по всему каталогу"""
+    counts = FacetCount.objects.all()
+    if category_id is not None:
+        counts = counts.filter(category_id=category_id)
+    rows = counts.values("parameter_id", "parameter__name", "value").annotate(total=Sum("count")).order_by(
+        "parameter__name", "value")
+    facets = OrderedDict()
+    for row in rows:
+        facet = facets.setdefault(row["parameter_id"], {
+            "parameter": row["parameter_id"],
+            "name": row["parameter__name"],
+            "values": [],
+        })
+        facet["values"].append({"value": row["value"], "count": row["total"]})
+    return list(facets.values())
@@ -0,0 +1,78 @@
+from rest_framework import permissions
+
+
+def parse_fields(value):
+    tree = {}
+    for dotted in value.split(","):
+        node = tree
+        for part in filter(None, dotted.strip().split(".")):
+            node = node.setdefault(part, {})
+    return tree
+
+
+class FieldSpec:
+    """Набор полей ответа из параметров ?fields=a,b.c и ?expand=b,b.d
+
+    Без ?fields= отдаются все поля. Без ?expand= раскрываются все вложенные связи,
+    а если ?expand= передан, не указанные в нём связи отдаются только своими id.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = parse_fields(fields) if fields is not None else None
+        self.expand = {part.strip() for part in expand.split(",") if part.strip()} if expand is not None else None
+
+    @classmethod
+    def from_request(cls, request):
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return cls()
+        return cls(request.query_params.get("fields"), request.query_params.get("expand"))
+
+    @property
+    def is_default(self):
+        """Ответ без ?fields= и ?expand= - полный, как у сериализатора без параметров"""
+        return self.fields is None and self.expand is None
+
+    def selected(self, path):
+        """Поля, которые нужно оставить у объекта по пути path, или None если нужны все"""
+        node = self.fields
+        if node is None:
+            return None
+        for part in path:
+            node = node.get(part)
+            if not node:
+                return None
+        return set(node)
+
+    def is_expanded(self, path):
+        if self.expand is None or not path:
+            return True
+        dotted = ".".join(path)
+        if any(name == dotted or name.startswith(f"{dotted}.") for name in self.expand):
+            return True
+        node = self.fields or {}
+        for part in path:
+            node = node.get(part) or {}
+        return bool(node)
+
+    def is_rendered(self, path):
+        for index, name in enumerate(path):
+            parent = path[:index]
+            if not self.is_expanded(parent):
+                return False
+            selected = self.selected(parent)
+            if selected is not None and name not in selected:
+                return False
+        return True
+
+    def needs_prefetch(self, path, many):
+        # Свёрнутой в id связи один-к-одному запрос не нужен, id лежит в самой строке
+        return self.is_rendered(path) and (many or self.is_expanded(path))
+
+
+def get_field_path(serializer):
+    parts = []
+    while serializer.parent is not None:
+        if serializer.field_name:
+            parts.append(serializer.field_name)
+        serializer = serializer.parent
+    return tuple(reversed(parts))
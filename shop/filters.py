@@ -1,8 +1,29 @@
+from collections import defaultdict
+
+from django import forms
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework as filters
 
+from shop.lookups import parameter_lookup
 from shop.models import Shop, Contacts, Category, ProductParameter, ProductInfo, Product, Order, Parameter
 
 
+class ParameterValueField(forms.MultipleChoiceField):
+    """Список пар параметр:значение, параметр задаётся id или названием"""
+
+    default_error_messages = {
+        "invalid_choice": "Неверный фильтр %(value)s, ожидается параметр:значение",
+    }
+
+    def valid_value(self, value):
+        name, separator, parameter_value = value.partition(":")
+        return bool(name and separator)
+
+
+class ParameterValueFilter(filters.Filter):
+    field_class = ParameterValueField
+
+
 class ShopsFilterSet(filters.FilterSet):
 
     class Meta:
@@ -33,17 +54,64 @@ class ProductParameterFilterSet(filters.FilterSet):
 
 
 class ProductInfoFilterSet(filters.FilterSet):
+    price_min = filters.NumberFilter(field_name="price", lookup_expr="gte")
+    price_max = filters.NumberFilter(field_name="price", lookup_expr="lte")
 
     class Meta:
         model = ProductInfo
-        fields = ("price", "price_rrc")
+        fields = ("price", "price_rrc", "shop")
 
 
 class ProductFilterSet(filters.FilterSet):
+    shop = filters.NumberFilter(method="filter_offers")
+    price_min = filters.NumberFilter(method="filter_offers")
+    price_max = filters.NumberFilter(method="filter_offers")
+    param = ParameterValueFilter(method="filter_offers")
 
     class Meta:
         model = Product
-        fields = ("id", "name", )
+        fields = ("id", "name", "category")
+
+    def filter_offers(self, queryset, name, value):
+        # Условия на предложение собираются в filter_queryset, чтобы цена, магазин и параметры
+        # относились к одному и тому же предложению, а не к разным предложениям продукта
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        data = self.form.cleaned_data
+        conditions = {}
+        if data.get("shop") is not None:
+            conditions["shop_id"] = data["shop"]
+        if data.get("price_min") is not None:
+            conditions["price__gte"] = data["price_min"]
+        if data.get("price_max") is not None:
+            conditions["price__lte"] = data["price_max"]
+        wanted = self.get_parameter_values(data.get("param"))
+        if wanted is None:
+            return queryset.none()
+        if not conditions and not wanted:
+            return queryset
+        offers = ProductInfo.objects.filter(product=OuterRef("pk"), **conditions)
+        # Значения одного параметра объединяются через ИЛИ, разные параметры - через И
+        for parameter_id, values in wanted.items():
+            offers = offers.filter(Exists(ProductParameter.objects.filter(
+                product_info=OuterRef("pk"),
+                parameter_id=parameter_id,
+                value__in=values
+            )))
+        return queryset.filter(Exists(offers))
+
+    def get_parameter_values(self, pairs):
+        pairs = [pair.partition(":")[::2] for pair in pairs or []]
+        names = {name for name, value in pairs if not name.isdigit()}
+        found, missing = parameter_lookup.resolve(names)
+        if missing:
+            return None
+        wanted = defaultdict(set)
+        for name, value in pairs:
+            wanted[int(name) if name.isdigit() else found[name]].add(value)
+        return wanted
 
 
 class OrderFilterSet(filters.FilterSet):
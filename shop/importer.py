@@ -0,0 +1,346 @@
+from collections import Counter
+
+import yaml
+from django.conf import settings
+from django.core import files
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from shop.cache import bump_versions
+from shop.cards import refresh_cards, refresh_info_cards
+from shop.download import get_download_link, download_file, get_filename
+from shop.facets import apply_facet_deltas, facets_counted_by_caller
+from shop.lookups import category_lookup, parameter_lookup
+from shop.models import Product, ProductInfo, ProductParameter, ImportJob
+from shop.search import get_search_backend
+from shop.utils import chunked
+
+
+def iter_catalog(stream):
+    """Отдаёт продукты из YAML-файла по одному, не загружая весь файл в память"""
+    loader = yaml.SafeLoader(stream)
+    try:
+        loader.get_event()
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()
+        if not loader.check_event(yaml.SequenceStartEvent):
+            raise serializers.ValidationError("Файл должен содержать список продуктов!")
+        loader.get_event()
+        while not loader.check_event(yaml.SequenceEndEvent):
+            yield loader.construct_document(loader.compose_node(None, None))
+    except yaml.YAMLError as error:
+        raise serializers.ValidationError(f"Не удалось прочитать файл: {error}")
+    finally:
+        loader.dispose()
+
+
+def parse_item(item):
+    try:
+        info = item["product_info"]
+        return {
+            "key": str(item.get("id") or item["name"]),
+            "name": item["name"],
+            "category": item["category"]["name"],
+            "quantity": int(info["quantity"]),
+            "price": int(info["price"]),
+            "price_rrc": int(info.get("price_rrc", info["price"])),
+            "parameters": [
+                (parameter["parameter"]["name"], str(parameter["value"]))
+                for parameter in item.get("product_parameter") or []
+            ],
+        }
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise serializers.ValidationError(f"Неверный формат продукта в файле: {item}")
+
+
+def bulk_create(model, objs, batch_size):
+    # bulk_create проставляет id только там, где БД умеет возвращать строки из INSERT
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+class CatalogImporter:
+    """Импорт каталога магазина пачками: по одному запросу на справочники и bulk_create на запись"""
+
+    def __init__(self, shop, batch_size=None, on_progress=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.SHOP_IMPORT_BATCH_SIZE
+        self.on_progress = on_progress
+        self.processed = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.facet_deltas = Counter()
+        self.search_backend = get_search_backend()
+
+    def run(self, items):
+        with transaction.atomic():
+            for batch in chunked(items, self.batch_size):
+                self.import_batch([parse_item(item) for item in batch])
+                self.processed += len(batch)
+                if self.on_progress:
+                    self.on_progress(self.processed)
+            self.finish()
+        return self.processed
+
+    def finish(self):
+        apply_facet_deltas(self.facet_deltas)
+        bump_versions(Product, ProductInfo, ProductParameter)
+
+    def resolve_references(self, batch):
+        categories, missing = category_lookup.resolve(item["category"] for item in batch)
+        if missing:
+            raise serializers.ValidationError(
+                f"Такой категории нет! Проверьте её на заглавные буквы! {', '.join(sorted(missing))}")
+        parameters, missing = parameter_lookup.resolve(
+            name for item in batch for name, value in item["parameters"])
+        if missing:
+            raise serializers.ValidationError(f"Такого параметра нет! Проверьте её на заглавные буквы! Они "
+                                              f"должны быть на вверхним регистре! И проверьте есть ли вообще такой "
+                                              f"параметр! {', '.join(sorted(missing))}")
+        return categories, parameters
+
+    def import_batch(self, batch):
+        categories, parameters = self.resolve_references(batch)
+        self.insert(batch, categories, parameters)
+
+    def insert(self, batch, categories, parameters):
+        products = bulk_create(Product, [
+            Product(name=item["name"], category_id=categories[item["category"]]) for item in batch
+        ], self.batch_size)
+        infos = bulk_create(ProductInfo, [
+            ProductInfo(
+                product=product,
+                shop=self.shop,
+                quantity=item["quantity"],
+                price=item["price"],
+                price_rrc=item["price_rrc"],
+                external_id=item["key"]
+            )
+            for product, item in zip(products, batch)
+        ], self.batch_size)
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info=info, parameter_id=parameters[name], value=value)
+            for info, item in zip(infos, batch)
+            for name, value in item["parameters"]
+        ], batch_size=self.batch_size)
+        self.facet_deltas.update(
+            (categories[item["category"]], parameters[name], value)
+            for item in batch
+            for name, value in item["parameters"]
+        )
+        self.search_backend.index_products(product.pk for product in products)
+        refresh_cards(product.pk for product in products)
+        self.inserted += len(infos)
+        return infos
+
+
+class CatalogSyncer(CatalogImporter):
+    """Синхронизация каталога: пишет только новые и изменившиеся продукты"""
+
+    INFO_FIELDS = ("quantity", "price", "price_rrc")
+
+    def __init__(self, shop, batch_size=None, on_progress=None, retire_missing=False):
+        super().__init__(shop, batch_size, on_progress)
+        self.retire_missing = retire_missing
+        self.seen = set()
+
+    def get_existing(self, batch):
+        """Предложения пачки по external_id и отдельно строки без external_id по названию продукта
+
+        Строки без external_id созданы до его появления, их забирают себе позиции фида с тем же названием,
+        даже если в фиде у позиции уже есть id.
+        """
+        infos = ProductInfo.objects.filter(shop=self.shop).filter(
+            Q(external_id__in=[item["key"] for item in batch])
+            | Q(external_id__isnull=True, product__name__in=[item["name"] for item in batch])
+        ).select_related("product").order_by("id")
+        existing = {}
+        legacy = {}
+        for info in infos:
+            if info.external_id is None:
+                legacy.setdefault(info.product.name, info)
+            else:
+                existing.setdefault(info.external_id, info)
+        parameters = {info.pk: {} for info in [*existing.values(), *legacy.values()]}
+        duplicates = []
+        for product_parameter in ProductParameter.objects.filter(product_info__in=list(parameters)):
+            current = parameters[product_parameter.product_info_id]
+            if product_parameter.parameter_id in current:
+                duplicates.append(product_parameter)
+            else:
+                current[product_parameter.parameter_id] = product_parameter
+        return existing, legacy, parameters, duplicates
+
+    def import_batch(self, batch):
+        batch = list({item["key"]: item for item in batch}.values())
+        categories, parameters = self.resolve_references(batch)
+        existing, legacy, current_parameters, duplicates = self.get_existing(batch)
+        infos_by_pk = {info.pk: info for info in [*existing.values(), *legacy.values()]}
+        parameters_to_delete = []
+        for product_parameter in duplicates:
+            parameters_to_delete.append(product_parameter.pk)
+            self.facet_deltas[(infos_by_pk[product_parameter.product_info_id].product.category_id,
+                               product_parameter.parameter_id, product_parameter.value)] -= 1
+        new_items = []
+        products_to_update = []
+        infos_to_update = []
+        parameters_to_update = []
+        parameters_to_create = []
+        products_to_index = []
+        for item in batch:
+            info = existing.get(item["key"]) or legacy.pop(item["name"], None)
+            if info is None:
+                new_items.append(item)
+                continue
+            self.seen.add(info.pk)
+            # Остаток и цены в поиск не входят, переиндексируются только название, категория и параметры
+            searchable_changed = False
+            info_changed = False
+            product = info.product
+            category_id = categories[item["category"]]
+            current = current_parameters[info.pk]
+            wanted = {parameters[name]: value for name, value in item["parameters"]}
+            self.facet_deltas.subtract(
+                (product.category_id, parameter_id, product_parameter.value)
+                for parameter_id, product_parameter in current.items()
+            )
+            self.facet_deltas.update((category_id, parameter_id, value) for parameter_id, value in wanted.items())
+            if product.name != item["name"] or product.category_id != category_id:
+                product.name = item["name"]
+                product.category_id = category_id
+                products_to_update.append(product)
+                searchable_changed = True
+            if any(getattr(info, field) != item[field] for field in self.INFO_FIELDS) or info.external_id is None:
+                for field in self.INFO_FIELDS:
+                    setattr(info, field, item[field])
+                info.external_id = item["key"]
+                infos_to_update.append(info)
+                info_changed = True
+            for parameter_id, value in wanted.items():
+                product_parameter = current.pop(parameter_id, None)
+                if product_parameter is None:
+                    parameters_to_create.append(
+                        ProductParameter(product_info=info, parameter_id=parameter_id, value=value))
+                    searchable_changed = True
+                elif product_parameter.value != value:
+                    product_parameter.value = value
+                    parameters_to_update.append(product_parameter)
+                    searchable_changed = True
+            if current:
+                parameters_to_delete.extend(product_parameter.pk for product_parameter in current.values())
+                searchable_changed = True
+            if searchable_changed:
+                products_to_index.append(product.pk)
+            if searchable_changed or info_changed:
+                self.updated += 1
+            else:
+                self.unchanged += 1
+
+        if products_to_update:
+            Product.objects.bulk_update(products_to_update, ["name", "category"], batch_size=self.batch_size)
+        if infos_to_update:
+            ProductInfo.objects.bulk_update(
+                infos_to_update, [*self.INFO_FIELDS, "external_id"], batch_size=self.batch_size)
+        if parameters_to_update:
+            ProductParameter.objects.bulk_update(parameters_to_update, ["value"], batch_size=self.batch_size)
+        if parameters_to_delete:
+            with facets_counted_by_caller():
+                ProductParameter.objects.filter(pk__in=parameters_to_delete).delete()
+        if parameters_to_create:
+            ProductParameter.objects.bulk_create(parameters_to_create, batch_size=self.batch_size)
+        if products_to_index:
+            self.search_backend.index_products(products_to_index)
+        # В карточке есть и остаток с ценами, поэтому она пересобирается при любом изменении
+        changed = {info.product_id for info in infos_to_update}
+        changed.update(product.pk for product in products_to_update)
+        changed.update(products_to_index)
+        refresh_cards(changed)
+        if new_items:
+            self.seen.update(info.pk for info in self.insert(new_items, categories, parameters))
+
+    def finish(self):
+        super().finish()
+        if not self.retire_missing:
+            return
+        # Отсутствующие в файле продукты не удаляем, чтобы не потерять позиции заказов, а обнуляем остаток
+        stale = ProductInfo.objects.filter(shop=self.shop, quantity__gt=0).values_list("id", flat=True)
+        missing = [pk for pk in stale.iterator(chunk_size=self.batch_size) if pk not in self.seen]
+        for chunk in chunked(missing, self.batch_size):
+            self.removed += ProductInfo.objects.filter(pk__in=chunk).update(quantity=0)
+            refresh_info_cards(chunk)
+
+
+def import_catalog(shop, path, mode="create", retire_missing=False, batch_size=None, on_progress=None):
+    if mode == "sync":
+        importer = CatalogSyncer(shop, batch_size, on_progress, retire_missing=retire_missing)
+    else:
+        importer = CatalogImporter(shop, batch_size, on_progress)
+    with open(path, encoding="utf-8") as f:
+        importer.run(iter_catalog(f))
+    return importer
+
+
+def fetch_catalog(shop, url):
+    get_link = get_download_link(url)
+    if not get_link:
+        raise serializers.ValidationError("По вашему Url нет никакого документа!")
+    download = download_file(get_link)
+    if not download:
+        raise serializers.ValidationError("Не удалось записать на файл")
+    filename = get_filename(get_link)
+    shop.url = url
+    # Временный файл удаляется при закрытии, импорт читает уже сохранённую копию
+    with download:
+        shop.filename.save(f"{filename}", files.File(download))
+    return shop.filename.path
+
+
+def job_progress_key(job_id):
+    return f"shop:import-job:{job_id}:processed"
+
+
+def get_job_progress(job):
+    # Пока импорт идёт в транзакции, прогресс виден другим запросам только через кэш
+    if job.state == "running":
+        return cache.get(job_progress_key(job.pk), job.processed)
+    return job.processed
+
+
+JOB_COUNTERS = ("processed", "inserted", "updated", "unchanged", "removed")
+
+
+def run_import_job(job_id):
+    job = ImportJob.objects.select_related("shop").get(pk=job_id)
+    job.state = "running"
+    job.started_at = timezone.now()
+    job.save(update_fields=["state", "started_at"])
+
+    def on_progress(processed):
+        cache.set(job_progress_key(job.pk), processed, timeout=None)
+
+    try:
+        path = fetch_catalog(job.shop, job.url)
+        importer = import_catalog(job.shop, path, job.mode, job.retire_missing, on_progress=on_progress)
+        for field in JOB_COUNTERS:
+            setattr(job, field, getattr(importer, field))
+        job.state = "done"
+    except serializers.ValidationError as error:
+        job.state = "failed"
+        job.errors = "\n".join(str(detail) for detail in error.detail)
+    except Exception as error:
+        job.state = "failed"
+        job.errors = f"{error.__class__.__name__}: {error}"
+        raise
+    finally:
+        job.finished_at = timezone.now()
+        job.save(update_fields=["state", *JOB_COUNTERS, "errors", "finished_at"])
+        cache.delete(job_progress_key(job.pk))
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from shop.cache import get_versions
+from shop.models import Category, Parameter
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш в памяти процесса с ограничением размера и временем жизни записей"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + self.ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class NameLookup:
+    """Имя -> id для небольших справочников, недостающие имена добираются одним запросом"""
+
+    def __init__(self, model):
+        self.model = model
+        self.cache = TTLCache(settings.SHOP_LOOKUP_CACHE_SIZE, settings.SHOP_LOOKUP_CACHE_TTL)
+        self.version = None
+
+    def check_version(self):
+        # Версия модели меняется после записи в любом процессе, см. shop.signals
+        version, = get_versions([self.model])
+        if version != self.version:
+            self.cache.clear()
+            self.version = version
+
+    def resolve(self, names):
+        """Возвращает словарь найденных имён и множество отсутствующих"""
+        self.check_version()
+        names = set(names)
+        found = {}
+        for name in names:
+            pk = self.cache.get(name)
+            if pk is not None:
+                found[name] = pk
+        misses = names - set(found)
+        if misses:
+            for name, pk in self.model.objects.filter(name__in=misses).values_list("name", "id"):
+                self.cache.set(name, pk)
+                found[name] = pk
+        return found, names - set(found)
+
+    def clear(self):
+        self.cache.clear()
+
+
+category_lookup = NameLookup(Category)
+parameter_lookup = NameLookup(Parameter)
@@ -0,0 +1,188 @@
+import contextlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from shop import workers
+from shop.models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_FIELDS = ("state", "attempts", "last_error", "next_attempt_at", "sent_at")
+MIN_RETRY_WAIT = 1
+
+_delivery_lock = threading.Lock()
+_delivery_requested = threading.Event()
+_retry_timer = None
+
+
+def to_outbox(message):
+    alternatives = getattr(message, "alternatives", ())
+    html = next((content for content, mimetype in alternatives if mimetype == "text/html"), None)
+    return OutboxEmail(
+        subject=message.subject,
+        body=message.body,
+        html_body=html,
+        from_email=message.from_email,
+        to=list(message.to),
+        cc=list(message.cc),
+        bcc=list(message.bcc),
+        reply_to=list(message.reply_to),
+        headers=dict(message.extra_headers),
+    )
+
+
+def to_message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject,
+        email.body,
+        email.from_email,
+        email.to,
+        email.bcc,
+        connection=connection,
+        cc=email.cc,
+        reply_to=email.reply_to,
+        headers=email.headers,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, "text/html")
+    return message
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Складывает письма в таблицу OutboxEmail вместо отправки во время запроса
+
+    Письма пишутся в той же транзакции, что и данные запроса, и уходят после коммита из локального
+    пула потоков через SHOP_OUTBOX_EMAIL_BACKEND. Письма с вложениями отправляются сразу.
+    """
+
+    def send_messages(self, email_messages):
+        queued = [message for message in email_messages if message.recipients() and not message.attachments]
+        direct = [message for message in email_messages if message.recipients() and message.attachments]
+        if queued:
+            OutboxEmail.objects.bulk_create([to_outbox(message) for message in queued])
+            workers.submit(deliver_in_background)
+        if direct:
+            get_connection(settings.SHOP_OUTBOX_EMAIL_BACKEND, fail_silently=self.fail_silently).send_messages(direct)
+        return len(queued) + len(direct)
+
+
+def open_connection(connection):
+    """Открывает соединение, если оно ещё не открыто, и возвращает ошибку вместо исключения"""
+    try:
+        connection.open()
+    except Exception as error:
+        return error
+    return None
+
+
+def mark_sent(email):
+    email.attempts += 1
+    email.state = "sent"
+    email.sent_at = timezone.now()
+
+
+def mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.SHOP_OUTBOX_MAX_ATTEMPTS:
+        email.state = "failed"
+    else:
+        email.next_attempt_at = timezone.now() + timedelta(
+            seconds=settings.SHOP_OUTBOX_RETRY_DELAY * 2 ** (email.attempts - 1))
+
+
+def claim_outbox(batch_size):
+    """Забирает пачку писем, которым подошло время, короткой транзакцией
+
+    Строки выбираются с SKIP LOCKED, а next_attempt_at сдвигается на SHOP_OUTBOX_CLAIM_TIMEOUT секунд:
+    пока письма отправляются вне транзакции, другие обработчики их не видят. Если обработчик упадёт,
+    не записав результат, письма снова станут в очередь по истечении этого времени.
+    """
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.filter(
+            state="pending", next_attempt_at__lte=timezone.now()
+        ).order_by("next_attempt_at", "id").select_for_update(skip_locked=True)[:batch_size])
+        if emails:
+            claimed_until = timezone.now() + timedelta(seconds=settings.SHOP_OUTBOX_CLAIM_TIMEOUT)
+            OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=claimed_until)
+            for email in emails:
+                email.next_attempt_at = claimed_until
+    return emails
+
+
+def deliver_outbox(batch_size=None):
+    """Отправляет письма, которым подошло время, пачками через одно соединение, возвращает (отправлено, ошибок)
+
+    Пачка забирается и результаты записываются двумя короткими транзакциями, SMTP работает между ними,
+    не держа блокировки. Неудачная попытка откладывает письмо на SHOP_OUTBOX_RETRY_DELAY секунд, каждый раз
+    вдвое дольше, после SHOP_OUTBOX_MAX_ATTEMPTS попыток письмо помечается как не отправленное.
+    """
+    batch_size = batch_size or settings.SHOP_OUTBOX_BATCH_SIZE
+    sent = failed = 0
+    connection = get_connection(settings.SHOP_OUTBOX_EMAIL_BACKEND)
+    try:
+        while True:
+            emails = claim_outbox(batch_size)
+            if not emails:
+                break
+            # Соединение открывается один раз на все пачки; если сервер недоступен, откладывается вся пачка
+            unavailable = open_connection(connection)
+            for email in emails:
+                error = unavailable
+                if error is None:
+                    try:
+                        connection.send_messages([to_message(email, connection)])
+                    except Exception as send_error:
+                        error = send_error
+                        with contextlib.suppress(Exception):
+                            connection.close()
+                        unavailable = open_connection(connection)
+                if error is None:
+                    mark_sent(email)
+                    sent += 1
+                else:
+                    logger.warning("Письмо %s не отправлено: %s", email.pk, error)
+                    mark_failed(email, error)
+                    failed += 1
+            OutboxEmail.objects.bulk_update(emails, OUTBOX_FIELDS)
+    finally:
+        with contextlib.suppress(Exception):
+            connection.close()
+    return sent, failed
+
+
+def schedule_retry():
+    """Будит локальный пул к ближайшей повторной попытке"""
+    global _retry_timer
+    due = OutboxEmail.objects.filter(state="pending").aggregate(due=Min("next_attempt_at"))["due"]
+    if _retry_timer is not None:
+        _retry_timer.cancel()
+        _retry_timer = None
+    if due is None:
+        return
+    wait = max((due - timezone.now()).total_seconds(), MIN_RETRY_WAIT)
+    _retry_timer = threading.Timer(wait, workers.get_executor().submit, (workers.run, deliver_in_background))
+    _retry_timer.daemon = True
+    _retry_timer.start()
+
+
+def deliver_in_background():
+    """Отправка из локального пула: в процессе идёт одна, а письма, пришедшие во время неё, не теряются"""
+    _delivery_requested.set()
+    while _delivery_requested.is_set():
+        if not _delivery_lock.acquire(blocking=False):
+            return
+        try:
+            _delivery_requested.clear()
+            deliver_outbox()
+            schedule_retry()
+        finally:
+            _delivery_lock.release()
@@ -0,0 +1,147 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from shop.asgi import StreamingASGIHandler
+from shop.middleware import percentile
+from shop.models import User, Product
+
+HOST = "localhost"
+
+# Режим: (обработчик, префикс пути). asgi-sync - синхронные ViewSet под ASGI, как их запускает Django без async_views
+MODES = {
+    "wsgi": ("wsgi", "/api/v1/"),
+    "asgi-sync": ("asgi", "/api/v1/"),
+    "asgi": ("asgi", "/api/v1/async/"),
+}
+
+
+class Command(BaseCommand):
+    help = "Сравнивает запросы в секунду и хвост задержек чтения каталога через WSGI и ASGI при одной конкурентности"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Сколько продуктов сгенерировать перед замером")
+        parser.add_argument("--requests", type=int, default=2000, help="Запросов на каждый эндпоинт и режим")
+        parser.add_argument("--concurrency", type=int, default=32, help="Одновременных запросов")
+        parser.add_argument("--mode", action="append", choices=MODES, help="Режимы замера, по умолчанию все")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            call_command("seed_shop", products=options["seed"], orders=0, stdout=self.stdout)
+        product = Product.objects.order_by("id").first()
+        user = User.objects.filter(is_active=True).order_by("id").first()
+        if product is None or user is None:
+            raise CommandError("Нет данных для замера, запустите команду с --seed")
+        token = Token.objects.get_or_create(user=user)[0].key
+        endpoints = ["products/", f"products/{product.pk}/", "categories/", "parameters/", "shops/"]
+        for mode in options["mode"] or MODES:
+            handler, prefix = MODES[mode]
+            run = self.run_wsgi if handler == "wsgi" else self.run_asgi
+            for endpoint in endpoints:
+                elapsed, durations, statuses = run(
+                    prefix + endpoint, token, options["requests"], options["concurrency"])
+                self.report(mode, endpoint, elapsed, durations, statuses)
+
+    def report(self, mode, endpoint, elapsed, durations, statuses):
+        errors = sum(1 for status in statuses if status != 200)
+        self.stdout.write(
+            f"{mode:<10} {endpoint:<16} {len(durations) / elapsed:8.0f} rps  "
+            f"p50 {percentile(durations, 0.5) * 1000:7.1f} мс  p95 {percentile(durations, 0.95) * 1000:7.1f} мс  "
+            f"p99 {percentile(durations, 0.99) * 1000:7.1f} мс  ошибок {errors}"
+        )
+
+    def run_wsgi(self, path, token, count, concurrency):
+        application = WSGIHandler()
+        environ = {
+            "REQUEST_METHOD": "GET",
+            "SCRIPT_NAME": "",
+            "PATH_INFO": path,
+            "QUERY_STRING": "",
+            "SERVER_NAME": HOST,
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "HTTP_HOST": HOST,
+            "HTTP_AUTHORIZATION": f"Token {token}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        statuses = []
+        lock = threading.Lock()
+
+        def request():
+            status = []
+            start = time.perf_counter()
+            result = application({**environ, "wsgi.input": io.BytesIO()}, lambda line, headers: status.append(line))
+            try:
+                b"".join(result)
+            finally:
+                # close() отправляет request_finished, как это делает WSGI-сервер
+                result.close()
+            with lock:
+                statuses.append(int(status[0].split()[0]))
+            return time.perf_counter() - start
+
+        # Пул потоков повторяет многопоточный WSGI-сервер, первый проход прогревает кэш ответов
+        with ThreadPoolExecutor(concurrency) as pool:
+            list(pool.map(lambda number: request(), range(concurrency)))
+            statuses.clear()
+            start = time.perf_counter()
+            durations = list(pool.map(lambda number: request(), range(count)))
+        return time.perf_counter() - start, durations, statuses
+
+    def run_asgi(self, path, token, count, concurrency):
+        return asyncio.run(self.asgi_load(path, token, count, concurrency))
+
+    async def asgi_load(self, path, token, count, concurrency):
+        application = StreamingASGIHandler()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", HOST.encode()), (b"authorization", f"Token {token}".encode())],
+            "client": ("127.0.0.1", 0),
+            "server": (HOST, 80),
+        }
+        statuses = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        async def request():
+            start = time.perf_counter()
+            await application(dict(scope), receive, send)
+            return time.perf_counter() - start
+
+        async def worker(share, durations):
+            for number in range(share):
+                durations.append(await request())
+
+        await asyncio.gather(*[request() for number in range(concurrency)])
+        statuses.clear()
+        durations = []
+        shares = [count // concurrency + (1 if number < count % concurrency else 0) for number in range(concurrency)]
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(share, durations) for share in shares])
+        return time.perf_counter() - start, durations, statuses
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from shop.cards import get_cards
+from shop.middleware import percentile
+from shop.models import Shop, Product, Order
+from shop.renderers import FastJSONRenderer, orjson
+from shop.serializers import ShopSerializer, OrderSerializer
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время рендера и размер JSON списков продуктов, заказов и магазинов у JSONRenderer и orjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=1000, help="Объектов в каждом списке")
+        parser.add_argument("--repeat", type=int, default=20, help="Рендеров каждого списка каждым рендерером")
+
+    def handle(self, *args, **options):
+        limit = options["limit"]
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson не установлен, FastJSONRenderer рендерит через json"))
+        product_ids = list(Product.objects.order_by("id").values_list("id", flat=True)[:limit])
+        cards = get_cards(product_ids)
+        lists = {
+            "products": [cards[pk] for pk in product_ids],
+            "orders": OrderSerializer(
+                Order.objects.prefetch_related("positions", "contacts").order_by("id")[:limit], many=True).data,
+            "shops": ShopSerializer(
+                Shop.objects.prefetch_related("categories", "user").order_by("id")[:limit], many=True).data,
+        }
+        for name, data in lists.items():
+            baseline, baseline_ms = self.measure(JSONRenderer(), data, options["repeat"])
+            fast, fast_ms = self.measure(FastJSONRenderer(), data, options["repeat"])
+            self.stdout.write(
+                f"{name:<9} {len(data):6} шт.  json {baseline_ms:8.2f} мс  fast {fast_ms:8.2f} мс  "
+                f"x{baseline_ms / fast_ms if fast_ms else 0:5.1f}  {len(baseline)} / {len(fast)} байт  "
+                f"{'совпадает' if baseline == fast else 'ОТЛИЧАЕТСЯ'}"
+            )
+
+    def measure(self, renderer, data, repeat):
+        """Рендерит data repeat раз, возвращает результат и медиану времени одного рендера в мс"""
+        durations = []
+        for number in range(repeat):
+            start = time.perf_counter()
+            content = renderer.render(data)
+            durations.append(time.perf_counter() - start)
+        return content, percentile(durations, 0.5) * 1000
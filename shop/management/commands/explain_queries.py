@@ -0,0 +1,93 @@
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from shop.models import Shop, Category, Parameter, ProductInfo, ProductParameter, Order, Product
+
+INDEXED_MODELS = (Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Печатает планы EXPLAIN и время горячих запросов магазина с индексами и без них"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0, help="Сколько продуктов сгенерировать перед замером")
+        parser.add_argument("--runs", type=int, default=5, help="Сколько раз выполнить каждый запрос")
+        parser.add_argument("--no-compare", action="store_true", help="Не замерять запросы без индексов")
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed(options["seed"])
+        queries = self.hot_queries()
+        self.analyze()
+        self.report("С индексами", queries, options["runs"])
+        if options["no_compare"]:
+            return
+        if connection.vendor != "postgresql":
+            # В SQLite уникальные ограничения встроены в таблицу и без пересоздания таблиц не удаляются,
+            # запросы по ним остались бы индексными, и сравнение ничего бы не показало
+            self.stdout.write(self.style.WARNING("Сравнение без индексов доступно только на PostgreSQL"))
+            return
+        # Индексы удаляются внутри транзакции и возвращаются откатом, DDL в PostgreSQL транзакционный
+        try:
+            with transaction.atomic():
+                self.drop_indexes()
+                self.report("Без индексов", queries, options["runs"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, count):
+        call_command("seed_shop", products=count, orders=count, stdout=self.stdout)
+
+    def hot_queries(self):
+        product_parameter = ProductParameter.objects.select_related("parameter", "product_info").first()
+        order = Order.objects.first()
+        if product_parameter is None or order is None:
+            raise CommandError("Нет данных для замера, запустите команду с --seed")
+        info = product_parameter.product_info
+        return [
+            ("Категория по имени", Category.objects.filter(name=info.product.category.name)),
+            ("Параметр по имени", Parameter.objects.filter(name=product_parameter.parameter.name)),
+            ("Продукт по имени", Product.objects.filter(name=info.product.name)),
+            ("Товары магазина дешевле цены",
+             ProductInfo.objects.filter(shop_id=info.shop_id, price__lte=info.price).order_by("price")[:50]),
+            ("Заказы пользователя по дате и статусу",
+             Order.objects.filter(user_id=order.user_id, created_date=order.created_date, state=order.state)[:50]),
+            ("Продукты по значению параметра",
+             ProductParameter.objects.filter(parameter_id=product_parameter.parameter_id,
+                                             value=product_parameter.value)[:50]),
+        ]
+
+    def drop_indexes(self):
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model in INDEXED_MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f"DROP INDEX {quote(index.name)}")
+                for constraint in model._meta.constraints:
+                    cursor.execute(f"ALTER TABLE {quote(model._meta.db_table)} DROP CONSTRAINT {quote(constraint.name)}")
+        self.analyze()
+
+    def analyze(self):
+        # Без свежей статистики планировщик оценивает таблицы как почти пустые
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def report(self, title, queries, runs):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        for name, queryset in queries:
+            timings = []
+            for run in range(runs):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(self.style.SUCCESS(f"{name}: медиана {statistics.median(timings):.2f} мс"))
+            self.stdout.write(queryset.explain())
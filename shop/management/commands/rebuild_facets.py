@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from shop.facets import rebuild_facets
+from shop.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики значений параметров для фильтров каталога"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--category", type=int, action="append", help="id категории, по умолчанию все")
+
+    def handle(self, *args, **options):
+        rebuild_facets(options["category"])
+        self.stdout.write(self.style.SUCCESS(f"Счётчиков фильтров: {FacetCount.objects.count()}"))
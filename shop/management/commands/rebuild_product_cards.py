@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.cards import rebuild_cards
+
+
+class Command(BaseCommand):
+    help = "Заново собирает карточки всех продуктов для чтения каталога"
+
+    def handle(self, *args, **options):
+        count = rebuild_cards()
+        self.stdout.write(self.style.SUCCESS(f"Собрано карточек: {count}"))
@@ -0,0 +1,17 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from shop.rollups import BACKFILL_CHUNK_SIZE, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает дневные итоги продаж из заказов по диапазонам id, нужно запустить после миграции"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--since", type=date.fromisoformat, help="Пересчитать только с этого дня, ГГГГ-ММ-ДД")
+        parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="Заказов в одном диапазоне id")
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups(options["since"], options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Учтено заказов: {count}"))
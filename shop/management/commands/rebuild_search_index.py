@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Заново индексирует все продукты для поиска"
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Индекс {backend.__class__.__name__} перестроен"))
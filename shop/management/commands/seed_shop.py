@@ -0,0 +1,227 @@
+import csv
+import io
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from shop.cache import bump_versions
+from shop.cards import refresh_cards
+from shop.facets import rebuild_facets
+from shop.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contacts, Order, \
+    OrderItem, STATE_CHOICES
+from shop.rollups import add_orders
+from shop.search import get_search_backend
+from shop.utils import chunked
+
+SEEDED_MODELS = (User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contacts, Order, OrderItem)
+
+ADJECTIVES = ("Новый", "Лёгкий", "Компактный", "Мощный", "Тихий", "Умный", "Складной", "Беспроводной", "Прочный",
+              "Детский", "Красный", "Чёрный", "Белый", "Стальной", "Деревянный")
+NOUNS = ("телефон", "ноутбук", "чайник", "пылесос", "рюкзак", "фонарь", "стул", "стол", "велосипед", "самокат",
+         "наушники", "монитор", "кофеварка", "утюг", "фен")
+VALUES_PER_PARAMETER = 20
+
+
+@contextmanager
+def explicit_created_date():
+    # auto_now_add перезаписывает дату при вставке, а заказы должны быть размазаны по году
+    field = Order._meta.get_field("created_date")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Генерирует магазины, каталог и заказы пачками bulk_create для замеров на больших данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=1, help="Одинаковое зерно - одинаковые данные")
+        parser.add_argument("--sellers", type=int, default=10)
+        parser.add_argument("--categories", type=int, default=50)
+        parser.add_argument("--parameters", type=int, default=30)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--offers", type=int, default=1, help="Сколько магазинов продают каждый продукт")
+        parser.add_argument("--product-parameters", type=int, default=3, help="Параметров у каждого предложения")
+        parser.add_argument("--buyers", type=int, default=100)
+        parser.add_argument("--orders", type=int, default=10000)
+        parser.add_argument("--positions", type=int, default=3, help="Наибольшее число позиций в заказе")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--no-index", action="store_true", help="Не пересчитывать фильтры и поисковый индекс")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.created = Counter()
+        # id задаются явно от текущего максимума: bulk_create не нужно возвращать их из БД, и SQLite тоже подходит
+        self.next_ids = {
+            model: (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1 for model in SEEDED_MODELS
+        }
+        start = time.perf_counter()
+        shops = self.seed_sellers(options["sellers"])
+        categories = self.seed_named(Category, "Категория", options["categories"])
+        parameters = self.seed_named(Parameter, "Параметр", options["parameters"])
+        self.link_categories(shops, categories)
+        first_product = self.next_ids[Product]
+        infos = self.seed_products(options, shops, categories, parameters)
+        buyers = self.seed_buyers(options["buyers"])
+        first_order = self.next_ids[Order]
+        if buyers and infos:
+            self.seed_orders(options, buyers, infos)
+            add_orders(Order.objects.filter(pk__gte=first_order).exclude(state="canceled"))
+        self.reset_sequences()
+        if not options["no_index"]:
+            self.rebuild_indexes(range(first_product, self.next_ids[Product]))
+        bump_versions(*SEEDED_MODELS)
+        for model in SEEDED_MODELS:
+            self.stdout.write(f"{model._meta.verbose_name_plural}: +{self.created[model]}")
+        self.stdout.write(self.style.SUCCESS(f"Готово за {time.perf_counter() - start:.1f} с"))
+
+    def take_ids(self, model, count):
+        first = self.next_ids[model]
+        self.next_ids[model] += count
+        return range(first, first + count)
+
+    def bulk_create(self, model, objs):
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.created[model] += len(objs)
+
+    def insert_rows(self, model, fields, rows):
+        """Вставляет кортежи значений полей: в PostgreSQL через COPY, в остальных БД через bulk_create"""
+        if connection.vendor != "postgresql":
+            self.bulk_create(model, [model(**dict(zip(fields, row))) for row in rows])
+            return
+        # Сборка INSERT в ORM занимает больше времени, чем сама запись, COPY её обходит
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        columns = ", ".join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+        self.created[model] += len(rows)
+
+    def seed_sellers(self, count):
+        ids = self.take_ids(User, count)
+        self.bulk_create(User, [
+            User(pk=pk, email=f"seed-seller-{pk}@shop.test", username=f"seller{pk}", user_type="Seller",
+                 password=make_password(None))
+            for pk in ids
+        ])
+        shop_ids = self.take_ids(Shop, count)
+        self.bulk_create(Shop, [
+            Shop(pk=pk, name=f"Магазин {pk}", user_id=user_id) for pk, user_id in zip(shop_ids, ids)
+        ])
+        return list(shop_ids)
+
+    def seed_named(self, model, prefix, count):
+        ids = self.take_ids(model, count)
+        self.bulk_create(model, [model(pk=pk, name=f"{prefix} {pk}") for pk in ids])
+        return list(ids)
+
+    def link_categories(self, shops, categories):
+        through = Category.shops.through
+        links = [
+            through(category_id=category_id, shop_id=shop_id)
+            for shop_id in shops
+            for category_id in self.rng.sample(categories, min(len(categories), 5))
+        ]
+        through.objects.bulk_create(links, batch_size=self.batch_size)
+
+    def seed_products(self, options, shops, categories, parameters):
+        offers = min(options["offers"], len(shops))
+        per_info = min(options["product_parameters"], len(parameters))
+        infos = []
+        for first in range(0, options["products"], self.batch_size):
+            count = min(self.batch_size, options["products"] - first)
+            products = []
+            batch_infos = []
+            product_parameters = []
+            for pk in self.take_ids(Product, count):
+                name = f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {pk}"
+                products.append((pk, name, self.rng.choice(categories)))
+                for shop_id in self.rng.sample(shops, offers):
+                    info_id = self.take_ids(ProductInfo, 1)[0]
+                    price = self.rng.randint(100, 100000)
+                    batch_infos.append(
+                        (info_id, pk, shop_id, self.rng.randint(0, 100), price, price, f"seed-{pk}"))
+                    product_parameters.extend(
+                        (info_id, parameter_id, str(self.rng.randint(1, VALUES_PER_PARAMETER)))
+                        for parameter_id in self.rng.sample(parameters, per_info)
+                    )
+            with transaction.atomic():
+                self.insert_rows(Product, ("id", "name", "category_id"), products)
+                self.insert_rows(ProductInfo, (
+                    "id", "product_id", "shop_id", "quantity", "price", "price_rrc", "external_id"
+                ), batch_infos)
+                self.insert_rows(ProductParameter, ("product_info_id", "parameter_id", "value"), product_parameters)
+            infos.extend((row[0], row[2], row[4]) for row in batch_infos)
+        return infos
+
+    def seed_buyers(self, count):
+        ids = self.take_ids(User, count)
+        self.bulk_create(User, [
+            User(pk=pk, email=f"seed-buyer-{pk}@shop.test", username=f"buyer{pk}", user_type="Buyer",
+                 password=make_password(None))
+            for pk in ids
+        ])
+        contact_ids = self.take_ids(Contacts, count)
+        self.bulk_create(Contacts, [
+            Contacts(pk=pk, user_id=user_id, city="Ташкент", district="Юнусабад", street=f"Улица {pk}",
+                     house=str(pk % 100 + 1), building="1", phone=f"+998{pk:09d}"[:20])
+            for pk, user_id in zip(contact_ids, ids)
+        ])
+        return list(zip(ids, contact_ids))
+
+    def seed_orders(self, options, buyers, infos):
+        states = [state for state, name in STATE_CHOICES]
+        today = date.today()
+        with explicit_created_date():
+            for first in range(0, options["orders"], self.batch_size):
+                count = min(self.batch_size, options["orders"] - first)
+                orders = []
+                items = []
+                for pk in self.take_ids(Order, count):
+                    user_id, contacts_id = self.rng.choice(buyers)
+                    created_date = today - timedelta(days=self.rng.randint(0, 364))
+                    positions = [
+                        (pk, info_id, shop_id, self.rng.randint(1, 5), price)
+                        for info_id, shop_id, price in self.rng.sample(
+                            infos, min(len(infos), self.rng.randint(1, options["positions"])))
+                    ]
+                    items.extend(positions)
+                    orders.append((
+                        pk, user_id, contacts_id, self.rng.choice(states), created_date,
+                        sum(quantity * price for order_id, info_id, shop_id, quantity, price in positions),
+                        sum(quantity for order_id, info_id, shop_id, quantity, price in positions)
+                    ))
+                with transaction.atomic():
+                    self.insert_rows(Order, (
+                        "id", "user_id", "contacts_id", "state", "created_date", "total_sum", "items_count"
+                    ), orders)
+                    self.insert_rows(OrderItem, ("order_id", "product_info_id", "shop_id", "quantity", "price"), items)
+
+    def reset_sequences(self):
+        # После вставки с явными id последовательности PostgreSQL нужно сдвинуть за максимум
+        statements = connection.ops.sequence_reset_sql(no_style(), SEEDED_MODELS)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+    def rebuild_indexes(self, product_ids):
+        rebuild_facets()
+        backend = get_search_backend()
+        for chunk in chunked(product_ids, self.batch_size):
+            backend.index_products(chunk)
+            refresh_cards(chunk)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.mail import deliver_outbox
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из очереди, с --loop работает как отдельный обработчик"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Не завершаться, проверять очередь каждые --interval с")
+        parser.add_argument("--interval", type=float, default=5, help="Пауза между проверками очереди, с")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_outbox()
+            if sent or failed or not options["loop"]:
+                self.stdout.write(self.style.SUCCESS(f"Отправлено писем: {sent}, отложено или с ошибкой: {failed}"))
+            if not options["loop"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import clickjacking, common, csrf, security
+
+from shop.asgi import run_inline
+
+logger = logging.getLogger("shop.sql")
+
+# contextvars переходят в потоки sync_to_async, поэтому запросы попадают к своему HTTP-запросу и под ASGI
+current_recorder = ContextVar("shop_query_recorder", default=None)
+
+PLACEHOLDERS_RE = re.compile(r"%s(?:\s*,\s*%s)+")
+
+
+@lru_cache(maxsize=2048)
+def query_shape(sql):
+    """Запрос без значений: списки IN (%s, %s, ...) любой длины сводятся к одной форме"""
+    return PLACEHOLDERS_RE.sub("%s, ...", sql)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class QueryRecorder:
+    """Считает запросы одного HTTP-запроса через execute_wrapper, без DEBUG-логов django.db"""
+
+    def __init__(self, log_statements=False):
+        self.log_statements = log_statements
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.shapes[query_shape(sql)] += 1
+            if self.log_statements:
+                logger.info("(%.2f мс) %s; args=%s", duration * 1000, sql, params)
+
+    def repeated(self):
+        threshold = settings.SHOP_SQL_REPEATED_QUERY_THRESHOLD
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = current_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection):
+    """Ставит постоянную обёртку на соединение потока, вызывается из сигнала connection_created"""
+    # В начало списка: временные обёртки execute_wrapper снимаются с конца и не заденут эту
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+class EndpointStats:
+    """Последние SHOP_SQL_STATS_WINDOW запросов эндпоинта для p50/p95"""
+
+    def __init__(self):
+        window = settings.SHOP_SQL_STATS_WINDOW
+        self.requests = 0
+        self.durations = deque(maxlen=window)
+        self.db_durations = deque(maxlen=window)
+        self.queries = deque(maxlen=window)
+        self.repeated = 0
+
+    def add(self, duration, recorder):
+        self.requests += 1
+        self.durations.append(duration)
+        self.db_durations.append(recorder.duration)
+        self.queries.append(recorder.count)
+        if recorder.repeated():
+            self.repeated += 1
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "p50_ms": round(percentile(self.durations, 0.5) * 1000, 2),
+            "p95_ms": round(percentile(self.durations, 0.95) * 1000, 2),
+            "db_p95_ms": round(percentile(self.db_durations, 0.95) * 1000, 2),
+            "queries_avg": round(sum(self.queries) / len(self.queries), 2),
+            "queries_max": max(self.queries),
+            "repeated_query_requests": self.repeated,
+        }
+
+
+class EndpointRegistry:
+    """Статистика по эндпоинтам внутри процесса, у каждого воркера сервера она своя"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def add(self, endpoint, duration, recorder):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.add(duration, recorder)
+
+    def summary(self):
+        with self.lock:
+            rows = [{"endpoint": endpoint, **stats.summary()} for endpoint, stats in self.endpoints.items()]
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
+
+    def clear(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+endpoint_stats = EndpointRegistry()
+
+
+def get_endpoint(request):
+    match = getattr(request, "resolver_match", None)
+    return f"{request.method} {match.view_name if match else '<unresolved>'}"
+
+
+class QueryInstrumentationMiddleware:
+    """Добавляет к ответу Server-Timing с числом и временем запросов к БД и копит статистику эндпоинтов
+
+    Полный текст запросов пишется в логгер shop.sql только для доли SHOP_SQL_LOG_SAMPLE_RATE запросов.
+    Работает и под WSGI, и под ASGI без перевода асинхронных представлений в синхронный режим.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Так Django 3.1 узнаёт асинхронный middleware, как в MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        recorder = QueryRecorder(log_statements=random.random() < settings.SHOP_SQL_LOG_SAMPLE_RATE)
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder(log_statements=random.random() < settings.SHOP_SQL_LOG_SAMPLE_RATE)
+        token = current_recorder.set(recorder)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_recorder.reset(token)
+        return self.finish(request, response, recorder, start)
+
+    def finish(self, request, response, recorder, start):
+        duration = time.perf_counter() - start
+        endpoint = get_endpoint(request)
+        endpoint_stats.add(endpoint, duration, recorder)
+        timings = [
+            f'db;dur={recorder.duration * 1000:.2f};desc="{recorder.count} queries"',
+            f"total;dur={duration * 1000:.2f}",
+        ]
+        repeated = recorder.repeated()
+        if repeated:
+            timings.append(f'repeated;desc="{len(repeated)} shapes"')
+            for shape, count in repeated:
+                logger.warning("%s: запрос выполнен %s раз, похоже на N+1: %s", endpoint, count, shape)
+        response["Server-Timing"] = ", ".join(timings)
+        return response
+
+
+class InlineMiddlewareMixin:
+    """Под ASGI вызывает process_request и process_response прямо в цикле событий
+
+    MiddlewareMixin из Django 3.1 под ASGI переводит каждый из них в поток синхронного кода, и все запросы
+    стоят в очереди к одному потоку: у семи стандартных middleware это до четырнадцати переходов на запрос.
+    Их методы обычно не обращаются к БД, а если обращаются (сохранение сессии), метод повторяется в потоке.
+    Под WSGI поведение не меняется.
+    """
+
+    async def __acall__(self, request):
+        response = None
+        if hasattr(self, "process_request"):
+            response = await run_inline(self.process_request, request)
+        response = response or await self.get_response(request)
+        if hasattr(self, "process_response"):
+            response = await run_inline(self.process_response, request, response)
+        return response
+
+
+class SecurityMiddleware(InlineMiddlewareMixin, security.SecurityMiddleware):
+    pass
+
+
+class SessionMiddleware(InlineMiddlewareMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CommonMiddleware(InlineMiddlewareMixin, common.CommonMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(InlineMiddlewareMixin, csrf.CsrfViewMiddleware):
+    pass
+
+
+class AuthenticationMiddleware(InlineMiddlewareMixin, auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(InlineMiddlewareMixin, messages_middleware.MessageMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(InlineMiddlewareMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
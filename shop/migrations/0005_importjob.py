@@ -0,0 +1,32 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_auto_20210708_1145'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(verbose_name='Ссылка')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершён'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус задачи')),
+                ('processed', models.IntegerField(default=0, verbose_name='Обработано продуктов')),
+                ('errors', models.TextField(blank=True, verbose_name='Ошибки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало импорта')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Конец импорта')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Задача импорта',
+                'verbose_name_plural': 'Список задач импорта',
+            },
+        ),
+    ]
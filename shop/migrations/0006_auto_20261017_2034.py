@@ -0,0 +1,52 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='inserted',
+            field=models.IntegerField(default=0, verbose_name='Добавлено'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='mode',
+            field=models.CharField(choices=[('create', 'Создать все продукты заново'), ('sync', 'Синхронизировать с каталогом магазина')], default='sync', max_length=20, verbose_name='Режим импорта'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='removed',
+            field=models.IntegerField(default=0, verbose_name='Снято с продажи'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='retire_missing',
+            field=models.BooleanField(default=False, verbose_name='Обнулять отсутствующие в файле'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='unchanged',
+            field=models.IntegerField(default=0, verbose_name='Без изменений'),
+        ),
+        migrations.AddField(
+            model_name='importjob',
+            name='updated',
+            field=models.IntegerField(default=0, verbose_name='Обновлено'),
+        ),
+        migrations.AddField(
+            model_name='productinfo',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Ключ в файле магазина'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'external_id'], name='shop_produc_shop_id_599114_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_auto_20261017_2034'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_date', 'id'], name='shop_order_created_bf5610_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['price', 'id'], name='shop_produc_price_7921a5_idx'),
+        ),
+    ]
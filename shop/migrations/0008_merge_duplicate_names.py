@@ -0,0 +1,36 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:39
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_names(apps, schema_editor):
+    """Склеивает одноимённые категории и параметры в запись с наименьшим id, как раньше делал .first()"""
+    Category = apps.get_model('shop', 'Category')
+    Parameter = apps.get_model('shop', 'Parameter')
+    Product = apps.get_model('shop', 'Product')
+    ProductParameter = apps.get_model('shop', 'ProductParameter')
+    duplicates = Category.objects.values('name').annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        keep = Category.objects.get(pk=duplicate['keep'])
+        others = Category.objects.filter(name=duplicate['name']).exclude(pk=keep.pk)
+        Product.objects.filter(category__in=others).update(category=keep)
+        for other in others:
+            keep.shops.add(*other.shops.all())
+        others.delete()
+    duplicates = Parameter.objects.values('name').annotate(keep=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        others = Parameter.objects.filter(name=duplicate['name']).exclude(pk=duplicate['keep'])
+        ProductParameter.objects.filter(parameter__in=others).update(parameter_id=duplicate['keep'])
+        others.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_auto_20261017_2035'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_merge_duplicate_names'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'created_date', 'state'], name='order_user_date_state_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['name'], name='product_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(fields=['shop', 'price'], name='productinfo_shop_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value'], name='productparameter_value_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('name',), name='category_unique_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='parameter',
+            constraint=models.UniqueConstraint(fields=('name',), name='parameter_unique_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='shop',
+            constraint=models.UniqueConstraint(fields=('user',), name='shop_unique_user'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:45
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def fill_facet_counts(apps, schema_editor):
+    FacetCount = apps.get_model('shop', 'FacetCount')
+    ProductParameter = apps.get_model('shop', 'ProductParameter')
+    counts = ProductParameter.objects.values('product_info__product__category_id', 'parameter_id', 'value').annotate(
+        total=Count('id')).order_by()
+    FacetCount.objects.bulk_create([
+        FacetCount(category_id=row['product_info__product__category_id'], parameter_id=row['parameter_id'],
+                   value=row['value'], count=row['total'])
+        for row in counts
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_auto_20261017_2039'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.IntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.category', verbose_name='Категория')),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='shop.parameter', verbose_name='Параметр')),
+            ],
+            options={
+                'verbose_name': 'Счётчик фильтра',
+                'verbose_name_plural': 'Счётчики фильтров',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'parameter', 'value'), name='facetcount_unique_value'),
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 3.1.8 on 2026-10-17 20:48
+
+import re
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Копия shop.search на момент миграции: миграция не должна зависеть от того, как модуль изменится потом
+TOKEN_RE = re.compile(r"\w+")
+NAME_WEIGHT = 4
+CATEGORY_WEIGHT = 2
+PARAMETER_WEIGHT = 1
+
+
+def tokenize(text):
+    return [token[:100] for token in TOKEN_RE.findall(text.lower())]
+
+
+def create_search_indexes(apps, schema_editor):
+    # GIN-индексы есть только в PostgreSQL, на других БД поиск идёт по таблице ProductSearchTerm
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX product_search_vector_idx ON shop_product USING gin (search_vector)')
+    # pg_trgm ставится отдельно от сервера, без него поиск работает без исправления опечаток
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute('CREATE INDEX product_name_trgm_idx ON shop_product USING gin (name gin_trgm_ops)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_search_vector_idx')
+    schema_editor.execute('DROP INDEX IF EXISTS product_name_trgm_idx')
+
+
+def fill_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "UPDATE shop_product SET search_vector = "
+            "setweight(to_tsvector('simple', document.name), 'A') || "
+            "setweight(to_tsvector('simple', document.category), 'B') || "
+            "setweight(to_tsvector('simple', document.parameters), 'C') "
+            "FROM (SELECT shop_product.id, shop_product.name, shop_category.name AS category, "
+            "coalesce(string_agg(shop_productparameter.value, ' '), '') AS parameters FROM shop_product "
+            "JOIN shop_category ON shop_category.id = shop_product.category_id "
+            "LEFT JOIN shop_productinfo ON shop_productinfo.product_id = shop_product.id "
+            "LEFT JOIN shop_productparameter ON shop_productparameter.product_info_id = shop_productinfo.id "
+            "GROUP BY shop_product.id, shop_category.name) AS document WHERE shop_product.id = document.id"
+        )
+        return
+    Product = apps.get_model('shop', 'Product')
+    ProductParameter = apps.get_model('shop', 'ProductParameter')
+    ProductSearchTerm = apps.get_model('shop', 'ProductSearchTerm')
+    weights = {}
+    for pk, name, category in Product.objects.values_list('id', 'name', 'category__name'):
+        for text, weight in ((name, NAME_WEIGHT), (category, CATEGORY_WEIGHT)):
+            for term in tokenize(text):
+                weights[(pk, term)] = max(weights.get((pk, term), 0), weight)
+    for pk, value in ProductParameter.objects.values_list('product_info__product_id', 'value'):
+        for term in tokenize(value):
+            weights[(pk, term)] = max(weights.get((pk, term), 0), PARAMETER_WEIGHT)
+    ProductSearchTerm.objects.bulk_create([
+        ProductSearchTerm(product_id=pk, term=term, weight=weight) for (pk, term), weight in weights.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_facetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, verbose_name='Слово')),
+                ('weight', models.PositiveSmallIntegerField(verbose_name='Вес')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='shop.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Слово поиска',
+                'verbose_name_plural': 'Обратный индекс поиска',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productsearchterm',
+            index=models.Index(fields=['term', 'product'], name='productsearchterm_term_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
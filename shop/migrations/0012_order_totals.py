@@ -0,0 +1,46 @@
+# Generated by Django 3.1.8 on 2026-10-17 21:09
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    # Цены старых заказов не сохранились, берётся текущая цена предложения
+    ProductInfo = apps.get_model('shop', 'ProductInfo')
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    OrderItem.objects.update(
+        price=Subquery(ProductInfo.objects.filter(pk=OuterRef('product_info_id')).values('price')[:1]))
+    positions = OrderItem.objects.filter(order=OuterRef('pk')).values('order')
+    Order.objects.update(
+        total_sum=Coalesce(Subquery(positions.annotate(total=Sum(F('price') * F('quantity'))).values('total')), 0),
+        items_count=Coalesce(Subquery(positions.annotate(total=Sum('quantity')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.IntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_sum',
+            field=models.IntegerField(default=0, verbose_name='Сумма заказа'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.IntegerField(default=0, verbose_name='Цена на момент заказа'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
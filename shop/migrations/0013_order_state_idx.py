@@ -0,0 +1,17 @@
+# Generated by Django 3.1.8 on 2026-10-17 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_order_totals'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['state', 'id'], name='order_state_idx'),
+        ),
+    ]
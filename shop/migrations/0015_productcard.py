@@ -0,0 +1,26 @@
+# Generated by Django 3.1.8 on 2026-10-17 21:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='shop.product', verbose_name='Продукт')),
+                ('data', models.JSONField(verbose_name='Карточка')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'Карточка продукта',
+                'verbose_name_plural': 'Карточки продуктов',
+            },
+        ),
+    ]
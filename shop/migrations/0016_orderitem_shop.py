@@ -0,0 +1,17 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0015_productcard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='shop.shop', verbose_name='Магазин'),
+        ),
+    ]
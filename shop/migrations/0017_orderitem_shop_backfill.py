@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.db.models import Max, Min, OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def fill_shop(apps, schema_editor):
+    # Каждая пачка - отдельная короткая транзакция: большая таблица не блокируется целиком, а после UPDATE
+    # в той же транзакции PostgreSQL не дал бы сделать ALTER TABLE (pending trigger events)
+    OrderItem = apps.get_model("shop", "OrderItem")
+    ProductInfo = apps.get_model("shop", "ProductInfo")
+    empty = OrderItem.objects.filter(shop__isnull=True)
+    bounds = empty.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["first"] is None:
+        return
+    shop = Subquery(ProductInfo.objects.filter(pk=OuterRef("product_info_id")).values("shop_id")[:1])
+    for start in range(bounds["first"], bounds["last"] + 1, BATCH_SIZE):
+        empty.filter(id__gte=start, id__lt=start + BATCH_SIZE).update(shop_id=shop)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('shop', '0016_orderitem_shop'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_shop, migrations.RunPython.noop),
+    ]
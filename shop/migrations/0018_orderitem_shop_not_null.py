@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_orderitem_shop_backfill'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderitem',
+            name='shop',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='shop.shop', verbose_name='Магазин'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['shop', 'order'], name='orderitem_shop_order_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.8 on 2026-10-17 21:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_orderitem_shop_not_null'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEmail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.TextField(verbose_name='Тема')),
+                ('body', models.TextField(verbose_name='Текст')),
+                ('html_body', models.TextField(blank=True, null=True, verbose_name='HTML-версия')),
+                ('from_email', models.CharField(max_length=254, verbose_name='Отправитель')),
+                ('to', models.JSONField(default=list, verbose_name='Кому')),
+                ('cc', models.JSONField(default=list, verbose_name='Копия')),
+                ('bcc', models.JSONField(default=list, verbose_name='Скрытая копия')),
+                ('reply_to', models.JSONField(default=list, verbose_name='Ответить')),
+                ('headers', models.JSONField(default=dict, verbose_name='Заголовки')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Не отправлено')], default='pending', max_length=20, verbose_name='Статус')),
+                ('attempts', models.IntegerField(default=0, verbose_name='Попыток отправки')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата отправки')),
+            ],
+            options={
+                'verbose_name': 'Письмо',
+                'verbose_name_plural': 'Очередь писем',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxemail',
+            index=models.Index(fields=['state', 'next_attempt_at'], name='outboxemail_due_idx'),
+        ),
+    ]
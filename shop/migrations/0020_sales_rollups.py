@@ -0,0 +1,57 @@
+# Generated by Django 3.1.8 on 2026-10-17 21:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_outboxemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopSalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('units', models.IntegerField(default=0, verbose_name='Продано товаров')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='Выручка')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shop_sales_rollups', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Продажи магазина за день',
+                'verbose_name_plural': 'Продажи магазинов по дням',
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('units', models.IntegerField(default=0, verbose_name='Продано товаров')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='Выручка')),
+                ('orders', models.IntegerField(default=0, verbose_name='Заказов с продуктом')),
+                ('product_info', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='shop.productinfo', verbose_name='Информация о продукте')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='shop.shop', verbose_name='Магазин')),
+            ],
+            options={
+                'verbose_name': 'Продажи продукта за день',
+                'verbose_name_plural': 'Продажи продуктов по дням',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shopsalesrollup',
+            constraint=models.UniqueConstraint(fields=('shop', 'day'), name='shopsalesrollup_unique_day'),
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['shop', 'day'], name='salesrollup_shop_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='salesrollup',
+            constraint=models.UniqueConstraint(fields=('product_info', 'day'), name='salesrollup_unique_day'),
+        ),
+    ]
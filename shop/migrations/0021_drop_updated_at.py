@@ -0,0 +1,37 @@
+# Generated by Django 3.1.8 on 2026-10-17 22:37
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0020_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='category',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='parameter',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='product',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='productcard',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='productinfo',
+            name='updated_at',
+        ),
+        migrations.RemoveField(
+            model_name='shop',
+            name='updated_at',
+        ),
+    ]
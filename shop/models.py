@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -20,6 +22,27 @@ STATE_CHOICES = (
 )
 
 
+IMPORT_MODE_CHOICES = (
+    ('create', 'Создать все продукты заново'),
+    ('sync', 'Синхронизировать с каталогом магазина'),
+)
+
+
+JOB_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершён'),
+    ('failed', 'Ошибка'),
+)
+
+
+OUTBOX_STATE_CHOICES = (
+    ('pending', 'В очереди'),
+    ('sent', 'Отправлено'),
+    ('failed', 'Не отправлено'),
+)
+
+
 class User(AbstractUser):
     """Модель пользователя"""
 
@@ -74,6 +97,9 @@ class Shop(models.Model):
     class Meta:
         verbose_name = "Магазин"
         verbose_name_plural = "Список магазинов"
+        constraints = [
+            models.UniqueConstraint(fields=["user"], name="shop_unique_user"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -93,6 +119,9 @@ class Category(models.Model):
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
+        constraints = [
+            models.UniqueConstraint(fields=["name"], name="category_unique_name"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -109,10 +138,15 @@ class Product(models.Model):
         blank=True,
         on_delete=models.CASCADE
     )
+    # Заполняется только на PostgreSQL, GIN-индексы по нему создаются миграцией
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         verbose_name = "Продукт"
         verbose_name_plural = "Список продуктов"
+        indexes = [
+            models.Index(fields=["name"], name="product_name_idx"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -137,14 +171,16 @@ class ProductInfo(models.Model):
     quantity = models.IntegerField(verbose_name="Количество в наличии")
     price = models.IntegerField(verbose_name="Цена")
     price_rrc = models.IntegerField(verbose_name="Рекомендованная цена")
+    external_id = models.CharField(verbose_name="Ключ в файле магазина", max_length=255, blank=True, null=True)
 
     class Meta:
         verbose_name = "Информация о продукте"
         verbose_name_plural = "Список информаций о продуктах"
-
-    # @property
-    # def total_sum(self):
-    #     self.aggregate(total=Sum("price_rrc"))
+        indexes = [
+            models.Index(fields=["shop", "external_id"]),
+            models.Index(fields=["price", "id"]),
+            models.Index(fields=["shop", "price"], name="productinfo_shop_price_idx"),
+        ]
 
     def __str__(self):
         return f"{self.product}"
@@ -158,6 +194,9 @@ class Parameter(models.Model):
     class Meta:
         verbose_name = "Параметры"
         verbose_name_plural = "Список параметров"
+        constraints = [
+            models.UniqueConstraint(fields=["name"], name="parameter_unique_name"),
+        ]
 
     def __str__(self):
         return f"{self.name}"
@@ -184,6 +223,81 @@ class ProductParameter(models.Model):
     class Meta:
         verbose_name = "Параметр продукта"
         verbose_name_plural = "Список параметров продукта"
+        indexes = [
+            models.Index(fields=["parameter", "value"], name="productparameter_value_idx"),
+        ]
+
+
+class ProductSearchTerm(models.Model):
+    """Модель обратного индекса поиска для БД без полнотекстового поиска"""
+
+    term = models.CharField(verbose_name="Слово", max_length=100)
+    product = models.ForeignKey(
+        Product,
+        verbose_name="Продукт",
+        related_name="search_terms",
+        on_delete=models.CASCADE
+    )
+    weight = models.PositiveSmallIntegerField(verbose_name="Вес")
+
+    class Meta:
+        verbose_name = "Слово поиска"
+        verbose_name_plural = "Обратный индекс поиска"
+        indexes = [
+            models.Index(fields=["term", "product"], name="productsearchterm_term_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.term}"
+
+
+class ProductCard(models.Model):
+    """Готовый ответ ProductSerializer по продукту, чтобы чтение каталога не собирало шесть связей"""
+
+    product = models.OneToOneField(
+        Product,
+        verbose_name="Продукт",
+        related_name="card",
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    data = models.JSONField("Карточка")
+
+    class Meta:
+        verbose_name = "Карточка продукта"
+        verbose_name_plural = "Карточки продуктов"
+
+    def __str__(self):
+        return f"{self.product_id}"
+
+
+class FacetCount(models.Model):
+    """Модель количества предложений с значением параметра в категории"""
+
+    category = models.ForeignKey(
+        Category,
+        verbose_name="Категория",
+        related_name="facet_counts",
+        on_delete=models.CASCADE
+    )
+    parameter = models.ForeignKey(
+        Parameter,
+        verbose_name="Параметр",
+        related_name="facet_counts",
+        on_delete=models.CASCADE
+    )
+    value = models.CharField(verbose_name="Значение", max_length=100)
+    count = models.IntegerField(verbose_name="Количество", default=0)
+
+    class Meta:
+        verbose_name = "Счётчик фильтра"
+        verbose_name_plural = "Счётчики фильтров"
+        constraints = [
+            models.UniqueConstraint(fields=["category", "parameter", "value"], name="facetcount_unique_value"),
+        ]
+
+    def __str__(self):
+        return f"{self.parameter}: {self.value}"
 
 
 class Contacts(models.Model):
@@ -227,18 +341,23 @@ class Order(models.Model):
         related_name="order",
         on_delete=models.CASCADE
     )
+    # Итоги считаются один раз при создании заказа по ценам на момент покупки
+    total_sum = models.IntegerField("Сумма заказа", default=0)
+    items_count = models.IntegerField("Количество товаров", default=0)
 
     class Meta:
         verbose_name = "Заказы"
         verbose_name_plural = "Список заказов"
+        indexes = [
+            models.Index(fields=["created_date", "id"]),
+            models.Index(fields=["user", "created_date", "state"], name="order_user_date_state_idx"),
+            # Фильтр по статусу в админке, список идёт по убыванию id
+            models.Index(fields=["state", "id"], name="order_state_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user}"
 
-    # @property
-    # def sum(self):
-    #     return 10
-
 
 class OrderItem(models.Model):
     """Модель позиции заказа"""
@@ -255,11 +374,142 @@ class OrderItem(models.Model):
         related_name="order_item",
         on_delete=models.CASCADE
     )
+    # Копия product_info.shop: заказы продавца выбираются по индексу без JOIN с информацией о продукте
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="order_items",
+        on_delete=models.CASCADE
+    )
     quantity = models.IntegerField("Количество товара")
+    price = models.IntegerField("Цена на момент заказа")
 
     class Meta:
         verbose_name = "Позиция заказа"
         verbose_name_plural = "Список позиций заказов"
+        indexes = [
+            models.Index(fields=["shop", "order"], name="orderitem_shop_order_idx"),
+        ]
 
     def __str__(self):
         return f"{self.quantity}"
+
+
+class SalesRollup(models.Model):
+    """Модель итогов продаж предложения за день, без отменённых заказов, см. shop.rollups"""
+
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="sales_rollups",
+        on_delete=models.CASCADE
+    )
+    product_info = models.ForeignKey(
+        ProductInfo,
+        verbose_name="Информация о продукте",
+        related_name="sales_rollups",
+        on_delete=models.CASCADE
+    )
+    day = models.DateField("День")
+    units = models.IntegerField("Продано товаров", default=0)
+    revenue = models.BigIntegerField("Выручка", default=0)
+    orders = models.IntegerField("Заказов с продуктом", default=0)
+
+    class Meta:
+        verbose_name = "Продажи продукта за день"
+        verbose_name_plural = "Продажи продуктов по дням"
+        constraints = [
+            models.UniqueConstraint(fields=["product_info", "day"], name="salesrollup_unique_day"),
+        ]
+        indexes = [
+            models.Index(fields=["shop", "day"], name="salesrollup_shop_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_info} - {self.day}"
+
+
+class ShopSalesRollup(models.Model):
+    """Модель итогов продаж магазина за день: число заказов из итогов продуктов не сложить, заказ в них повторяется"""
+
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="shop_sales_rollups",
+        on_delete=models.CASCADE
+    )
+    day = models.DateField("День")
+    units = models.IntegerField("Продано товаров", default=0)
+    revenue = models.BigIntegerField("Выручка", default=0)
+    orders = models.IntegerField("Заказов", default=0)
+
+    class Meta:
+        verbose_name = "Продажи магазина за день"
+        verbose_name_plural = "Продажи магазинов по дням"
+        constraints = [
+            models.UniqueConstraint(fields=["shop", "day"], name="shopsalesrollup_unique_day"),
+        ]
+
+    def __str__(self):
+        return f"{self.shop} - {self.day}"
+
+
+class ImportJob(models.Model):
+    """Модель задачи импорта каталога"""
+
+    shop = models.ForeignKey(
+        Shop,
+        verbose_name="Магазин",
+        related_name="import_jobs",
+        on_delete=models.CASCADE
+    )
+    url = models.URLField(verbose_name="Ссылка")
+    mode = models.CharField("Режим импорта", choices=IMPORT_MODE_CHOICES, max_length=20, default="sync")
+    retire_missing = models.BooleanField("Обнулять отсутствующие в файле", default=False)
+    state = models.CharField("Статус задачи", choices=JOB_STATE_CHOICES, max_length=20, default="pending")
+    processed = models.IntegerField("Обработано продуктов", default=0)
+    inserted = models.IntegerField("Добавлено", default=0)
+    updated = models.IntegerField("Обновлено", default=0)
+    unchanged = models.IntegerField("Без изменений", default=0)
+    removed = models.IntegerField("Снято с продажи", default=0)
+    errors = models.TextField("Ошибки", blank=True)
+    created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+    started_at = models.DateTimeField("Начало импорта", blank=True, null=True)
+    finished_at = models.DateTimeField("Конец импорта", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Задача импорта"
+        verbose_name_plural = "Список задач импорта"
+
+    def __str__(self):
+        return f"{self.shop} - {self.state}"
+
+
+class OutboxEmail(models.Model):
+    """Модель письма в очереди на отправку, см. shop.mail"""
+
+    subject = models.TextField("Тема")
+    body = models.TextField("Текст")
+    html_body = models.TextField("HTML-версия", blank=True, null=True)
+    from_email = models.CharField("Отправитель", max_length=254)
+    to = models.JSONField("Кому", default=list)
+    cc = models.JSONField("Копия", default=list)
+    bcc = models.JSONField("Скрытая копия", default=list)
+    reply_to = models.JSONField("Ответить", default=list)
+    headers = models.JSONField("Заголовки", default=dict)
+    state = models.CharField("Статус", choices=OUTBOX_STATE_CHOICES, max_length=20, default="pending")
+    attempts = models.IntegerField("Попыток отправки", default=0)
+    last_error = models.TextField("Последняя ошибка", blank=True)
+    created_at = models.DateTimeField("Дата создания", auto_now_add=True)
+    next_attempt_at = models.DateTimeField("Следующая попытка", default=timezone.now)
+    sent_at = models.DateTimeField("Дата отправки", blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Письмо"
+        verbose_name_plural = "Очередь писем"
+        indexes = [
+            models.Index(fields=["state", "next_attempt_at"], name="outboxemail_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject}"
@@ -0,0 +1,71 @@
+from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Sum
+from rest_framework import serializers
+
+from shop.models import Order, OrderItem
+from shop.rollups import apply_orders
+from shop.stock import release_stock
+from shop.utils import chunked
+
+# Из какого статуса в какие можно перевести заказ, доставленный и отменённый заказы не меняются
+ORDER_TRANSITIONS = {
+    "new": ("confirmed", "canceled"),
+    "confirmed": ("assembled", "canceled"),
+    "assembled": ("sent", "canceled"),
+    "sent": ("delivered",),
+}
+
+TRANSITION_BATCH_SIZE = 500
+
+
+def send_order_confirmation(order):
+    """Письмо покупателю о принятом заказе, с EMAIL_BACKEND по умолчанию попадает в очередь в той же транзакции"""
+    send_mail(
+        f"Заказ №{order.pk} принят",
+        f"Ваш заказ №{order.pk} принят. Товаров: {order.items_count}, сумма: {order.total_sum}.",
+        None,
+        [order.user.email],
+    )
+
+
+def seller_orders(shop):
+    """Заказы, в которых есть продукты магазина, выбираются по индексу позиций (shop, order)"""
+    return Order.objects.filter(pk__in=OrderItem.objects.filter(shop=shop).values("order_id"))
+
+
+def transition_orders(order_ids, state, shop=None):
+    """Переводит заказы в state: блокирующий SELECT и UPDATE на каждую пачку id
+
+    Если хоть один заказ не найден среди заказов магазина, содержит товары других магазинов (статус и отмена
+    относятся ко всему заказу) или не может перейти в state, ValidationError и ни один заказ не меняется.
+    При отмене товары возвращаются на склад.
+    """
+    order_ids = sorted(set(order_ids))
+    orders = Order.objects.all() if shop is None else seller_orders(shop)
+    with transaction.atomic():
+        current = {}
+        for chunk in chunked(order_ids, TRANSITION_BATCH_SIZE):
+            current.update(orders.filter(pk__in=chunk).select_for_update().values_list("id", "state"))
+        missing = [pk for pk in order_ids if pk not in current]
+        if missing:
+            raise serializers.ValidationError({"orders": f"Заказы не найдены: {missing}"})
+        if shop is not None:
+            shared = set()
+            for chunk in chunked(order_ids, TRANSITION_BATCH_SIZE):
+                shared.update(OrderItem.objects.filter(order__in=chunk).exclude(shop=shop).values_list(
+                    "order_id", flat=True))
+            if shared:
+                raise serializers.ValidationError(
+                    {"orders": f"В этих заказах есть товары других магазинов: {sorted(shared)}"})
+        rejected = [pk for pk in order_ids if state not in ORDER_TRANSITIONS.get(current[pk], ())]
+        if rejected:
+            raise serializers.ValidationError({"orders": f"Эти заказы нельзя перевести в статус {state}: {rejected}"})
+        for chunk in chunked(order_ids, TRANSITION_BATCH_SIZE):
+            Order.objects.filter(pk__in=chunk).update(state=state)
+            if state == "canceled":
+                apply_orders(chunk, -1)
+                # Остатки возвращаются по пачке, чтобы CASE в UPDATE не рос на тысячи веток
+                release_stock(dict(OrderItem.objects.filter(order__in=chunk).values_list(
+                    "product_info_id").annotate(total=Sum("quantity")).order_by()))
+    return len(order_ids)
@@ -0,0 +1,137 @@
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def keyset_filter(ordering, position, reverse=False):
+    """Условие "строка после position" для порядка ordering: (a > x) ИЛИ (a = x И b > y) ИЛИ ..."""
+    condition = Q()
+    equal = {}
+    for order, value in zip(ordering, position):
+        name = order.lstrip("-")
+        lookup = "lt" if order.startswith("-") != reverse else "gt"
+        condition |= Q(**equal, **{f"{name}__{lookup}": value})
+        equal[name] = value
+    # Условие на первое поле отдельно, чтобы индекс начинал чтение с позиции, а не с начала
+    first = ordering[0].lstrip("-")
+    bound = "lte" if ordering[0].startswith("-") != reverse else "gte"
+    return Q(**{f"{first}__{bound}": position[0]}) & condition
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация: следующая страница выбирается по индексу, без OFFSET
+
+    Курсор хранит значения всех полей порядка, а порядок всегда заканчивается на id, поэтому позиция
+    уникальна и одинаковые значения (цена, дата) не теряются и не повторяются между страницами.
+    Поля порядка не должны быть NULL.
+    """
+
+    ordering = "id"
+    page_size_query_param = "page_size"
+    max_page_size = settings.SHOP_MAX_PAGE_SIZE
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        names = [order.lstrip("-") for order in ordering]
+        if "id" not in names and "pk" not in names:
+            ordering += ("-id" if ordering[-1].startswith("-") else "id",)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if position is not None:
+            queryset = queryset.filter(keyset_filter(self.ordering, json.loads(position), reverse))
+        # Лишняя строка показывает, есть ли страница дальше
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following = self._get_position_from_instance(results[-1], self.ordering) \
+            if len(results) > self.page_size else None
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = following is not None, following
+        else:
+            self.has_next, self.next_position = following is not None, following
+            self.has_previous, self.previous_position = position is not None, position
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering) or cursor.offset:
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = [
+            instance[order.lstrip("-")] if isinstance(instance, dict) else getattr(instance, order.lstrip("-"))
+            for order in ordering
+        ]
+        return json.dumps([str(value) for value in values], separators=(",", ":"))
+
+
+def offset_page_response(request, results, offset, limit, has_next):
+    """Ответ в том же виде, что у KeysetPagination, для выдачи по ?offset=, например по релевантности"""
+    url = request.build_absolute_uri()
+    previous = None
+    if offset > limit:
+        previous = replace_query_param(url, "offset", offset - limit)
+    elif offset > 0:
+        previous = remove_query_param(url, "offset")
+    return Response({
+        "next": replace_query_param(url, "offset", offset + limit) if has_next else None,
+        "previous": previous,
+        "results": results,
+    })
+
+
+def estimate_count(queryset):
+    """Число строк по оценке планировщика PostgreSQL, для остальных БД None"""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    # psycopg2 разбирает json сам, но другой драйвер может вернуть строку
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор админки: на больших таблицах COUNT(*) заменяется оценкой планировщика
+
+    Точный COUNT выполняется, только если по оценке строк меньше SHOP_ADMIN_EXACT_COUNT_LIMIT.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < settings.SHOP_ADMIN_EXACT_COUNT_LIMIT:
+            return super().count
+        return estimate
@@ -0,0 +1,39 @@
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Даты и время отдаются DRF-кодировщику: он пишет UTC как Z, а orjson как +00:00
+ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """JSONRenderer на orjson, если он установлен, иначе обычный на stdlib json
+
+    Ответ совпадает с JSONRenderer байт в байт: тот же компактный UTF-8, U+2028 и U+2029 экранируются,
+    всё, что orjson не умеет сам, проходит через кодировщик DRF. С отступом (?indent= и browsable API),
+    при выключенных COMPACT_JSON, UNICODE_JSON или STRICT_JSON и на том, что orjson не принял
+    (например, числа больше 64 бит), рендер идёт обычным путём. Отличаются только числа с плавающей точкой
+    в экспоненциальной записи: 1e16 вместо 1e+16, в API магазина таких полей нет.
+    """
+
+    def use_orjson(self, accepted_media_type, renderer_context):
+        if orjson is None or self.encoder_class is not encoders.JSONEncoder:
+            return False
+        if not self.compact or self.ensure_ascii or not self.strict:
+            return False
+        return self.get_indent(accepted_media_type, renderer_context or {}) is None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not self.use_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
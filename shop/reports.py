@@ -0,0 +1,53 @@
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+
+from shop.models import SalesRollup, ShopSalesRollup
+
+PERIODS = {
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+    "year": TruncYear,
+}
+
+PRODUCT_REPORT_LIMIT = 100
+
+
+def filter_days(rollups, shop_ids=None, date_from=None, date_to=None):
+    if shop_ids is not None:
+        rollups = rollups.filter(shop_id__in=shop_ids)
+    if date_from is not None:
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to is not None:
+        rollups = rollups.filter(day__lte=date_to)
+    return rollups
+
+
+def revenue_report(period="month", shop_ids=None, date_from=None, date_to=None):
+    """Выручка, товары и заказы по магазинам за каждый период из дневных итогов, отменённые заказы не считаются
+
+    Запрос читает не больше одной строки на магазин и день, сколько бы заказов ни было в истории.
+    """
+    return filter_days(ShopSalesRollup.objects.all(), shop_ids, date_from, date_to).values(
+        "shop",
+        shop_name=F("shop__name"),
+        period=PERIODS[period]("day"),
+    ).annotate(
+        revenue=Sum("revenue"),
+        items=Sum("units"),
+        orders=Sum("orders"),
+    ).order_by("period", "shop")
+
+
+def product_sales_report(shop_ids=None, date_from=None, date_to=None, limit=PRODUCT_REPORT_LIMIT):
+    """Самые продаваемые по выручке предложения за период из дневных итогов"""
+    return filter_days(SalesRollup.objects.all(), shop_ids, date_from, date_to).values(
+        "product_info",
+        "shop",
+        product=F("product_info__product_id"),
+        product_name=F("product_info__product__name"),
+    ).annotate(
+        revenue=Sum("revenue"),
+        items=Sum("units"),
+        orders=Sum("orders"),
+    ).order_by("-revenue", "product_info")[:limit]
@@ -0,0 +1,93 @@
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Min, Sum
+
+from shop.models import Order, OrderItem, SalesRollup, ShopSalesRollup
+from shop.utils import chunked
+
+UPSERT_BATCH_SIZE = 500
+BACKFILL_CHUNK_SIZE = 10000
+
+TOTALS = ("units", "revenue", "orders")
+
+
+def upsert_totals(model, keys, conflict, rows):
+    """Прибавляет итоги к строкам model через INSERT ... ON CONFLICT, rows - кортежи (*keys, units, revenue, orders)"""
+    if not rows:
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = [*keys, *TOTALS]
+    updates = ", ".join(f"{name} = {table}.{name} + excluded.{name}" for name in TOTALS)
+    placeholders = f"({', '.join(['%s'] * len(columns))})"
+    with connection.cursor() as cursor:
+        for chunk in chunked(rows, UPSERT_BATCH_SIZE):
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(chunk))} "
+                f"ON CONFLICT ({', '.join(conflict)}) DO UPDATE SET {updates}",
+                [field for row in chunk for field in row]
+            )
+
+
+def apply_positions(positions, sign=1):
+    """Прибавляет к итогам позиции заказов из queryset OrderItem, sign=-1 вычитает их
+
+    Позиции сворачиваются в БД двумя GROUP BY - по предложениям и по магазинам, - в Python попадают только итоги.
+    """
+    totals = {
+        "units": Sum("quantity"),
+        "revenue": Sum(F("price") * F("quantity")),
+        "orders": Count("order_id", distinct=True),
+    }
+    # Ключи сортируются, чтобы параллельные заказы блокировали строки итогов в одном порядке
+    product_rows = sorted(
+        (row["shop_id"], row["product_info_id"], row["day"], *[sign * row[name] for name in TOTALS])
+        for row in positions.values("shop_id", "product_info_id", day=F("order__created_date")).annotate(
+            **totals).order_by()
+    )
+    shop_rows = sorted(
+        (row["shop_id"], row["day"], *[sign * row[name] for name in TOTALS])
+        for row in positions.values("shop_id", day=F("order__created_date")).annotate(**totals).order_by()
+    )
+    upsert_totals(SalesRollup, ("shop_id", "product_info_id", "day"), ("product_info_id", "day"), product_rows)
+    upsert_totals(ShopSalesRollup, ("shop_id", "day"), ("shop_id", "day"), shop_rows)
+    if sign < 0:
+        shop_ids = {row[0] for row in shop_rows}
+        SalesRollup.objects.filter(shop__in=shop_ids, orders__lte=0).delete()
+        ShopSalesRollup.objects.filter(shop__in=shop_ids, orders__lte=0).delete()
+
+
+def apply_orders(order_ids, sign=1):
+    """Учитывает созданные заказы (sign=1) или снимает отменённые (sign=-1), вызывать в транзакции заказа"""
+    apply_positions(OrderItem.objects.filter(order__in=list(order_ids)), sign)
+
+
+def add_orders(orders, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Добавляет к итогам заказы из queryset по диапазонам id, в памяти только итоги одного диапазона"""
+    bounds = orders.aggregate(first=Min("id"), last=Max("id"))
+    if bounds["first"] is None:
+        return 0
+    for start in range(bounds["first"], bounds["last"] + 1, chunk_size):
+        chunk = orders.filter(id__gte=start, id__lt=start + chunk_size)
+        apply_positions(OrderItem.objects.filter(order__in=chunk.values("id")))
+    return orders.count()
+
+
+def rebuild_rollups(since=None, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Пересчитывает итоги с дня since, без него - за всю историю, возвращает число учтённых заказов
+
+    На PostgreSQL таблицы итогов блокируются на запись до конца пересчёта: новые и отменённые в это время
+    заказы ждут его и потом учитываются поверх, а не теряются и не считаются дважды.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            tables = ", ".join(connection.ops.quote_name(model._meta.db_table)
+                               for model in (SalesRollup, ShopSalesRollup))
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {tables} IN EXCLUSIVE MODE")
+        product, shop = SalesRollup.objects.all(), ShopSalesRollup.objects.all()
+        orders = Order.objects.exclude(state="canceled")
+        if since is not None:
+            product, shop = product.filter(day__gte=since), shop.filter(day__gte=since)
+            orders = orders.filter(created_date__gte=since)
+        product.delete()
+        shop.delete()
+        return add_orders(orders, chunk_size)
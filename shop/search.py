@@ -0,0 +1,170 @@
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from shop.models import Product, ProductParameter, ProductSearchTerm
+from shop.utils import chunked, defer_on_commit
+
+TOKEN_RE = re.compile(r"\w+")
+MAX_QUERY_TERMS = 8
+INDEX_BATCH_SIZE = 1000
+
+
+def tokenize(text):
+    return [token[:100] for token in TOKEN_RE.findall(text.lower())]
+
+
+def get_query_terms(query):
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+
+
+class SearchBackend(ABC):
+    """Общий интерфейс поиска: индексирует продукты по id и возвращает id найденных по релевантности"""
+
+    @abstractmethod
+    def index_products(self, product_ids):
+        """Пересобирает записи индекса продуктов product_ids"""
+
+    @abstractmethod
+    def search(self, query, limit, offset=0):
+        """id продуктов по убыванию релевантности, окно offset, limit"""
+
+    def get_documents(self, product_ids):
+        """Тексты продуктов {id: (название, категория, [значения параметров])} двумя запросами"""
+        documents = {
+            pk: (name, category, [])
+            for pk, name, category in Product.objects.filter(pk__in=product_ids).values_list(
+                "id", "name", "category__name")
+        }
+        values = ProductParameter.objects.filter(product_info__product__in=list(documents)).values_list(
+            "product_info__product_id", "value")
+        for pk, value in values:
+            documents[pk][2].append(value)
+        return documents
+
+    def rebuild(self):
+        ids = Product.objects.order_by("id").values_list("id", flat=True)
+        for chunk in chunked(ids.iterator(chunk_size=INDEX_BATCH_SIZE), INDEX_BATCH_SIZE):
+            self.index_products(chunk)
+
+
+@lru_cache(maxsize=None)
+def has_trigram():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+class PostgresSearchBackend(SearchBackend):
+    """tsvector с весами название > категория > параметры и триграммы по названию для опечаток"""
+
+    config = "simple"
+
+    def index_products(self, product_ids):
+        documents = self.get_documents(list(product_ids))
+        if not documents:
+            return
+        # Тексты передаются списком VALUES: один UPDATE на пачку без подзапроса на каждую строку
+        rows = [(pk, name, category, " ".join(values)) for pk, (name, category, values) in documents.items()]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE shop_product SET search_vector = "
+                "setweight(to_tsvector(%s, document.name), 'A') || "
+                "setweight(to_tsvector(%s, document.category), 'B') || "
+                "setweight(to_tsvector(%s, document.parameters), 'C') "
+                f"FROM (VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))}) "
+                "AS document (id, name, category, parameters) WHERE shop_product.id = document.id",
+                [self.config, self.config, self.config, *[field for row in rows for field in row]]
+            )
+
+    def search(self, query, limit, offset=0):
+        terms = get_query_terms(query)
+        if not terms:
+            return []
+        # Слова ищутся по префиксу, чтобы поиск работал по мере набора
+        search_query = SearchQuery(" & ".join(f"{term}:*" for term in terms), config=self.config, search_type="raw")
+        rank = Coalesce(SearchRank(F("search_vector"), search_query), 0.0)
+        matches = Q(search_vector=search_query)
+        if has_trigram():
+            rank += TrigramSimilarity("name", query)
+            matches |= Q(name__trigram_similar=query)
+        products = Product.objects.filter(matches).annotate(rank=rank).order_by("-rank", "id")
+        return list(products.values_list("id", flat=True)[offset:offset + limit])
+
+
+class InvertedIndexBackend(SearchBackend):
+    """Обратный индекс слово -> продукт в таблице ProductSearchTerm, работает на любой БД"""
+
+    NAME_WEIGHT = 4
+    CATEGORY_WEIGHT = 2
+    PARAMETER_WEIGHT = 1
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        documents = self.get_documents(product_ids)
+        ProductSearchTerm.objects.filter(product_id__in=product_ids).delete()
+        terms = []
+        for pk, (name, category, values) in documents.items():
+            weights = {}
+            fields = [(name, self.NAME_WEIGHT), (category, self.CATEGORY_WEIGHT)]
+            fields.extend((value, self.PARAMETER_WEIGHT) for value in values)
+            for text, weight in fields:
+                for term in tokenize(text):
+                    weights[term] = max(weights.get(term, 0), weight)
+            terms.extend(ProductSearchTerm(term=term, product_id=pk, weight=weight) for term, weight in weights.items())
+        ProductSearchTerm.objects.bulk_create(terms, batch_size=INDEX_BATCH_SIZE)
+
+    def search(self, query, limit, offset=0):
+        terms = get_query_terms(query)
+        if not terms:
+            return []
+        # Префикс задан диапазоном term >= x AND term < x + U+FFFF, чтобы и в SQLite он шёл по индексу
+        conditions = [Q(term__gte=term, term__lt=f"{term}\uffff") for term in terms]
+        matches = Q()
+        for condition in conditions:
+            matches |= condition
+        products = ProductSearchTerm.objects.filter(matches).values("product_id").annotate(
+            score=Sum("weight"),
+            **{
+                f"matched_{number}": Max(Case(When(condition, then=Value(1)), default=Value(0),
+                                              output_field=IntegerField()))
+                for number, condition in enumerate(conditions)
+            }
+        ).filter(**{f"matched_{number}": 1 for number in range(len(conditions))}).order_by("-score", "product_id")
+        return [row["product_id"] for row in products[offset:offset + limit]]
+
+
+def get_search_backend():
+    if settings.SHOP_SEARCH_BACKEND:
+        return import_string(settings.SHOP_SEARCH_BACKEND)()
+    if connection.vendor == "postgresql":
+        return PostgresSearchBackend()
+    return InvertedIndexBackend()
+
+
+def index_products(product_ids):
+    get_search_backend().index_products(product_ids)
+
+
+def index_categories(category_ids):
+    ids = Product.objects.filter(category_id__in=category_ids).order_by("id").values_list("id", flat=True)
+    backend = get_search_backend()
+    for chunk in chunked(ids.iterator(chunk_size=INDEX_BATCH_SIZE), INDEX_BATCH_SIZE):
+        backend.index_products(chunk)
+
+
+def schedule_reindex(product_ids=(), category_ids=()):
+    """Откладывает переиндексацию до коммита, все изменения транзакции индексируются одним вызовом"""
+    if product_ids:
+        defer_on_commit(index_products, product_ids)
+    if category_ids:
+        defer_on_commit(index_categories, category_ids)
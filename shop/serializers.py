@@ -1,28 +1,67 @@
-import yaml
+from collections import Counter, OrderedDict
+
 from django.conf import settings
-from django.core import files
+from django.db import transaction
 from django.db.models import Sum
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 from rest_framework.response import Response
 
-from shop.download import get_download_link, download_file, get_filename
+from shop import workers
+from shop.cache import bump_versions
+from shop.cards import schedule_card_refresh
+from shop.facets import apply_facet_deltas
+from shop.fieldsets import FieldSpec, get_field_path
+from shop.importer import run_import_job, get_job_progress
+from shop.lookups import category_lookup, parameter_lookup
+from shop.orders import send_order_confirmation, transition_orders
+from shop.reports import PERIODS, PRODUCT_REPORT_LIMIT
+from shop.rollups import apply_orders
+from shop.search import index_products
+from shop.stock import reserve_stock
 from shop.models import User, Contacts, Category, Product, ProductInfo, Parameter, ProductParameter, Order, OrderItem, \
-    Shop
+    Shop, ImportJob, IMPORT_MODE_CHOICES, STATE_CHOICES
+
+
+class SparseFieldsMixin:
+    """Урезает поля по ?fields= и сворачивает в id связи, не указанные в ?expand="""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        spec = FieldSpec.from_request(self.context.get("request"))
+        path = get_field_path(self)
+        selected = spec.selected(path)
+        if selected is not None:
+            fields = OrderedDict((name, field) for name, field in fields.items() if name in selected)
+        for name, field in fields.items():
+            if isinstance(field, serializers.BaseSerializer) and not spec.is_expanded(path + (name,)):
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True,
+                    many=isinstance(field, serializers.ListSerializer)
+                )
+        return fields
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ("id", "username", "user_type")
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ("id", "name")
         read_only_fields = ("id",)
 
+    def validate_name(self, value):
+        # Вложенный в продукт сериализатор только ищет категорию по имени
+        if self.parent is None and Category.objects.filter(name=value.capitalize()).exclude(
+                pk=getattr(self.instance, "pk", None)).exists():
+            raise serializers.ValidationError("Такая категория уже есть!")
+        return value
+
     def create(self, validated_data):
         name = validated_data.pop("name")
         uppercase_letter = name.capitalize()
@@ -37,7 +76,7 @@ class CategorySerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class ShopSerializer(serializers.ModelSerializer):
+class ShopSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     categories = CategorySerializer(read_only=True, many=True)
 
@@ -71,11 +110,17 @@ class ContactsSerializer(serializers.ModelSerializer):
         read_only_fields = ("user",)
 
 
-class ParameterSerializer(serializers.ModelSerializer):
+class ParameterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Parameter
         fields = ("name",)
 
+    def validate_name(self, value):
+        if self.parent is None and Parameter.objects.filter(name=value.capitalize()).exclude(
+                pk=getattr(self.instance, "pk", None)).exists():
+            raise serializers.ValidationError("Такой параметр уже есть!")
+        return value
+
     def create(self, validated_data):
         name = validated_data.pop("name")
         uppercase_letter = name.capitalize()
@@ -90,7 +135,7 @@ class ParameterSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
-class ProductParameterSerializer(serializers.ModelSerializer):
+class ProductParameterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     parameter = ParameterSerializer()
 
     class Meta:
@@ -98,14 +143,10 @@ class ProductParameterSerializer(serializers.ModelSerializer):
         fields = ("parameter", "value")
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_parameter = ProductParameterSerializer(many=True)
     shop = ShopSerializer(read_only=True)
 
-    # def get_total_sum(self, obj):
-    #     return obj.total_sum
-    # total_sum = SerializerMethodField(read_only=True)
-
     class Meta:
         model = ProductInfo
         fields = ("shop", "quantity", "price", "price_rrc", "product_parameter")
@@ -124,7 +165,7 @@ class CustomProductInfoSerializer(serializers.ModelSerializer):
         return Response("Нельзя обновить информацию о продукте отдельно!", status=405)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_info = ProductInfoSerializer(many=True)
     category = CategorySerializer()
 
@@ -140,21 +181,21 @@ class ProductSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("У вас нет магазина! Сначала создайте её!")
         get_product_info = validated_data.pop("product_info")
         pop_parameters = get_product_info[0].pop("product_parameter")
-        parameters_list = []
-        for parameter in pop_parameters:
-            get_parameter = Parameter.objects.filter(name=parameter['parameter']["name"]).first()
-            if not get_parameter:
-                raise serializers.ValidationError(
-                    "Такого параметра нет! Проверьте заглавные буквы! Они должны быть на вверхним регистре")
-            params_dict = {"parameter": get_parameter, "value": parameter["value"]}
-            parameters_list.append(params_dict)
+        parameters, missing = parameter_lookup.resolve(parameter["parameter"]["name"] for parameter in pop_parameters)
+        if missing:
+            raise serializers.ValidationError(
+                "Такого параметра нет! Проверьте заглавные буквы! Они должны быть на вверхним регистре")
+        parameters_list = [
+            {"parameter_id": parameters[parameter["parameter"]["name"]], "value": parameter["value"]}
+            for parameter in pop_parameters
+        ]
         validated_data.pop("user")
         get_category = validated_data.pop("category")
-        check_category = Category.objects.filter(name=get_category["name"]).first()
-        if not check_category:
+        categories, missing = category_lookup.resolve([get_category["name"]])
+        if missing:
             raise serializers.ValidationError(
                 "Такой категории нет! Проверьте заглавные буквы! Они должны быть на вверхним регистре")
-        validated_data["category"] = check_category
+        validated_data["category_id"] = categories[get_category["name"]]
         create_product = super().create(validated_data)
         data_for_create_product_info = {
             "product": create_product,
@@ -164,119 +205,158 @@ class ProductSerializer(serializers.ModelSerializer):
             "price_rrc": get_product_info[0]["price_rrc"],
         }
         create_product_info = ProductInfo.objects.create(**data_for_create_product_info)
-        for create_products_param in parameters_list:
-            ProductParameter.objects.create(
-                product_info=create_product_info,
-                parameter=create_products_param["parameter"],
-                value=create_products_param["value"]
-            )
+        ProductParameter.objects.bulk_create([
+            ProductParameter(product_info=create_product_info, **create_products_param)
+            for create_products_param in parameters_list
+        ])
+        apply_facet_deltas(Counter(
+            (create_product.category_id, parameter["parameter_id"], parameter["value"]) for parameter in parameters_list
+        ))
+        index_products([create_product.pk])
+        # Параметры создаются bulk_create без сигналов, а сигнал продукта мог сработать раньше них
+        schedule_card_refresh(product_ids=[create_product.pk])
+        bump_versions(ProductParameter)
         return create_product
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    # def get_total_order_sum(self, obj):
-    #     return obj.sum
-    #
-    # total_order_sum = SerializerMethodField(read_only=True)
 
     class Meta:
         model = OrderItem
-        fields = ("id", "product_info", "quantity",)
-        read_only_fields = ("id", )
+        fields = ("id", "product_info", "quantity", "price")
+        read_only_fields = ("id", "price")
+        extra_kwargs = {"quantity": {"min_value": 1}}
 
 
 class OrderSerializer(serializers.ModelSerializer):
-
-    # def get_total_order_sum(self, obj):
-    #     return obj.sum
-
     contacts = ContactsSerializer()
     positions = OrderItemSerializer(many=True)
-    # total_order_sum = SerializerMethodField(read_only=True)
 
     class Meta:
         model = Order
-        fields = ("id", "positions", "created_date", "state", "contacts", )
-        read_only_fields = ("id", "positions", "contacts")
+        fields = ("id", "positions", "created_date", "state", "contacts", "total_sum", "items_count")
+        read_only_fields = ("id", "positions", "contacts", "total_sum", "items_count")
 
     def create(self, validated_data):
         pop_positions = validated_data.pop("positions")
-        positions_list = []
-        for check_positions in pop_positions:
-            quantity_in_stock = check_positions['product_info']
-            if quantity_in_stock.quantity < check_positions['quantity']:
-                raise serializers.ValidationError("Количество заказанных товаров больше чем количество товаров в наличии!")
-            ready_to_create = OrderItem(product_info=check_positions['product_info'], quantity=check_positions['quantity'])
-            quantity_in_stock.quantity -= check_positions['quantity']
-            quantity_in_stock.save()
-            positions_list.append(ready_to_create)
+        quantities = Counter()
+        for position in pop_positions:
+            quantities[position["product_info"].pk] += position["quantity"]
         pop_contacts = validated_data.pop("contacts")
-        create_contacts = Contacts.objects.create(user=validated_data['user'], **pop_contacts)
-        validated_data['contacts'] = create_contacts
-        create_order = super().create(validated_data)
-        for append_order in positions_list:
-            append_order.order = create_order
-        OrderItem.objects.bulk_create(positions_list)
+        # Заказ создаётся только новым: остатки и итоги продаж меняются дальше лишь переходами статуса
+        validated_data["state"] = "new"
+        with transaction.atomic():
+            reserve_stock(quantities)
+            # Строки уже заблокированы списанием остатков, цена не изменится до конца транзакции
+            prices = dict(ProductInfo.objects.filter(pk__in=quantities).values_list("id", "price"))
+            create_contacts = Contacts.objects.create(user=validated_data['user'], **pop_contacts)
+            validated_data['contacts'] = create_contacts
+            validated_data['total_sum'] = sum(prices[pk] * quantity for pk, quantity in quantities.items())
+            validated_data['items_count'] = sum(quantities.values())
+            create_order = super().create(validated_data)
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=create_order,
+                    product_info=position["product_info"],
+                    shop_id=position["product_info"].shop_id,
+                    quantity=position["quantity"],
+                    price=prices[position["product_info"].pk]
+                )
+                for position in pop_positions
+            ])
+            apply_orders([create_order.pk])
+            send_order_confirmation(create_order)
         return create_order
 
+    def update(self, instance, validated_data):
+        state = validated_data.pop("state", instance.state)
+        with transaction.atomic():
+            order = super().update(instance, validated_data)
+            # Статус меняется теми же переходами, что и в orders/transition: отмена возвращает товары на склад
+            # и снимает заказ с итогов продаж, отменённый заказ уже не восстановить
+            if state != order.state:
+                transition_orders([order.pk], state)
+                order.refresh_from_db(fields=["state"])
+        return order
+
+
+class SellerOrderSerializer(serializers.ModelSerializer):
+    """Заказ в ленте продавца: позиции только его магазина"""
+    contacts = ContactsSerializer(read_only=True)
+    positions = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ("id", "positions", "created_date", "state", "contacts")
+
+
+class OrderTransitionSerializer(serializers.Serializer):
+    orders = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.SHOP_MAX_ORDER_TRANSITIONS
+    )
+    state = serializers.ChoiceField(choices=STATE_CHOICES)
+
+
+class RevenueReportQuerySerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=list(PERIODS), default="month")
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    shop = serializers.IntegerField(required=False)
+
+
+class ProductSalesReportQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    shop = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=PRODUCT_REPORT_LIMIT)
+
 
 class YamlSerializer(serializers.ModelSerializer):
+    mode = serializers.ChoiceField(choices=IMPORT_MODE_CHOICES, default="sync", write_only=True)
+    retire_missing = serializers.BooleanField(default=False, write_only=True)
+
     class Meta:
         model = Shop
-        fields = ("url",)
+        fields = ("url", "mode", "retire_missing")
+        extra_kwargs = {"url": {"required": True, "allow_null": False}}
 
     def create(self, validated_data):
         user = validated_data["user"]
         check_shop = Shop.objects.filter(user=user).first()
-        url = validated_data["url"]
-        get_link = get_download_link(url)
-        if not get_link:
-            raise serializers.ValidationError("По вашему Url нет никакого документа!")
-        download = download_file(get_link)
-        if not download:
-            raise serializers.ValidationError("Не удалось записать на файл")
-        filename = get_filename(get_link)
-        check_shop.url = url
-        check_shop.filename.save(f"{filename}", files.File(download))
-        with open(f"{settings.BASE_DIR}{settings.MEDIA_URL}{check_shop.filename}", encoding="utf-8") as f:
-            data = yaml.load(f, Loader=yaml.FullLoader)
-        data_for_create_product = []
-        for get_data in data:
-            ready_data = {
-                "product": get_data["name"],
-                "category": get_data["category"]["name"],
-                "info": get_data["product_info"],
-                "parameter": get_data["product_parameter"]
-            }
-            data_for_create_product.append(ready_data)
-        for create_product in data_for_create_product:
-            check_category = Category.objects.filter(name=create_product["category"]).first()
-            if not check_category:
-                raise serializers.ValidationError(f"Такой категории нет! Проверьте её на заглавные буквы!")
-            create_product["category"] = check_category
-            create = Product.objects.create(
-                name=create_product["product"],
-                category=create_product["category"]
-            )
-            create_info = ProductInfo.objects.create(
-                product=create,
-                shop=check_shop,
-                quantity=create_product["info"]["quantity"],
-                price=create_product["info"]["price"],
-                price_rrc=create_product["info"]["price"]
-            )
-            for parameter in create_product['parameter']:
-                check_param = Parameter.objects.filter(name=parameter["parameter"]["name"]).first()
-                if not check_param:
-                    raise serializers.ValidationError(f"Такого параметра нет! Проверьте её на заглавные буквы! Они "
-                                                      f"должны быть на вверхним регистре! И проверьте есть ли вообще такой "
-                                                      f"параметр!")
-                ProductParameter.objects.create(
-                    product_info=create_info,
-                    parameter=check_param,
-                    value=parameter["value"]
-                )
-        return super().data
+        if not check_shop:
+            raise serializers.ValidationError("У вас нет магазина! Сначала создайте её!")
+        job = ImportJob.objects.create(
+            shop=check_shop,
+            url=validated_data["url"],
+            mode=validated_data["mode"],
+            retire_missing=validated_data["retire_missing"]
+        )
+        workers.submit(run_import_job, job.pk)
+        return job
 
     def update(self, instance, validated_data):
         return Response("Нельзя обновить ссылку или название файла! Можно только создать!", status=405)
+
+
+class ImportJobSerializer(serializers.ModelSerializer):
+    processed = SerializerMethodField(read_only=True)
+    throughput = SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ("id", "url", "mode", "retire_missing", "state", "processed", "throughput", "inserted", "updated",
+                  "unchanged", "removed", "errors", "created_at", "started_at", "finished_at")
+        read_only_fields = fields
+
+    def get_processed(self, obj):
+        return get_job_progress(obj)
+
+    def get_throughput(self, obj):
+        if not obj.started_at:
+            return None
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return round(get_job_progress(obj) / elapsed, 2)
@@ -0,0 +1,185 @@
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from shop.authentication import schedule_token_expiry
+from shop.cache import bump_versions
+from shop.cards import schedule_card_refresh
+from shop.facets import schedule_facet_rebuild, tracking_state, parameter_facet_key, track_parameter_saved, \
+    track_parameter_deleted, track_category_change
+from shop.lookups import category_lookup, parameter_lookup
+from shop.middleware import install_query_recorder
+from shop.models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from shop.search import schedule_reindex
+
+CATALOG_MODELS = (Shop, Category, Product, ProductInfo, Parameter, ProductParameter)
+
+
+def catalog_changed(sender, **kwargs):
+    bump_versions(sender)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_saved_{model.__name__}")
+    post_delete.connect(catalog_changed, sender=model, dispatch_uid=f"catalog_deleted_{model.__name__}")
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    category_lookup.clear()
+
+
+@receiver(post_save, sender=Parameter)
+@receiver(post_delete, sender=Parameter)
+def parameter_changed(sender, **kwargs):
+    parameter_lookup.clear()
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, **kwargs):
+    instance._old_category_id = Product.objects.filter(pk=instance.pk).values_list(
+        "category_id", flat=True).first() if instance.pk else None
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, **kwargs):
+    schedule_reindex(product_ids=[instance.pk])
+    schedule_card_refresh(product_ids=[instance.pk])
+    old_category_id = getattr(instance, "_old_category_id", None)
+    if not created and old_category_id is not None:
+        track_category_change(instance.pk, old_category_id, instance.category_id)
+
+
+# Поля, которые попадают в карточки продуктов: правка остальных карточки не пересобирает
+CARD_FIELDS = {
+    User: ("username", "user_type"),
+    Shop: ("name", "user", "state"),
+    Category: ("name",),
+    Parameter: ("name",),
+}
+
+
+def card_source_saving(sender, instance, update_fields=None, **kwargs):
+    # Сохраняются только update_fields, остальные поля в памяти могут отличаться от БД
+    fields = [field for field in CARD_FIELDS[sender] if not update_fields or field in update_fields]
+    old_values = sender.objects.filter(pk=instance.pk).values_list(*fields).first() if instance.pk and fields else None
+    instance._old_card_values = dict(zip(fields, old_values or ()))
+
+
+def card_fields_changed(sender, instance):
+    return any(getattr(instance, sender._meta.get_field(field).attname) != value
+               for field, value in getattr(instance, "_old_card_values", {}).items())
+
+
+for model in CARD_FIELDS:
+    pre_save.connect(card_source_saving, sender=model, dispatch_uid=f"card_source_saving_{model.__name__}")
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, **kwargs):
+    if not created:
+        schedule_reindex(category_ids=[instance.pk])
+    if card_fields_changed(sender, instance):
+        schedule_card_refresh(category_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Shop)
+def shop_saved(sender, instance, **kwargs):
+    if card_fields_changed(sender, instance):
+        schedule_card_refresh(shop_ids=[instance.pk])
+
+
+@receiver(post_save, sender=Parameter)
+def parameter_saved(sender, instance, **kwargs):
+    if card_fields_changed(sender, instance):
+        schedule_card_refresh(parameter_ids=[instance.pk])
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver(post_delete, sender=ProductInfo)
+def product_info_changed(sender, instance, **kwargs):
+    schedule_card_refresh(product_ids=[instance.product_id])
+
+
+@receiver(post_save, sender=ProductParameter)
+@receiver(post_delete, sender=ProductParameter)
+def product_parameter_changed(sender, instance, **kwargs):
+    schedule_card_refresh(info_ids=[instance.product_info_id])
+
+
+@receiver(pre_save, sender=ProductParameter)
+def product_parameter_saving(sender, instance, **kwargs):
+    instance._old_facet_key = parameter_facet_key(instance.pk) if instance.pk else None
+
+
+@receiver(post_save, sender=ProductParameter)
+def product_parameter_saved(sender, instance, **kwargs):
+    track_parameter_saved(instance, getattr(instance, "_old_facet_key", None))
+
+
+@receiver(post_delete, sender=ProductParameter)
+def product_parameter_deleted(sender, instance, **kwargs):
+    track_parameter_deleted(instance)
+
+
+@receiver(pre_delete, sender=ProductInfo)
+def product_info_deleting(sender, instance, **kwargs):
+    # pre_delete приходит до удаления параметров каскадом, post_delete предложения - после
+    tracking_state().deleting_infos.add(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    schedule_facet_rebuild(category_ids=[instance.category_id])
+
+
+@receiver(post_delete, sender=ProductInfo)
+def product_info_deleted(sender, instance, **kwargs):
+    tracking_state().deleting_infos.discard(instance.pk)
+    # Удаление магазина уносит его предложения, но не продукты: категории ищутся уже после коммита
+    schedule_facet_rebuild(product_ids=[instance.product_id])
+
+
+@receiver(m2m_changed, sender=Category.shops.through)
+def category_shops_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action.startswith("post_"):
+        bump_versions(Category, Shop)
+    # Категории магазина лежат в карточках его продуктов; после clear связей уже не найти, поэтому pre_clear
+    if reverse:
+        shop_ids = [instance.pk]
+    elif action == "pre_clear":
+        shop_ids = list(instance.shops.values_list("id", flat=True))
+    else:
+        shop_ids = pk_set
+    if action in ("post_add", "post_remove", "pre_clear"):
+        schedule_card_refresh(shop_ids=shop_ids)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login, в ответах каталога его нет
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_versions(User)
+    if card_fields_changed(sender, instance):
+        schedule_card_refresh(user_ids=[instance.pk])
+    if not created:
+        # Смена пароля, деактивация и любые другие изменения сбрасывают закэшированные токены пользователя
+        schedule_token_expiry(user_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, **kwargs):
+    bump_versions(User)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    schedule_token_expiry(keys=[instance.key])
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_recorder(connection)
@@ -0,0 +1,42 @@
+from django.db.models import Case, F, IntegerField, Value, When
+from rest_framework import serializers
+
+from shop.cache import bump_versions
+from shop.cards import schedule_card_refresh
+from shop.models import ProductInfo
+
+
+def quantity_case(quantities):
+    return Case(
+        *[When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()],
+        output_field=IntegerField()
+    )
+
+
+def reserve_stock(quantities):
+    """Списывает остатки {id информации о продукте: количество} одним условным UPDATE
+
+    Вызывать внутри transaction.atomic: если хоть одной позиции не хватает, ValidationError
+    откатывает всю транзакцию вместе с уже списанными остатками.
+    """
+    if not quantities:
+        return
+    needed = quantity_case(quantities)
+    reserved = ProductInfo.objects.filter(
+        pk__in=sorted(quantities),
+        quantity__gte=needed
+    ).update(quantity=F("quantity") - needed)
+    if reserved != len(quantities):
+        raise serializers.ValidationError("Количество заказанных товаров больше чем количество товаров в наличии!")
+    bump_versions(ProductInfo)
+    schedule_card_refresh(info_ids=quantities)
+
+
+def release_stock(quantities):
+    """Возвращает на склад остатки {id информации о продукте: количество} одним UPDATE"""
+    if not quantities:
+        return
+    ProductInfo.objects.filter(pk__in=sorted(quantities)).update(
+        quantity=F("quantity") + quantity_case(quantities))
+    bump_versions(ProductInfo)
+    schedule_card_refresh(info_ids=quantities)
@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import json
+import os
+import smtplib
+import tempfile
+import threading
+from datetime import datetime, time, timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+from unittest import skipUnless
 
-# Create your tests here.
+import yaml
+from asgiref.sync import sync_to_async
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.serializer_helpers import ReturnList
+from rest_framework.test import APIClient
+
+from shop.asgi import StreamingASGIHandler
+from shop.cache import get_cache, get_version_cache, set_new_versions
+from shop.cards import build_cards, get_cards, refresh_cards, upsert_cards
+from shop.download import download_file
+from shop.facets import rebuild_facets
+from shop.importer import CatalogImporter, CatalogSyncer, fetch_catalog, import_catalog
+from shop.mail import deliver_outbox, to_outbox
+from shop.lookups import category_lookup, parameter_lookup
+from shop.middleware import endpoint_stats
+from shop.renderers import FastJSONRenderer
+from shop.rollups import rebuild_rollups
+from shop.serializers import ProductSerializer
+from shop.utils import defer_on_commit
+from shop.models import User, Shop, Category, Product, ProductInfo, Order, OrderItem, Parameter, ProductParameter, \
+    Contacts, OutboxEmail, SalesRollup, FacetCount, ImportJob
+
+CONTACTS = {
+    "city": "Ташкент",
+    "district": "Юнусабад",
+    "street": "Амира Темура",
+    "house": "1",
+    "building": "1",
+    "phone": "+998900000000",
+}
+
+
+def create_product_info(quantity, name="Товар"):
+    seller = User.objects.create(email=f"{name}@shop.test", username=name, user_type="Seller")
+    shop = Shop.objects.create(name=f"Магазин {name}", user=seller)
+    category = Category.objects.create(name=f"Категория {name}")
+    product = Product.objects.create(name=name, category=category)
+    return ProductInfo.objects.create(product=product, shop=shop, quantity=quantity, price=100, price_rrc=100)
+
+
+def clear_caches():
+    get_cache().clear()
+    get_version_cache().clear()
+
+
+def run_workers_inline(test):
+    """Задачи shop.workers выполняются после коммита в том же потоке: тест не гоняется с фоновым пулом"""
+    patcher = mock.patch("shop.workers.submit", side_effect=lambda func, *args: transaction.on_commit(
+        lambda: func(*args)))
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def order_payload(*positions):
+    return {
+        "positions": [{"product_info": info.pk, "quantity": quantity} for info, quantity in positions],
+        "state": "new",
+        "contacts": CONTACTS,
+    }
+
+
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        self.buyer = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        self.client = APIClient()
+        self.client.force_authenticate(self.buyer)
+
+    def test_order_reserves_stock(self):
+        info = create_product_info(quantity=5)
+        response = self.client.post("/api/v1/orders/", order_payload((info, 2), (info, 1)), format="json")
+        self.assertEqual(response.status_code, 201)
+        info.refresh_from_db()
+        self.assertEqual(info.quantity, 2)
+
+    def test_cancel_by_patch_returns_stock_and_cannot_be_undone(self):
+        info = create_product_info(quantity=5)
+        order = self.client.post("/api/v1/orders/", order_payload((info, 2)), format="json").data["id"]
+        response = self.client.patch(f"/api/v1/orders/{order}/", {"state": "canceled"}, format="json")
+        self.assertEqual((response.status_code, response.data["state"]), (200, "canceled"))
+        info.refresh_from_db()
+        self.assertEqual(info.quantity, 5)
+        self.assertFalse(SalesRollup.objects.filter(units__gt=0).exists())
+        # Восстановление отменённого заказа снова списало бы остатки мимо проверки наличия
+        response = self.client.patch(f"/api/v1/orders/{order}/", {"state": "new"}, format="json")
+        self.assertEqual(response.status_code, 400)
+        info.refresh_from_db()
+        self.assertEqual((info.quantity, Order.objects.get(pk=order).state), (5, "canceled"))
+        self.assertFalse(SalesRollup.objects.filter(units__gt=0).exists())
+
+    def test_order_is_created_new_whatever_state_is_posted(self):
+        info = create_product_info(quantity=5)
+        payload = dict(order_payload((info, 2)), state="canceled")
+        response = self.client.post("/api/v1/orders/", payload, format="json")
+        self.assertEqual((response.status_code, response.data["state"]), (201, "new"))
+        self.assertEqual(Order.objects.get(pk=response.data["id"]).state, "new")
+        rollups = list(SalesRollup.objects.values_list("product_info", "units", "orders"))
+        rebuild_rollups()
+        self.assertEqual(list(SalesRollup.objects.values_list("product_info", "units", "orders")), rollups)
+        self.assertEqual(rollups, [(info.pk, 2, 1)])
+
+    def test_order_cannot_be_deleted(self):
+        info = create_product_info(quantity=5)
+        order = self.client.post("/api/v1/orders/", order_payload((info, 2)), format="json").data["id"]
+        response = self.client.delete(f"/api/v1/orders/{order}/")
+        self.assertEqual(response.status_code, 405)
+        info.refresh_from_db()
+        self.assertEqual((info.quantity, Order.objects.get(pk=order).state), (3, "new"))
+        self.assertTrue(SalesRollup.objects.filter(product_info=info, units=2).exists())
+
+    def test_order_stores_totals_at_purchase_price(self):
+        info = create_product_info(quantity=5)
+        response = self.client.post("/api/v1/orders/", order_payload((info, 2), (info, 1)), format="json")
+        ProductInfo.objects.filter(pk=info.pk).update(price=500)
+        order = Order.objects.get(pk=response.data["id"])
+        self.assertEqual((response.data["total_sum"], response.data["items_count"]), (300, 3))
+        self.assertEqual((order.total_sum, order.items_count), (300, 3))
+        self.assertEqual(list(order.positions.values_list("price", flat=True)), [100, 100])
+
+    def test_order_is_rolled_back_when_any_position_is_short(self):
+        enough = create_product_info(quantity=5, name="Хватает")
+        short = create_product_info(quantity=1, name="Мало")
+        response = self.client.post("/api/v1/orders/", order_payload((enough, 2), (short, 3)), format="json")
+        self.assertEqual(response.status_code, 400)
+        enough.refresh_from_db()
+        short.refresh_from_db()
+        self.assertEqual((enough.quantity, short.quantity), (5, 1))
+        self.assertFalse(Order.objects.exists())
+
+
+class SellerOrderTests(TestCase):
+
+    def setUp(self):
+        buyer = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        self.client = APIClient()
+        self.client.force_authenticate(buyer)
+        self.mine = create_product_info(quantity=10, name="Мой")
+        self.other = create_product_info(quantity=10, name="Чужой")
+        self.shared = self.order((self.mine, 2), (self.other, 1))
+        self.foreign = self.order((self.other, 1))
+        self.client.force_authenticate(self.mine.shop.user)
+
+    def order(self, *positions):
+        response = self.client.post("/api/v1/orders/", order_payload(*positions), format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def transition(self, orders, state):
+        return self.client.post("/api/v1/orders/transition/", {"orders": orders, "state": state}, format="json")
+
+    def test_feed_shows_only_own_orders_and_positions(self):
+        response = self.client.get("/api/v1/orders/seller/")
+        self.assertEqual([order["id"] for order in response.data["results"]], [self.shared])
+        positions = response.data["results"][0]["positions"]
+        self.assertEqual([(item["product_info"], item["quantity"]) for item in positions], [(self.mine.pk, 2)])
+
+    def test_bulk_transition_is_validated_as_a_whole(self):
+        own = self.order((self.mine, 2))
+        self.assertEqual(self.transition([own], "confirmed").data["updated"], 1)
+        # Чужой заказ и недопустимый переход отклоняют весь запрос
+        self.assertEqual(self.transition([own, self.foreign], "assembled").status_code, 400)
+        self.assertEqual(self.transition([own], "delivered").status_code, 400)
+        self.assertEqual(Order.objects.get(pk=own).state, "confirmed")
+        self.assertEqual(self.transition([own], "canceled").status_code, 200)
+        self.mine.refresh_from_db()
+        self.assertEqual(self.mine.quantity, 8)
+
+    def test_seller_cannot_change_order_with_other_shops_items(self):
+        before = self.rollup_totals()
+        self.assertEqual(self.transition([self.shared], "canceled").status_code, 400)
+        self.assertEqual(Order.objects.get(pk=self.shared).state, "new")
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.quantity, 8)
+        self.assertEqual(self.rollup_totals(), before)
+
+    def rollup_totals(self):
+        return sorted(SalesRollup.objects.values_list("product_info_id", "units", "revenue", "orders"))
+
+    def test_sales_rollups_follow_orders_and_match_rebuild(self):
+        own = self.order((self.mine, 3))
+        self.assertEqual(self.rollup_totals(), [(self.mine.pk, 5, 500, 2), (self.other.pk, 2, 200, 2)])
+        self.transition([own], "canceled")
+        self.assertEqual(self.rollup_totals(), [(self.mine.pk, 2, 200, 1), (self.other.pk, 2, 200, 2)])
+        rows = self.client.get("/api/v1/reports/revenue/", {"period": "day"}).data
+        self.assertEqual([(row["shop"], row["revenue"], row["items"], row["orders"]) for row in rows],
+                         [(self.mine.shop_id, 200, 2, 1)])
+        top = self.client.get("/api/v1/reports/products/").data
+        self.assertEqual([(row["product_info"], row["revenue"]) for row in top], [(self.mine.pk, 200)])
+        totals = self.rollup_totals()
+        self.assertEqual(rebuild_rollups(), 2)
+        self.assertEqual(self.rollup_totals(), totals)
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.infos = [create_product_info(quantity=10, name=f"Товар {number}").pk for number in range(7)]
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.first())
+
+    def pages(self, url, params):
+        """id всех строк вперёд по next и затем назад по previous"""
+        forward, backward = [], []
+        response = self.client.get(url, params)
+        while True:
+            forward.extend(row["id"] for row in response.data["results"])
+            if response.data["next"] is None:
+                break
+            response = self.client.get(response.data["next"])
+        while response.data["previous"] is not None:
+            response = self.client.get(response.data["previous"])
+            backward[:0] = [row["id"] for row in response.data["results"]]
+        return forward, backward
+
+    def test_duplicate_ordering_values_are_paged_exactly_once(self):
+        # У всех предложений одна цена: курсор только по цене терял бы строки и не доходил до конца
+        for ordering in ("price", "-price"):
+            forward, backward = self.pages("/api/v1/product-info/", {"ordering": ordering, "page_size": 2})
+            expected = sorted(self.infos, reverse=ordering.startswith("-"))
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected[:-1])
+
+    def test_orders_with_one_date_are_paged_exactly_once(self):
+        info = ProductInfo.objects.get(pk=self.infos[0])
+        orders = [self.client.post("/api/v1/orders/", order_payload((info, 1)), format="json").data["id"]
+                  for number in range(5)]
+        forward, backward = self.pages("/api/v1/orders/", {"ordering": "created_date", "page_size": 2})
+        self.assertEqual(forward, orders)
+
+
+def catalog_item(key, name, color):
+    return {
+        "id": key,
+        "name": name,
+        "category": {"name": "Смартфоны"},
+        "product_info": {"quantity": 1, "price": 100},
+        "product_parameter": [{"parameter": {"name": "Цвет"}, "value": color}],
+    }
+
+
+@skipUnless(connection.features.can_return_rows_from_bulk_insert,
+            "Без возврата id из INSERT importer.bulk_create создаёт строки по одной")
+class ImportQueryCountTests(TestCase):
+    items = 5
+
+    def setUp(self):
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        self.keys = iter(range(1, 10 ** 6))
+        # Справочники уже в памяти процесса, как на втором и следующих импортах
+        self.queries(CatalogImporter, 1, 1)
+
+    def queries(self, importer, count, batch_size):
+        items = [catalog_item(key, f"Телефон {key}", "черный") for key, _ in zip(self.keys, range(count))]
+        with CaptureQueriesContext(connection) as queries:
+            importer(self.shop, batch_size=batch_size).run(items)
+        return len(queries)
+
+    def test_one_batch_costs_the_same_for_any_number_of_items(self):
+        for importer in (CatalogImporter, CatalogSyncer):
+            with self.subTest(importer=importer.__name__):
+                few = self.queries(importer, self.items, 10 * self.items)
+                self.assertEqual(self.queries(importer, 10 * self.items, 10 * self.items), few)
+
+    def test_each_batch_adds_the_same_number_of_queries(self):
+        for importer in (CatalogImporter, CatalogSyncer):
+            with self.subTest(importer=importer.__name__):
+                one, two, ten = (self.queries(importer, batches * self.items, self.items) for batches in (1, 2, 10))
+                self.assertEqual(ten - one, 9 * (two - one))
+
+
+class CatalogSyncTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+        ])
+        # Строка из импорта до появления external_id
+        self.legacy = ProductInfo.objects.get(external_id="1")
+        ProductInfo.objects.filter(pk=self.legacy.pk).update(external_id=None)
+
+    def test_feed_with_ids_adopts_legacy_rows_by_name(self):
+        syncer = CatalogSyncer(self.shop)
+        syncer.run([
+            catalog_item(1, "iPhone 13 Pro", "зелёный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+            catalog_item(3, "Pixel 6", "серый"),
+        ])
+        self.assertEqual((syncer.inserted, syncer.updated, syncer.unchanged), (1, 1, 1))
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), 3)
+        self.assertEqual(ProductInfo.objects.get(external_id="1").pk, self.legacy.pk)
+        self.assertEqual(self.legacy.product_parameter.get().value, "зелёный")
+
+
+class ImportJobTests(TransactionTestCase):
+
+    def setUp(self):
+        run_workers_inline(self)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = self.settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=self.seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        self.client = APIClient()
+        self.client.force_authenticate(self.seller)
+
+    def feed(self, *items):
+        """Подменяет Я.Диск: ссылка на скачивание есть, а файл - YAML из items"""
+        def download(link):
+            file = tempfile.NamedTemporaryFile()
+            file.write(yaml.safe_dump(list(items), allow_unicode=True).encode())
+            file.seek(0)
+            return file
+        patchers = [
+            mock.patch("shop.importer.get_download_link", return_value="https://downloader.test/?filename=feed.yaml"),
+            mock.patch("shop.importer.download_file", side_effect=download),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def job(self, pk, client=None):
+        response = (client or self.client).get(f"/api/v1/import-jobs/{pk}/")
+        return response.status_code, response.data
+
+    def test_job_runs_in_background_and_reports_counters(self):
+        self.feed(catalog_item(1, "iPhone 13 Pro", "черный"), catalog_item(2, "Samsung Galaxy S21", "белый"))
+        polled = []
+
+        def import_and_poll(*args, **kwargs):
+            polled.append(self.job(ImportJob.objects.get().pk)[1]["state"])
+            return import_catalog(*args, **kwargs)
+
+        with mock.patch("shop.importer.import_catalog", side_effect=import_and_poll):
+            response = self.client.post("/api/v1/create-yml/", {"url": "https://disk.yandex.ru/d/feed"})
+        self.assertEqual((response.status_code, response.data["state"]), (202, "pending"))
+        self.assertEqual(polled, ["running"])
+        status, job = self.job(response.data["id"])
+        self.assertEqual((status, job["state"], job["mode"], job["errors"]), (200, "done", "sync", ""))
+        self.assertEqual([job[field] for field in ("processed", "inserted", "updated", "unchanged", "removed")],
+                         [2, 2, 0, 0, 0])
+        self.assertIsNotNone(job["finished_at"])
+        self.assertEqual(ProductInfo.objects.filter(shop=self.shop).count(), 2)
+
+    def test_jobs_are_visible_only_to_shop_owner(self):
+        self.feed(catalog_item(1, "iPhone 13 Pro", "черный"))
+        pk = self.client.post("/api/v1/create-yml/", {"url": "https://disk.yandex.ru/d/feed"}).data["id"]
+        other = User.objects.create(email="other@shop.test", username="other", user_type="Seller")
+        Shop.objects.create(name="Другой магазин", user=other)
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.get("/api/v1/import-jobs/").data["results"], [])
+        self.assertEqual(self.job(pk, client)[0], 404)
+        self.assertEqual([job["id"] for job in self.client.get("/api/v1/import-jobs/").data["results"]], [pk])
+        client.logout()
+        self.assertEqual(client.get("/api/v1/import-jobs/").status_code, 401)
+
+    def test_invalid_feed_fails_job_without_importing(self):
+        item = catalog_item(1, "iPhone 13 Pro", "черный")
+        item["category"] = {"name": "Планшеты"}
+        self.feed(catalog_item(2, "Samsung Galaxy S21", "белый"), item)
+        pk = self.client.post("/api/v1/create-yml/", {"url": "https://disk.yandex.ru/d/feed"}).data["id"]
+        status, job = self.job(pk)
+        self.assertEqual((job["state"], job["processed"]), ("failed", 0))
+        self.assertIn("Планшеты", job["errors"])
+        self.assertFalse(ProductInfo.objects.exists())
+
+
+class NameLookupTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        category_lookup.clear()
+        parameter_lookup.clear()
+        self.category = Category.objects.create(name="Смартфоны")
+        self.parameter = Parameter.objects.create(name="Цвет")
+
+    def test_repeated_names_are_resolved_without_queries(self):
+        expected = ({"Смартфоны": self.category.pk}, set())
+        with self.assertNumQueries(1):
+            self.assertEqual(category_lookup.resolve(["Смартфоны", "Смартфоны"]), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(category_lookup.resolve(["Смартфоны"]), expected)
+
+    def test_rename_through_save_clears_lookup(self):
+        category_lookup.resolve(["Смартфоны"])
+        parameter_lookup.resolve(["Цвет"])
+        self.category.name = "Телефоны"
+        self.category.save()
+        self.parameter.name = "Оттенок"
+        self.parameter.save()
+        self.assertEqual(category_lookup.resolve(["Смартфоны", "Телефоны"]),
+                         ({"Телефоны": self.category.pk}, {"Смартфоны"}))
+        self.assertEqual(parameter_lookup.resolve(["Цвет", "Оттенок"]), ({"Оттенок": self.parameter.pk}, {"Цвет"}))
+
+    def test_version_bump_from_other_process_clears_lookup(self):
+        category_lookup.resolve(["Смартфоны"])
+        parameter_lookup.resolve(["Цвет"])
+        # UPDATE мимо save() в другом процессе: сигнала здесь нет, видна только новая версия модели
+        Category.objects.filter(pk=self.category.pk).update(name="Телефоны")
+        Parameter.objects.filter(pk=self.parameter.pk).update(name="Оттенок")
+        self.assertEqual(category_lookup.resolve(["Смартфоны"]), ({"Смартфоны": self.category.pk}, set()))
+        set_new_versions([Category, Parameter])
+        self.assertEqual(category_lookup.resolve(["Смартфоны"]), ({}, {"Смартфоны"}))
+        self.assertEqual(parameter_lookup.resolve(["Оттенок"]), ({"Оттенок": self.parameter.pk}, set()))
+
+    def test_missing_names_are_not_cached(self):
+        for attempt in range(2):
+            with self.assertNumQueries(1):
+                self.assertEqual(category_lookup.resolve(["Планшеты"]), ({}, {"Планшеты"}))
+        # bulk_create не шлёт сигналов, новая категория находится только потому, что промах не запомнен
+        Category.objects.bulk_create([Category(name="Планшеты")])
+        tablets = Category.objects.get(name="Планшеты")
+        self.assertEqual(category_lookup.resolve(["Планшеты"]), ({"Планшеты": tablets.pk}, set()))
+
+
+class FacetCountTests(TestCase):
+
+    def setUp(self):
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "черный"),
+        ])
+
+    def counts(self):
+        return sorted(FacetCount.objects.values_list("category__name", "value", "count"))
+
+    def assert_counts(self, expected):
+        self.assertEqual(self.counts(), expected)
+        # Счётчики должны совпадать с полным пересчётом
+        rebuild_facets()
+        self.assertEqual(self.counts(), expected)
+
+    def test_edits_outside_import_update_counts(self):
+        product_parameter = ProductParameter.objects.get(product_info__external_id="1")
+        product_parameter.value = "белый"
+        product_parameter.save()
+        self.assert_counts([("Смартфоны", "белый", 1), ("Смартфоны", "черный", 1)])
+        product = Product.objects.get(name="Samsung Galaxy S21")
+        product.category = Category.objects.create(name="Планшеты")
+        product.save()
+        self.assert_counts([("Планшеты", "черный", 1), ("Смартфоны", "белый", 1)])
+        product_parameter.delete()
+        self.assert_counts([("Планшеты", "черный", 1)])
+        ProductParameter.objects.create(product_info=product.product_info.get(), parameter=Parameter.objects.get(),
+                                        value="синий")
+        self.assert_counts([("Планшеты", "синий", 1), ("Планшеты", "черный", 1)])
+
+    def test_sync_import_is_not_counted_twice(self):
+        item = catalog_item(1, "iPhone 13 Pro", "черный")
+        item["product_parameter"] = []
+        CatalogSyncer(self.shop).run([item, catalog_item(2, "Samsung Galaxy S21", "черный")])
+        self.assert_counts([("Смартфоны", "черный", 1)])
+
+
+class ProductSearchTests(TestCase):
+
+    def setUp(self):
+        # В TestCase коммита нет, версии моделей не меняются, и ответы прошлых запусков остались бы в кэше
+        clear_caches()
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(seller)
+
+    def search(self, query):
+        response = self.client.get("/api/v1/products/search/", {"q": query})
+        self.assertEqual(response.status_code, 200)
+        return [product["name"] for product in response.data["results"]]
+
+    def test_search_matches_name_prefix_category_and_parameters(self):
+        self.assertEqual(self.search("iphone черн"), ["iPhone 13 Pro"])
+        self.assertEqual(self.search("смартфон"), ["iPhone 13 Pro", "Samsung Galaxy S21"])
+        self.assertEqual(self.search("galaxy черный"), [])
+
+    def test_search_pages_have_next_and_previous_links(self):
+        first = self.client.get("/api/v1/products/search/", {"q": "смартфон", "page_size": 1}).data
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).data
+        self.assertEqual([product["name"] for product in first["results"] + second["results"]],
+                         ["iPhone 13 Pro", "Samsung Galaxy S21"])
+        self.assertIsNone(second["next"])
+        self.assertEqual(self.client.get(second["previous"]).data["results"], first["results"])
+
+    def test_sync_import_reindexes_changed_products(self):
+        CatalogSyncer(self.shop).run([catalog_item(1, "iPhone 13 Pro", "зелёный")])
+        self.assertEqual(self.search("зелёный"), ["iPhone 13 Pro"])
+        self.assertEqual(self.search("черный"), [])
+
+
+class ProductCardTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны").shops.add(self.shop)
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(seller)
+
+    def serialized(self):
+        products = Product.objects.order_by("id")
+        return json.loads(json.dumps(ProductSerializer(products, many=True).data))
+
+    def test_cards_match_serializer_and_are_read_in_one_query(self):
+        self.assertEqual(list(build_cards(Product.objects.values_list("id", flat=True)).values()), self.serialized())
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/products/")
+        self.assertEqual(json.loads(response.content)["results"], self.serialized())
+        product = Product.objects.order_by("id").first()
+        response = self.client.get(f"/api/v1/products/{product.pk}/")
+        self.assertEqual(json.loads(response.content), self.serialized()[0])
+
+    def test_sync_import_refreshes_cards(self):
+        CatalogSyncer(self.shop).run([catalog_item(1, "iPhone 13 Pro", "зелёный")])
+        response = self.client.get("/api/v1/products/")
+        self.assertEqual(json.loads(response.content)["results"], self.serialized())
+        self.assertEqual(response.data["results"][0]["product_info"][0]["product_parameter"][0]["value"], "зелёный")
+
+
+class SparseFieldsTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны").shops.add(self.shop)
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(seller)
+
+    def products(self, query):
+        response = self.client.get(f"/api/v1/products/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)["results"]
+
+    def test_fields_prune_product_and_nested_objects(self):
+        products = self.products("fields=id,name,product_info.price")
+        self.assertEqual([product["name"] for product in products], ["iPhone 13 Pro", "Samsung Galaxy S21"])
+        self.assertEqual([set(product) for product in products], [{"id", "name", "product_info"}] * 2)
+        self.assertEqual([product["product_info"] for product in products], [[{"price": 100}]] * 2)
+
+    def test_expand_nested_relation_leaves_others_as_ids(self):
+        info = ProductInfo.objects.get(external_id="1")
+        product = self.products("expand=category,product_info.shop")[0]
+        self.assertEqual(product["category"], {"id": info.product.category_id, "name": "Смартфоны"})
+        offer = product["product_info"][0]
+        self.assertEqual(offer["shop"]["name"], "Магазин")
+        self.assertEqual(offer["shop"]["user"], self.shop.user_id)
+        self.assertEqual(offer["shop"]["categories"], [info.product.category_id])
+        self.assertEqual(offer["product_parameter"], [info.product_parameter.get().pk])
+        product = self.products("expand=")[0]
+        self.assertEqual((product["category"], product["product_info"]), (info.product.category_id, [info.pk]))
+
+    def test_unknown_names_are_ignored(self):
+        self.assertEqual(self.products("fields=id,price,product_info.nope"), [
+            {"id": product.pk, "product_info": [{}]} for product in Product.objects.order_by("id")
+        ])
+        products = self.products("fields=id,category&expand=nope")
+        self.assertEqual([product["category"] for product in products],
+                         list(Product.objects.order_by("id").values_list("category_id", flat=True)))
+
+    def test_expand_queries_do_not_grow_with_products(self):
+        query = "fields=id,category,product_info.shop&expand=category"
+        with CaptureQueriesContext(connection) as two:
+            self.products(query)
+        CatalogImporter(self.shop).run([catalog_item(key, f"Телефон {key}", "серый") for key in range(3, 13)])
+        clear_caches()
+        with CaptureQueriesContext(connection) as twelve:
+            self.assertEqual(len(self.products(query)), 12)
+        self.assertEqual(len(twelve), len(two))
+        # Категория приходит JOIN-ом, предложения - одним запросом, магазины свёрнуты в id из той же строки
+        self.assertEqual(len(twelve), 2)
+
+
+class CardRefreshTests(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.info = create_product_info(5)
+        refresh_cards([self.info.product_id])
+
+    def refreshed(self, action):
+        """Выполняет action и возвращает, сколько раз после коммита записывались карточки"""
+        with mock.patch("shop.cards.upsert_cards", wraps=upsert_cards) as upsert:
+            action()
+        return upsert.call_count
+
+    def card_shop(self):
+        return get_cards([self.info.product_id])[self.info.product_id]["product_info"][0]["shop"]
+
+    def listed_quantity(self, client):
+        return client.get("/api/v1/products/").data["results"][0]["product_info"][0]["quantity"]
+
+    def test_only_card_fields_refresh_cards(self):
+        seller = self.info.shop.user
+        self.assertEqual(self.refreshed(lambda: seller.save(update_fields=["last_login"])), 0)
+        self.assertEqual(self.refreshed(lambda: seller.save()), 0)
+        seller.username = "Продавец"
+        self.assertEqual(self.refreshed(lambda: seller.save()), 1)
+        self.assertEqual(self.card_shop()["user"]["username"], "Продавец")
+        shop = self.info.shop
+        shop.name = "Новое название"
+        self.assertEqual(self.refreshed(lambda: shop.save(update_fields=["state"])), 0)
+        self.assertEqual(self.refreshed(lambda: shop.save()), 1)
+        self.assertEqual(self.card_shop()["name"], "Новое название")
+
+    def test_cached_products_show_quantity_right_after_order(self):
+        buyer = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        client = APIClient()
+        client.force_authenticate(buyer)
+        self.assertEqual(self.listed_quantity(client), 5)
+        response = client.post("/api/v1/orders/", order_payload((self.info, 2)), format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.listed_quantity(client), 3)
+
+
+class ConditionalGetTests(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.info = create_product_info(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.info.shop.user)
+
+    def test_unchanged_catalog_answers_not_modified(self):
+        response = self.client.get("/api/v1/products/")
+        self.assertEqual(response.status_code, 200)
+        etag, modified = response["ETag"], response["Last-Modified"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/v1/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b""))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get("/api/v1/products/").status_code, 200)
+        response = self.client.get("/api/v1/products/", HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_evicted_responses_keep_versions(self):
+        etag = self.client.get("/api/v1/products/")["ETag"]
+        get_cache().clear()
+        response = self.client.get("/api/v1/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_product_gets_new_etag(self):
+        etag = self.client.get("/api/v1/products/")["ETag"]
+        self.info.product.name = "Новое название"
+        self.info.product.save()
+        response = self.client.get("/api/v1/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class ShopExportTests(TestCase):
+
+    def setUp(self):
+        clear_caches()
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        self.shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(self.shop).run([
+            catalog_item(1, "iPhone 13 Pro", "черный"),
+            catalog_item(2, "Samsung Galaxy S21", "белый"),
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(seller)
+
+    def export(self, export_format):
+        response = self.client.get(f"/api/v1/shops/{self.shop.pk}/export/", {"format": export_format})
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_export_round_trips_through_import(self):
+        for items in (yaml.safe_load(self.export("yaml")), map(json.loads, self.export("jsonl").splitlines())):
+            syncer = CatalogSyncer(self.shop)
+            syncer.run(items)
+            self.assertEqual((syncer.unchanged, syncer.updated, syncer.removed), (2, 0, 0))
+        self.assertEqual(self.export("csv").splitlines()[1], "1,iPhone 13 Pro,Смартфоны,1,100,100,черный")
+
+    def test_only_owner_can_export(self):
+        stranger = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        self.client.force_authenticate(stranger)
+        response = self.client.get(f"/api/v1/shops/{self.shop.pk}/export/", {"format": "csv"})
+        self.assertEqual(response.status_code, 403)
+
+
+class ShopExportAsgiTests(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        seller = User.objects.create(email="seller@shop.test", username="seller", user_type="Seller")
+        shop = Shop.objects.create(name="Магазин", user=seller)
+        Category.objects.create(name="Смартфоны")
+        Parameter.objects.create(name="Цвет")
+        CatalogImporter(shop).run([catalog_item(1, "iPhone 13 Pro", "черный")])
+        self.token = Token.objects.create(user=seller).key
+        self.path = f"/api/v1/shops/{shop.pk}/export/"
+        response = self.client.get(self.path, {"format": "csv"}, HTTP_AUTHORIZATION=f"Token {self.token}")
+        self.expected = b"".join(response.streaming_content)
+
+    async def test_async_client_streams_export(self):
+        # AsyncClient в Django 3.1 не переносит data в строку запроса GET
+        response = await AsyncClient().get(f"{self.path}?format=csv", authorization=f"Token {self.token}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await sync_to_async(b"".join)(response.streaming_content), self.expected)
+
+    async def test_asgi_handler_streams_export(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": self.path, "raw_path": self.path.encode(), "root_path": "", "query_string": b"format=csv",
+            "headers": [(b"host", b"testserver"), (b"authorization", f"Token {self.token}".encode())],
+            "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+        }
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        # ASGIHandler Django 3.1 перебирает генератор выгрузки в цикле событий и падает на запросе к БД
+        await StreamingASGIHandler()(scope, receive, send)
+        self.assertEqual(messages[0]["status"], 200)
+        self.assertEqual(b"".join(message.get("body", b"") for message in messages[1:]), self.expected)
+
+
+class QueryInstrumentationTests(TestCase):
+
+    def setUp(self):
+        endpoint_stats.clear()
+
+    def test_response_reports_queries_and_endpoint_stats(self):
+        buyer = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        client = APIClient()
+        client.force_authenticate(buyer)
+        response = client.get("/api/v1/orders/")
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="1 queries", total;dur=[\d.]+$')
+        stats, = endpoint_stats.summary()
+        self.assertEqual((stats["endpoint"], stats["requests"], stats["queries_max"]), ("GET orders-list", 1, 1))
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        admin = User.objects.create_superuser("admin", "admin@shop.test", "password")
+        self.client.force_login(admin)
+        self.parameter = Parameter.objects.create(name="Цвет")
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/admin/shop/productparameter/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_rows(self, count):
+        for number in range(count):
+            info = create_product_info(1, name=f"Товар {ProductParameter.objects.count()}")
+            ProductParameter.objects.create(product_info=info, parameter=self.parameter, value=str(number))
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.add_rows(1)
+        expected = self.changelist_queries()
+        self.add_rows(5)
+        self.assertEqual(self.changelist_queries(), expected)
+
+    def change_form_queries(self, obj):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/admin/shop/{obj._meta.model_name}/{obj.pk}/change/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "<select")
+        return len(queries)
+
+    def test_change_forms_do_not_load_related_tables(self):
+        info = create_product_info(5)
+        contacts = Contacts.objects.create(user=info.shop.user, **CONTACTS)
+        order = Order.objects.create(user=info.shop.user, contacts=contacts, state="new")
+        item = OrderItem.objects.create(order=order, product_info=info, shop=info.shop, quantity=1, price=100)
+        # Первый запрос к каждой форме прогревает кэши Django
+        for obj in (item, info):
+            self.change_form_queries(obj)
+        expected = [self.change_form_queries(obj) for obj in (item, info)]
+        self.add_rows(5)
+        self.assertEqual([self.change_form_queries(obj) for obj in (item, info)], expected)
+
+
+class AsyncReadTests(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        info = create_product_info(1)
+        self.token = Token.objects.create(user=info.shop.user).key
+        self.path = f"/api/v1/categories/{info.product.category_id}/"
+        self.expected = self.client.get(self.path, HTTP_AUTHORIZATION=f"Token {self.token}").content
+
+    async def test_asgi_response_matches_wsgi_one(self):
+        # AsyncClient в Django 3.1 принимает заголовки запроса как есть, без префикса HTTP_
+        headers = {"authorization": f"Token {self.token}"}
+        # Без кэша ответов запросы к БД идут в потоке синхронного кода и всё равно попадают в Server-Timing
+        await sync_to_async(get_cache().clear)()
+        response = await AsyncClient().get(self.path, **headers)
+        self.assertEqual((response.status_code, response.content), (200, self.expected))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        response = await AsyncClient().get(self.path, **headers, **{"if-none-match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_async_endpoint_serves_cache_hits_without_threads(self):
+        headers = {"authorization": f"Token {self.token}"}
+        path = self.path.replace("/v1/", "/v1/async/")
+        await sync_to_async(get_cache().clear)()
+        response = await AsyncClient().get(path, **headers)
+        self.assertEqual((response.status_code, response.content), (200, self.expected))
+        self.assertRegex(response["Server-Timing"], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        # Токен, версии и ответ уже в кэше: ни представление, ни middleware не переходят в поток
+        with mock.patch("shop.asgi.sync_to_async", wraps=sync_to_async) as to_thread:
+            cached = await AsyncClient().get(path, **headers)
+        self.assertEqual(to_thread.call_count, 0)
+        self.assertEqual((cached.status_code, cached.content, cached["ETag"]), (200, self.expected, response["ETag"]))
+        self.assertEqual(cached["X-Frame-Options"], "DENY")
+        response = await AsyncClient().get(path, **headers, **{"if-none-match": cached["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise smtplib.SMTPServerDisconnected("Сервер недоступен")
+
+
+class ObservingEmailBackend(BaseEmailBackend):
+    """Запоминает, открыта ли транзакция и видно ли письмо в очереди в момент отправки"""
+    observed = []
+
+    def send_messages(self, email_messages):
+        due = OutboxEmail.objects.filter(state="pending", next_attempt_at__lte=datetime.now(timezone.utc)).count()
+        self.observed.append((connection.in_atomic_block, due))
+        return len(email_messages)
+
+
+@override_settings(SHOP_OUTBOX_EMAIL_BACKEND="shop.tests.ObservingEmailBackend")
+class OutboxClaimTests(TransactionTestCase):
+
+    def test_emails_are_sent_outside_transaction_and_hidden_from_other_workers(self):
+        ObservingEmailBackend.observed = []
+        to_outbox(mail.EmailMessage("Заказ", "Текст", "shop@shop.test", ["buyer@shop.test"])).save()
+        self.assertEqual(deliver_outbox(), (1, 0))
+        self.assertEqual(ObservingEmailBackend.observed, [(False, 0)])
+        self.assertEqual(OutboxEmail.objects.get().state, "sent")
+
+
+@override_settings(
+    EMAIL_BACKEND="shop.mail.OutboxEmailBackend",
+    SHOP_OUTBOX_EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+)
+class OutboxEmailTests(TestCase):
+
+    def test_email_is_queued_and_delivered_later(self):
+        mail.send_mail("Активация", "Текст", "shop@shop.test", ["buyer@shop.test"], html_message="<p>Текст</p>")
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(OutboxEmail.objects.get().state, "pending")
+        self.assertEqual(deliver_outbox(), (1, 0))
+        self.assertEqual([(message.subject, message.to) for message in mail.outbox], [("Активация", ["buyer@shop.test"])])
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>Текст</p>", "text/html")])
+        self.assertEqual(OutboxEmail.objects.get().state, "sent")
+
+    def test_failed_delivery_is_retried_later(self):
+        mail.send_mail("Заказ", "Текст", "shop@shop.test", ["buyer@shop.test"])
+        with self.settings(SHOP_OUTBOX_EMAIL_BACKEND="shop.tests.FailingEmailBackend"), self.assertLogs("shop.mail"):
+            self.assertEqual(deliver_outbox(), (0, 1))
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.state, email.attempts, email.last_error), ("pending", 1, "Сервер недоступен"))
+        # Следующая попытка отложена, до неё письмо не отправляется
+        self.assertEqual(deliver_outbox(), (0, 0))
+        OutboxEmail.objects.update(next_attempt_at=email.created_at)
+        self.assertEqual(deliver_outbox(), (1, 0))
+
+
+class FlakyFeedHandler(BaseHTTPRequestHandler):
+    """Отдаёт content с поддержкой Range, но на первый запрос рвёт соединение на середине"""
+
+    content = b"x" * 200000
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(self.headers.get("Range"))
+        start = int(self.headers["Range"][6:-1]) if self.headers.get("Range") else 0
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Length", str(len(self.content) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(self.content) - 1}/{len(self.content)}")
+        self.end_headers()
+        if len(self.requests) == 1:
+            self.wfile.write(self.content[:len(self.content) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(self.content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(SHOP_DOWNLOAD_BACKOFF=0, SHOP_DOWNLOAD_RETRIES=3)
+class DownloadTests(TestCase):
+
+    def setUp(self):
+        FlakyFeedHandler.requests = []
+        self.server = HTTPServer(("127.0.0.1", 0), FlakyFeedHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/feed.yaml"
+
+    def test_broken_download_resumes_with_range(self):
+        file = download_file(self.url)
+        self.assertEqual(file.read(), FlakyFeedHandler.content)
+        # Второй запрос докачивает с места обрыва, а не качает заново
+        first, resumed = FlakyFeedHandler.requests
+        self.assertIsNone(first)
+        self.assertGreater(int(resumed[6:-1]), 0)
+
+    def test_retries_are_not_multiplied(self):
+        with mock.patch.object(FlakyFeedHandler, "do_GET", lambda handler: (
+                FlakyFeedHandler.requests.append(None), handler.send_error(503))):
+            self.assertFalse(download_file(self.url))
+        self.assertEqual(len(FlakyFeedHandler.requests), 4)
+
+
+    def test_fetched_feed_temp_file_is_removed(self):
+        downloads = []
+
+        def download(link):
+            downloads.append(download_file(link))
+            return downloads[-1]
+
+        shop = Shop.objects.create(name="Магазин")
+        with tempfile.TemporaryDirectory() as media, self.settings(MEDIA_ROOT=media), \
+                mock.patch("shop.importer.get_download_link", return_value=f"{self.url}?a=1&filename=feed.yaml"), \
+                mock.patch("shop.importer.download_file", side_effect=download):
+            with open(fetch_catalog(shop, "https://disk.yandex.ru/d/feed"), "rb") as saved:
+                self.assertEqual(saved.read(), FlakyFeedHandler.content)
+        self.assertTrue(downloads[0].closed)
+        self.assertFalse(os.path.exists(downloads[0].name))
+
+
+class FastJSONRendererTests(TestCase):
+
+    def test_output_matches_json_renderer(self):
+        moment = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        data = ReturnList([{
+            "name": "Строка\u2028с\u2029разделителями \"кавычки\" \\ \x01 😀",
+            "created": moment,
+            "day": moment.date(),
+            "time": time(9, 5, 1, 500000),
+            "price": Decimal("10.50"),
+            "lazy": gettext_lazy("Имя"),
+            "ids": {1, 2},
+            "nested": [None, True, 0, -1, 1.5, {"пусто": []}],
+        }], serializer=None)
+        for media_type in ("application/json", "application/json; indent=4"):
+            self.assertEqual(FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+        # orjson не принимает числа больше 64 бит, такой ответ рендерится через json
+        self.assertEqual(FastJSONRenderer().render({"big": 2 ** 70}), b'{"big":1180591620717411303424}')
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+    def test_api_responses_match_json_renderer(self):
+        info = create_product_info(quantity=5)
+        client = APIClient()
+        client.force_authenticate(info.shop.user)
+        response = client.get("/api/v1/products/")
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+
+class DeferOnCommitTests(TransactionTestCase):
+
+    def test_items_are_passed_once_after_commit_even_after_savepoint_rollback(self):
+        calls = []
+        with transaction.atomic():
+            with self.assertRaises(ValueError), transaction.atomic():
+                defer_on_commit(calls.append, [1])
+                raise ValueError
+            defer_on_commit(calls.append, [2])
+            defer_on_commit(calls.append, [3])
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, [{1, 2, 3}])
+
+
+class CachedTokenAuthenticationTests(TransactionTestCase):
+
+    def setUp(self):
+        clear_caches()
+        self.user = User.objects.create(email="buyer@shop.test", username="buyer", user_type="Buyer")
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            status = self.client.get("/api/v1/orders/").status_code
+        return status, sum("authtoken_token" in query["sql"] for query in queries)
+
+    def test_repeat_request_skips_token_query_until_invalidated(self):
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.assertEqual(self.token_queries(), (200, 0))
+        self.user.set_password("новый пароль")
+        self.user.save()
+        self.assertEqual(self.token_queries(), (200, 1))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.token_queries()[0], 401)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.token_queries()[0], 200)
+        self.token.delete()
+        self.assertEqual(self.token_queries()[0], 401)
+
+
+@skipUnless(connection.vendor == "postgresql", "Параллельные транзакции проверяются только на PostgreSQL")
+class ConcurrentStockReservationTests(TransactionTestCase):
+    buyers = 20
+    stock = 7
+
+    def test_parallel_orders_never_oversell(self):
+        info = create_product_info(quantity=self.stock)
+        buyers = [
+            User.objects.create(email=f"buyer{number}@shop.test", username=f"buyer{number}", user_type="Buyer")
+            for number in range(self.buyers)
+        ]
+        barrier = threading.Barrier(self.buyers)
+        statuses = []
+
+        def place_order(buyer):
+            client = APIClient()
+            client.force_authenticate(buyer)
+            try:
+                barrier.wait()
+                statuses.append(client.post("/api/v1/orders/", order_payload((info, 1)), format="json").status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=place_order, args=(buyer,)) for buyer in buyers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        info.refresh_from_db()
+        self.assertEqual(info.quantity, 0)
+        self.assertEqual(statuses.count(201), self.stock)
+        self.assertEqual(statuses.count(400), self.buyers - self.stock)
+        self.assertEqual(OrderItem.objects.filter(product_info=info).count(), self.stock)
@@ -0,0 +1,43 @@
+import functools
+import threading
+from itertools import islice
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+def chunked(iterable, size):
+    """Разбивает итерируемый объект на списки длиной не более size"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_pending = threading.local()
+
+
+def pending_items(using):
+    """Значения, ждущие коммита в соединении using этого потока: {функция: set}"""
+    if not hasattr(_pending, "items"):
+        _pending.items = {}
+    return _pending.items.setdefault(using, {})
+
+
+def flush_pending(func, using):
+    items = pending_items(using).pop(func, None)
+    if items:
+        func(items)
+
+
+def defer_on_commit(func, items, using=None):
+    """Копит значения за транзакцию и передаёт их в func одним вызовом после коммита
+
+    Каждый вызов регистрирует свой on_commit, но значения забирает первый сработавший, остальные пустые:
+    так вызов не теряется, если savepoint с первым из них откатили. Значения из откатанных savepoint
+    и транзакций уходят в func со следующим коммитом: все такие функции только пересчитывают данные из БД.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    pending_items(using).setdefault(func, set()).update(items)
+    transaction.on_commit(functools.partial(flush_pending, func, using), using)
@@ -0,0 +1,37 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHOP_WORKERS,
+                thread_name_prefix="shop-worker"
+            )
+    return _executor
+
+
+def run(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception("Фоновая задача %s завершилась с ошибкой", func.__name__)
+    finally:
+        connection.close()
+
+
+def submit(func, *args):
+    """Ставит задачу в локальный пул потоков после коммита текущей транзакции"""
+    transaction.on_commit(lambda: get_executor().submit(run, func, *args))